@@ -0,0 +1,225 @@
+import logging
+import queue
+import threading
+
+from config import config
+from Metrics import Metrics
+
+
+class Subscriber(threading.Thread):
+    """
+    worker for a single subscriber of the event bus, delivers queued events to its callback
+    """
+
+    def __init__(self, event, name, callback, queue_length):
+        super().__init__(name=f"Bus/{event}/{name}", daemon=True)
+
+        self.callback = callback
+        self.delivered = 0
+        self.dropped = 0
+        self.events = queue.Queue(maxsize=queue_length)
+        self.failed = 0
+
+    def notify(self, args):
+        """queue event arguments for delivery, never blocks the caller.
+        if the queue of the subscriber is full, the event is dropped.
+
+        Args:
+            args (tuple): arguments for the callback
+        """
+        try:
+            self.events.put_nowait(args)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        """run the Subscriber thread"""
+        while True:
+            args = self.events.get()
+
+            try:
+                self.callback(*args)
+                self.delivered += 1
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"{self.name}: {e}")
+
+    def getStats(self):
+        """counters of the subscriber
+
+        Returns:
+            dictionary: delivered, dropped, failed and queued events
+        """
+        return {
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "queued": self.events.qsize(),
+        }
+
+
+class LoopSubscriber(object):
+    """
+    subscriber of the event bus, delivering events as callbacks of an asyncio event loop.
+    callbacks run inside the loop and must not block.
+    """
+
+    def __init__(self, event, name, callback, queue_length, loop):
+        super().__init__()
+
+        self.callback = callback
+        self.delivered = 0
+        self.dropped = 0
+        self.failed = 0
+        self.loop = loop
+        self.name = f"Bus/{event}/{name}"
+        self.pending = 0
+        self.queue_length = queue_length
+
+    def deliver(self, args):
+        """call the callback for one queued event, runs inside the loop
+
+        Args:
+            args (tuple): arguments for the callback
+        """
+        self.pending -= 1
+
+        try:
+            self.callback(*args)
+            self.delivered += 1
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"{self.name}: {e}")
+
+    def notify(self, args):
+        """schedule event arguments for delivery, never blocks the caller.
+        if too many events are pending, the event is dropped.
+
+        Args:
+            args (tuple): arguments for the callback
+        """
+        if self.pending >= self.queue_length:
+            self.dropped += 1
+            return
+
+        self.pending += 1
+        self.loop.call_soon_threadsafe(self.deliver, args)
+
+    def start(self):
+        """nothing to start, events are delivered by the loop"""
+        pass
+
+    def getStats(self):
+        """counters of the subscriber
+
+        Returns:
+            dictionary: delivered, dropped, failed and queued events
+        """
+        return {
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "queued": self.pending,
+        }
+
+
+class Bus(object):
+    """
+    lightweight in-process event bus, publishing never blocks.
+    every subscriber gets its own bounded queue and worker thread, or a bounded
+    number of pending callbacks in the asyncio runtime.
+    """
+
+    FRAME_RECEIVED = "frame_received"
+
+    __instance = None
+    published = {}
+    # longest queue of all subscribers, events published longer ago are delivered or dropped
+    queue_length = 0
+    subscribers = {}
+
+    @staticmethod
+    def getInstance():
+        """Static access method for Bus """
+        if Bus.__instance is None:
+            Bus()
+        return Bus.__instance
+
+    def __init__(self):
+        super().__init__()
+
+        if Bus.__instance is not None:
+            raise Exception("This class is a singleton")
+        else:
+            Bus.__instance = self
+
+        logging.debug("Bus initiated")
+
+    def getStats(self):
+        """counters for all events and their subscribers
+
+        Returns:
+            dictionary: counters, ordered by event and subscriber name
+        """
+        stats = {}
+
+        for event in self.subscribers:
+            stats[event] = {
+                "published": self.published.get(event, 0),
+                "subscribers": {s: self.subscribers[event][s].getStats() for s in self.subscribers[event]},
+            }
+
+        return stats
+
+    def publish(self, event, *args):
+        """notify all subscribers of event
+
+        Args:
+            event (str): event name
+            args: arguments for the subscribers callbacks
+        """
+        self.published[event] = self.published.get(event, 0) + 1
+
+        for subscriber in self.subscribers.get(event, {}).values():
+            subscriber.notify(args)
+
+    def subscribe(self, event, name, callback, queue_length=None, loop=None):
+        """register callback for event, the callback runs in its own thread
+        or, if loop is given, as non blocking callback inside the asyncio event loop
+
+        Args:
+            event (str): event name
+            name (str): name of the subscriber, unique per event
+            callback (func): function called with the published arguments
+            queue_length (int, optional): maximum of queued events. Defaults to config["bus"]["queue_length"].
+            loop (asyncio loop, optional): event loop for delivery. Defaults to None.
+        """
+        if event not in self.subscribers:
+            self.subscribers[event] = {}
+        if name in self.subscribers[event]:
+            raise ValueError(f'subscriber "{name}" already registered for event "{event}"')
+
+        queue_length = queue_length or config["bus"]["queue_length"]
+
+        if loop:
+            subscriber = LoopSubscriber(event, name, callback, queue_length, loop)
+        else:
+            subscriber = Subscriber(event, name, callback, queue_length)
+        self.subscribers[event][name] = subscriber
+        Bus.queue_length = max(Bus.queue_length, queue_length)
+        subscriber.start()
+
+        metrics = Metrics.getInstance()
+        labels = {"event": event, "subscriber": name}
+        for counter in ("delivered", "dropped", "failed"):
+            metrics.counter(
+                f"bus_events_{counter}_total",
+                f"events {counter} by a bus subscriber",
+                labels,
+                callback=lambda counter=counter: subscriber.getStats()[counter],
+            )
+        metrics.gauge(
+            "bus_events_queued", "events queued for a bus subscriber", labels, lambda: subscriber.getStats()["queued"]
+        )
+
+        logging.debug(f"Bus: {name} subscribed to {event}")
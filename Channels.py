@@ -0,0 +1,113 @@
+import logging
+
+
+class Channel(object):
+    """
+    compiled config entry of one analogue or digital channel
+    """
+
+    __slots__ = (
+        "command",
+        "decimals",
+        "divisor",
+        "entry",
+        "immediate",
+        "index",
+        "name",
+        "node",
+        "sIndex",
+        "sNode",
+        "unit",
+    )
+
+    def __init__(self, node, index, entry, device):
+        super().__init__()
+
+        self.decimals = int(entry.get("decimals", 0))
+        self.divisor = pow(10, self.decimals)
+        self.entry = entry
+        self.immediate = entry.get("immediate")
+        self.index = index
+        self.name = entry["name"].replace(" ", "_") if "name" in entry else False
+        self.node = node
+        self.sIndex = str(index)
+        self.sNode = str(node)
+        self.unit = entry.get("unit", "")
+        # FHEM splits command lines at single semicolons
+        self.command = f"setreading {device} {self.name} ".replace(";", ";;")
+
+
+class ChannelTable(object):
+    """
+    channel configs of a source compiled into dense node x index tables, built once per
+    (re)load of the config files and never changed afterwards, so it can be swapped atomically.
+    """
+
+    NODES = 256
+    INDEXES = 33
+
+    def __init__(self, node_config, device):
+        super().__init__()
+
+        self.channels = {"analogue": [], "digital": []}
+        self.tables = {"analogue": [None] * self.NODES, "digital": [None] * self.NODES}
+
+        for (type, nodes) in node_config.items():
+            table = self.tables[type]
+
+            for (sNode, entries) in nodes.items():
+                for (sIndex, entry) in entries.items():
+                    try:
+                        (node, index) = (int(sNode), int(sIndex))
+                        if node not in range(self.NODES) or index not in range(1, self.INDEXES):
+                            raise ValueError("out of range")
+
+                        channel = Channel(node, index, entry, device)
+                    except (KeyError, TypeError, ValueError) as e:
+                        logging.error(f"ChannelTable: skipping {type} channel {sNode}/{sIndex}: {e}")
+                        continue
+
+                    if table[node] is None:
+                        table[node] = [None] * self.INDEXES
+
+                    table[node][index] = channel
+                    self.channels[type].append(channel)
+
+    def get(self, type, node, index):
+        """compiled config of a channel
+
+        Args:
+            type (str): "analogue" or "digital"
+            node (int): node number
+            index (int): index number
+
+        Returns:
+            Channel: compiled config, None for channels without config
+        """
+        try:
+            return self.tables[type][node][index]
+        except (IndexError, TypeError):
+            return None
+
+    def getNode(self, type, node):
+        """compiled configs of all indexes of a node
+
+        Args:
+            type (str): "analogue" or "digital"
+            node (int): node number
+
+        Returns:
+            list: Channel or None by index (0 is unused), None for nodes without config
+        """
+        return self.tables[type][node]
+
+    def getChannels(self, type):
+        """all configured channels of a type in the order of the config file
+
+        Args:
+            type (str): "analogue" or "digital"
+
+        Returns:
+            list: Channel instances
+        """
+        return self.channels[type]
@@ -0,0 +1,480 @@
+import logging
+import os
+import struct
+import threading
+
+from time import time
+
+#  Chunk Scheme (per channel, bit stream, MSB first):
+#  timestamps: milliseconds, first one in the chunk header, then first delta, then delta-of-delta,
+#              zigzag encoded: [0] = 0, [10|7 bits], [110|9 bits], [1110|12 bits], [1111|64 bits]
+#  analogue:   first value 16 bits, then zigzag delta: [0] = same, [10|4 bits], [110|8 bits], [111|17 bits]
+#  digital:    all 16 states of a frame as one word, first word 16 bits, then XOR: [0] = same, [1|16 bits]
+
+
+def zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+class BitWriter(object):
+    """
+    appends bits to a growing integer
+    """
+
+    __slots__ = ("bits", "length")
+
+    def __init__(self):
+        super().__init__()
+
+        self.bits = 0
+        self.length = 0
+
+    def getBytes(self):
+        """written bits, padded with zeros to full bytes
+
+        Returns:
+            bytes: bits
+        """
+        padding = -self.length % 8
+        return (self.bits << padding).to_bytes((self.length + padding) // 8, "big")
+
+    def write(self, value, length):
+        """append the lowest length bits of value
+
+        Args:
+            value (int): value
+            length (int): number of bits
+        """
+        self.bits = (self.bits << length) | (value & ((1 << length) - 1))
+        self.length += length
+
+
+class BitReader(object):
+    """
+    reads bits from bytes, written by BitWriter
+    """
+
+    __slots__ = ("bits", "length", "position")
+
+    def __init__(self, data, length):
+        super().__init__()
+
+        self.bits = int.from_bytes(data, "big") >> (len(data) * 8 - length)
+        self.length = length
+        self.position = 0
+
+    def read(self, length):
+        """read the next length bits
+
+        Args:
+            length (int): number of bits
+
+        Returns:
+            int: value
+        """
+        self.position += length
+        return (self.bits >> (self.length - self.position)) & ((1 << length) - 1)
+
+    def readPrefix(self, maximum):
+        """number of 1 bits before the next 0 bit, at most maximum
+
+        Args:
+            maximum (int): longest prefix
+
+        Returns:
+            int: number of 1 bits
+        """
+        ones = 0
+        while ones < maximum and self.read(1):
+            ones += 1
+        return ones
+
+
+class Chunk(object):
+    """
+    streaming encoder of one chunk of a channel
+    """
+
+    __slots__ = ("count", "digital", "first", "last", "last_delta", "last_value", "writer")
+
+    timestampBuckets = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12), (0b1111, 4, 64))
+    valueBuckets = ((0b10, 2, 4), (0b110, 3, 8), (0b111, 3, 17))
+
+    def __init__(self, digital):
+        super().__init__()
+
+        self.count = 0
+        self.digital = digital
+        self.first = None
+        self.last = None
+        self.last_delta = 0
+        self.last_value = 0
+        self.writer = BitWriter()
+
+    def append(self, timestamp, value):
+        """encode a sample
+
+        Args:
+            timestamp (int): milliseconds
+            value (int): 16 bit raw value or digital word
+        """
+        writer = self.writer
+
+        if self.count == 0:
+            self.first = timestamp
+            writer.write(value, 16)
+        else:
+            delta = timestamp - self.last
+            self.writeBucket(zigzag(delta - self.last_delta), self.timestampBuckets)
+            self.last_delta = delta
+
+            if self.digital:
+                xor = value ^ self.last_value
+                if xor:
+                    writer.write(1, 1)
+                    writer.write(xor, 16)
+                else:
+                    writer.write(0, 1)
+            else:
+                self.writeBucket(zigzag(value - self.last_value), self.valueBuckets)
+
+        self.count += 1
+        self.last = timestamp
+        self.last_value = value
+
+    def writeBucket(self, value, buckets):
+        """write a zigzag encoded value with the smallest matching bucket, 0 is a single bit
+
+        Args:
+            value (int): zigzag encoded value
+            buckets (tuple): (prefix, prefix length, value length) tuples
+        """
+        if value == 0:
+            self.writer.write(0, 1)
+            return
+
+        for (prefix, prefix_length, length) in buckets:
+            if value < 1 << length:
+                self.writer.write(prefix, prefix_length)
+                self.writer.write(value, length)
+                return
+
+    @staticmethod
+    def decode(data, nbits, first, count, digital):
+        """streaming decoder of a chunk
+
+        Args:
+            data (bytes): encoded chunk
+            nbits (int): number of valid bits
+            first (int): first timestamp in milliseconds
+            count (int): number of samples
+            digital (bool): digital words instead of analogue values
+
+        Yields:
+            tuple: (timestamp in milliseconds, value)
+        """
+        reader = BitReader(data, nbits)
+        timestamp = first
+        delta = 0
+        value = reader.read(16)
+
+        yield (timestamp, value)
+
+        for _ in range(count - 1):
+            prefix = reader.readPrefix(4)
+            if prefix:
+                delta += unzigzag(reader.read(Chunk.timestampBuckets[prefix - 1][2]))
+            timestamp += delta
+
+            if digital:
+                if reader.read(1):
+                    value ^= reader.read(16)
+            else:
+                prefix = reader.readPrefix(3)
+                if prefix:
+                    value += unzigzag(reader.read(Chunk.valueBuckets[prefix - 1][2]))
+
+            yield (timestamp, value)
+
+
+class ChunkStore(object):
+    """
+    compressed on-disk history of the configured channels of a source.
+    every channel has an open Chunk, sealed chunks are queued on ingest and appended to one file
+    by write(), outside of the ingest thread. save() also keeps the open chunks in a second file,
+    so a restart continues them.
+    digital channels are stored per frame (16 states), analogue channels per value.
+    """
+
+    # kind (0 analogue/1 digital), node, index (high mapping for digital), first ms, last ms, count, bits
+    headerStruct = struct.Struct("<BBBqqII")
+    # kind, node, index, first ms, last ms, last delta ms, last value, count, bits
+    openStruct = struct.Struct("<BBBqqqiII")
+
+    def __init__(self, filename, table, samples=1024, max_age=3600):
+        super().__init__()
+
+        self.chunks = {}
+        self.filename = filename
+        self.index = {}
+        self.lock = threading.Lock()
+        self.max_age = max_age * 1000
+        self.queue = []
+        self.samples = samples
+        self.stats = {"bytes": 0, "chunks": 0, "samples": 0}
+        # ChannelTable of the configured channels, replaced on config reloads
+        self.table = table
+        self.write_lock = threading.RLock()
+
+        self.readIndex()
+        self.readOpen()
+
+    def add(self, frame):
+        """encode all configured values of frame
+
+        Args:
+            frame (Frame): received frame
+        """
+        timestamp = int(frame.timestamp * 1000)
+        node = frame.getNode()
+
+        with self.lock:
+            if frame.isAnalogue():
+                channels = self.table.getNode("analogue", node)
+                if channels is None:
+                    return
+
+                for (_, index, raw, _, _) in frame.getAnalogues():
+                    if channels[index]:
+                        self.append((0, node, index), timestamp, raw)
+            else:
+                channels = self.table.getNode("digital", node)
+                mapping = 1 if frame.isMapped() else 0
+                if channels is None or not any(channels[mapping * 16 + 1 : mapping * 16 + 17]):
+                    return
+
+                rawData = frame.rawData
+                self.append((1, node, mapping), timestamp, rawData[3] << 8 | rawData[2])
+
+    def append(self, key, timestamp, value):
+        """append a sample to the open chunk of a channel, queue the chunk for write() if it is full or too old
+
+        Args:
+            key (tuple): (kind, node, index)
+            timestamp (int): milliseconds
+            value (int): raw value or digital word
+        """
+        chunk = self.chunks.get(key)
+
+        if chunk is None:
+            chunk = self.chunks[key] = Chunk(key[0] == 1)
+
+        chunk.append(timestamp, value)
+        self.stats["samples"] += 1
+
+        if chunk.count >= self.samples or timestamp - chunk.first >= self.max_age:
+            self.queue.append((key, chunk))
+            del self.chunks[key]
+
+    def getOpenFilename(self):
+        """file of the open chunks
+
+        Returns:
+            str: filename
+        """
+        return self.filename + ".open"
+
+    def getStats(self):
+        """sizes of the store
+
+        Returns:
+            dictionary: samples, sealed chunks, bytes on disc, bytes of open and queued chunks
+                        and compression ratio against 10 bytes per sample
+        """
+        with self.lock:
+            open_bytes = sum((c.writer.length + 7) // 8 for c in self.chunks.values())
+            open_bytes += sum((c.writer.length + 7) // 8 for (_, c) in self.queue)
+            total = self.stats["bytes"] + open_bytes
+
+            return {
+                **self.stats,
+                "open_bytes": open_bytes,
+                "queued": len(self.queue),
+                "ratio": round(self.stats["samples"] * 10 / total, 2) if total else 0,
+            }
+
+    def read(self, kind, node, index, start=None, end=None):
+        """streaming decode of a channel between start and end, oldest first
+
+        Args:
+            kind (int): 0 for analogue, 1 for digital words
+            node (int): node number
+            index (int): index number (high mapping for digital)
+            start (float, optional): timestamp. Defaults to None (first sample).
+            end (float, optional): timestamp. Defaults to None (last sample).
+
+        Yields:
+            tuple: (timestamp, value)
+        """
+        key = (kind, node, index)
+        start = -(1 << 62) if start is None else int(start * 1000)
+        end = 1 << 62 if end is None else int(end * 1000)
+
+        with self.lock:
+            sealed = [c for c in self.index.get(key, []) if c[1] >= start and c[0] <= end]
+            chunks = [c for (k, c) in self.queue if k == key and c.last >= start and c.first <= end]
+            chunk = self.chunks.get(key)
+            if chunk and chunk.count:
+                chunks.append(chunk)
+            current = [(c.writer.getBytes(), c.writer.length, c.first, c.count) for c in chunks]
+
+        if sealed:
+            with open(self.filename, "rb") as f:
+                for (first, _, count, nbits, offset) in sealed:
+                    f.seek(offset)
+                    yield from self.readChunk(f.read((nbits + 7) // 8), nbits, first, count, kind, start, end)
+
+        for chunk in current:
+            yield from self.readChunk(*chunk, kind, start, end)
+
+    def readChunk(self, data, nbits, first, count, kind, start, end):
+        """decode a chunk and filter by start and end
+
+        Yields:
+            tuple: (timestamp, value)
+        """
+        for (timestamp, value) in Chunk.decode(data, nbits, first, count, kind == 1):
+            if timestamp > end:
+                break
+            if timestamp >= start:
+                yield (timestamp / 1000, value)
+
+    def readIndex(self):
+        """read all chunk headers of the store file, a torn chunk at the end is cut off"""
+        if not os.path.exists(self.filename):
+            return
+
+        started = time()
+        offset = 0
+        length = self.headerStruct.size
+
+        with open(self.filename, "r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+
+            while offset + length <= size:
+                f.seek(offset)
+                (kind, node, index, first, last, count, nbits) = self.headerStruct.unpack(f.read(length))
+                nbytes = (nbits + 7) // 8
+
+                if offset + length + nbytes > size:
+                    break
+
+                self.index.setdefault((kind, node, index), []).append((first, last, count, nbits, offset + length))
+                self.stats["chunks"] += 1
+                self.stats["samples"] += count
+                offset += length + nbytes
+
+            if offset != size:
+                logging.error(f"ChunkStore: {self.filename} truncated from {size} to {offset} bytes")
+                f.truncate(offset)
+
+        self.stats["bytes"] = offset
+        logging.debug(f"ChunkStore: read {self.stats['chunks']} chunks of {self.filename} in {time() - started:.3f}s")
+
+    def readOpen(self):
+        """continue the open chunks saved by save(), chunks already in the store file are skipped"""
+        filename = self.getOpenFilename()
+
+        if not os.path.exists(filename):
+            return
+
+        with open(filename, "rb") as f:
+            data = f.read()
+
+        offset = 0
+        length = self.openStruct.size
+
+        while offset + length <= len(data):
+            (kind, node, index, first, last, last_delta, last_value, count, nbits) = self.openStruct.unpack_from(
+                data, offset
+            )
+            nbytes = (nbits + 7) // 8
+            offset += length
+
+            if offset + nbytes > len(data):
+                logging.error(f"ChunkStore: {filename} is truncated, open chunks are incomplete")
+                break
+
+            key = (kind, node, index)
+            sealed = self.index.get(key)
+
+            if count and not (sealed and first <= sealed[-1][1]):
+                chunk = self.chunks[key] = Chunk(kind == 1)
+                chunk.writer.bits = int.from_bytes(data[offset : offset + nbytes], "big") >> (-nbits % 8)
+                chunk.writer.length = nbits
+                (chunk.count, chunk.first, chunk.last) = (count, first, last)
+                (chunk.last_delta, chunk.last_value) = (last_delta, last_value)
+                self.stats["samples"] += count
+
+            offset += nbytes
+
+        logging.debug(f"ChunkStore: continued {len(self.chunks)} open chunks of {filename}")
+
+    def save(self):
+        """write the queued chunks and save the open chunks, e.g. before shutdown"""
+        with self.write_lock:
+            self.write()
+
+            with self.lock:
+                chunks = [
+                    (key, c.first, c.last, c.last_delta, c.last_value, c.count, c.writer.length, c.writer.getBytes())
+                    for (key, c) in self.chunks.items()
+                ]
+
+            filename = self.getOpenFilename()
+
+            with open(filename + ".tmp", "wb") as f:
+                for (key, *fields, data) in chunks:
+                    f.write(self.openStruct.pack(*key, *fields) + data)
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(filename + ".tmp", filename)
+
+    def write(self):
+        """append the queued chunks to the store file, they stay readable from the queue until written"""
+        with self.write_lock:
+            with self.lock:
+                queue = list(self.queue)
+
+            if not queue:
+                return
+
+            blocks = []
+            entries = []
+
+            with open(self.filename, "ab") as f:
+                offset = f.tell()
+
+                for (key, chunk) in queue:
+                    data = chunk.writer.getBytes()
+                    header = self.headerStruct.pack(*key, chunk.first, chunk.last, chunk.count, chunk.writer.length)
+                    offset += len(header)
+                    entries.append((key, (chunk.first, chunk.last, chunk.count, chunk.writer.length, offset)))
+                    blocks.append(header + data)
+                    offset += len(data)
+
+                f.write(b"".join(blocks))
+
+            with self.lock:
+                del self.queue[: len(queue)]
+
+                for (key, entry) in entries:
+                    self.index.setdefault(key, []).append(entry)
+
+                self.stats["bytes"] += sum(len(b) for b in blocks)
+                self.stats["chunks"] += len(queue)
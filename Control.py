@@ -1,19 +1,101 @@
+import asyncio
+import datetime
 import json
 import logging
 import os
 import re
+import selectors
 import socket
 import sys
 import threading
 
+from collections import deque
 from concurrent import futures
-from time import sleep
+from time import perf_counter, sleep, time
 
 import Data
+import FHEM
+import Metrics
+import Outbound
+import Replay
 import UDP_Server
 
+from Bus import Bus
 from config import config
-from Frame import Frame
+
+
+class Session(object):
+    """
+    state of a telnet session: received partial line, buffered output, last activity
+    and the filter and bounded queue of an active watch
+    """
+
+    __slots__ = (
+        "closing",
+        "conn",
+        "inbuf",
+        "last_activity",
+        "name",
+        "outbuf",
+        "output",
+        "wake",
+        "watch",
+        "watch_dropped",
+        "watch_queue",
+    )
+
+    def __init__(self, name, conn=None):
+        super().__init__()
+
+        self.closing = False
+        self.conn = conn
+        self.inbuf = bytearray()
+        self.last_activity = time()
+        self.name = name
+        self.outbuf = bytearray()
+        self.output = None
+        self.wake = None
+        self.watch = None
+        self.watch_dropped = 0
+        self.watch_queue = deque(maxlen=config["control"]["watch_queue"])
+
+    def push(self, lines):
+        """queue pushed lines of the watch, the oldest lines are dropped if the client is too slow
+
+        Args:
+            lines (list): encoded lines
+        """
+        queue = self.watch_queue
+
+        for line in lines:
+            if len(queue) == queue.maxlen:
+                self.watch_dropped += 1
+            queue.append(line)
+
+        self.wake()
+
+    def feed(self, data):
+        """add received data, complete lines are returned
+
+        Args:
+            data (bytes): received data
+
+        Raises:
+            ValueError: line too long
+
+        Returns:
+            list: commands
+        """
+        self.inbuf += data
+        self.last_activity = time()
+
+        *lines, rest = self.inbuf.split(b"\n")
+        if len(rest) > 65536:
+            raise ValueError("line too long.")
+
+        self.inbuf = rest
+
+        return [line.decode("utf-8", errors="replace").strip() for line in lines]
 
 
 class Control(threading.Thread):
@@ -22,11 +104,26 @@ class Control(threading.Thread):
     """
 
     __instance = None
+    # long forms of commands with arguments, replaced by their short form, longer prefixes first
+    aliases = (
+        ("chunks export", "ce"),
+        ("chunks stats", "cs"),
+        ("chunks", "ch"),
+        ("history as of", "ha"),
+        ("history stats", "hs"),
+        ("history", "hi"),
+        ("rollups stats", "rs"),
+        ("rollups", "ro"),
+    )
     cmds = {"send": None}
     data = None
     data_frames = None
     executor = futures.ThreadPoolExecutor(max_workers=2)
+    sessions = {}
+    command_seconds = None
+    replayer = None
     udp_server = None
+    wakeup = None
 
     @staticmethod
     def getInstance():
@@ -45,23 +142,116 @@ class Control(threading.Thread):
 
         logging.debug("Control initiated")
 
-    def initialize(self):
-        """get needed instances from local classes"""
+    def initialize(self, loop=None):
+        """get needed instances from local classes
+
+        Args:
+            loop (asyncio loop, optional): event loop of the asyncio runtime. Defaults to None (threaded).
+        """
         self.data = Data.Data.getInstance()
         self.data_frames = self.data.getFrames()
         self.udp_server = UDP_Server.UDP_Server.getInstance()
 
-    def command(self, cmd, output):
-        """command switcher
+        metrics = Metrics.Metrics.getInstance()
+        self.command_seconds = metrics.histogram("control_command_seconds", "duration of Control commands")
+        metrics.gauge("control_sessions", "open telnet sessions", callback=lambda: len(self.sessions))
+
+        if config["control"]["telnet"]:
+            Bus.getInstance().subscribe(Bus.FRAME_RECEIVED, "watch", self.pushWatch, loop=loop)
+
+    def chunks(self, data, cmd, output):
+        """queries of the compressed history, see help for the syntax.
+        the export is written chunk by chunk while decoding.
+
+        Args:
+            data (Data): Data instance of the source
+            cmd (str): command
+            output (func): function to write output to
+
+        Raises:
+            ValueError: invalid syntax
+        """
+        args = cmd.split()
+
+        try:
+            analogue = args[1] == "a"
+            node = int(args[2])
+            index = int(args[3])
+            start = self.parseTime(args[4]) if len(args) > 4 else None
+            end = self.parseTime(args[5]) if len(args) > 5 else None
+        except IndexError:
+            raise ValueError('command has wrong syntax. use e.g. "ch a 51 4 -3600" for the last hour.')
+
+        values = data.getChunkValues(node, index, start, end, analogue=analogue, digital=not analogue)
+
+        if args[0] == "ch":
+            output(json.dumps(list(values)))
+            return
+
+        lines = []
+        for (timestamp, value) in values:
+            lines.append(f"{timestamp:.3f};{value}")
+            if len(lines) == 1024:
+                output("\n".join(lines))
+                lines = []
+        output("\n".join(lines) if lines else "OK.")
+
+    def closeSession(self, session):
+        """forget the state of a closed session
+
+        Args:
+            session (str): session name
+        """
+        for data in Data.Data.getInstances().values():
+            data.removeConsumer(f"control/{session}")
+
+    def command(self, cmd, output, session="shell"):
+        """command switcher, see dispatch()
 
         Args:
             cmd (str): command to run
             output ([func): function to write output to
+            session (str, optional): session name, every session gets its own differences. Defaults to "shell".
         """
+        start = perf_counter()
+
+        try:
+            self.dispatch(cmd, output, session)
+        finally:
+            if self.command_seconds:
+                self.command_seconds.since(start)
+
+    def dispatch(self, cmd, output, session="shell"):
+        """run a command
+
+        Args:
+            cmd (str): command to run
+            output ([func): function to write output to
+            session (str): session name
+        """
+        data = self.data
+
+        if cmd.startswith("@"):
+            (source, _, cmd) = cmd[1:].partition(" ")
+            try:
+                data = Data.Data.getInstance(source)
+            except ValueError as e:
+                output(str(e))
+                return
+            cmd = cmd.strip()
+
+        for (alias, short) in self.aliases:
+            if cmd == alias or cmd.startswith(alias + " "):
+                cmd = short + cmd[len(alias) :]
+                break
+
+        data_frames = data.getFrames()
+
         if cmd in ["q", "quit"]:
             res = "quit."
             if output is print:
                 print(res)
+                Data.Data.saveAll()
                 os._exit(0)
             else:
                 output(res)
@@ -71,69 +261,383 @@ class Control(threading.Thread):
                     [
                         "Command         [long command] Description",
                         "----------------------------------------------------------------------",
+                        "  @<source> <command>\tcommand for source, e.g. \"@cmi2 a\" (default source without prefix)",
                         "  a\t\t[analogue] all analogue values (JSON)",
+                        "  ce\t\t[chunks export] compressed history as CSV, e.g. \"ce a 51 4 -86400\"",
+                        "  ch\t\t[chunks] values from the compressed history, e.g. \"ch a 51 4 -3600 now\" (JSON)",
+                        "  cs\t\t[chunks stats] size and compression ratio of the compressed history (JSON)",
                         "  d\t\t[digital] all digital values (JSON)",
                         "  ar\t\t[analogue] all analogue raw values (JSON)",
-                        "  da\t\t[diff analogue] differences of analogue values since last call (JSON)",
-                        "  dd\t\t[diff digital] differences of digital values since last call (JSON)",
+                        "  da\t\t[diff analogue] differences of analogue values since last call of this session (JSON)",
+                        "  dd\t\t[diff digital] differences of digital values since last call of this session (JSON)",
                         "  dr\t\t[digital] all digital raw values (JSON)",
                         "  f\t\t[frames] show all available frames",
+                        "  fh\t\t[fhem] FHEM connection, flush latency and batch size counters (JSON)",
                         "  fs\t\t[frames short] show all available frames, verbose off",
                         "  h\t\t[help] tshow this help",
+                        "  ha\t\t[history as of] values of all channels at a time, e.g. \"ha -3600 a\" (JSON)",
+                        "  hi\t\t[history] values between two times, e.g. \"hi a 51 4 -3600 now\" (JSON)",
+                        "  hs\t\t[history stats] count/min/max/mean between two times, e.g. \"hs a 51 4 -86400\" (JSON)",
                         "  lf\t\t[last frame):\t\tshow last frame",
                         "  lfs\t\t[last frame short):\t\tshow last frame, verbose off",
+                        "  n\t\t[notifications] notification counters (JSON)",
+                        "  o\t\t[outbound] counters of sent values and frames (JSON)",
                         "  r\t\t[restore] restore saved frames",
-                        "  s\t\t[send] send command",
+                        "  rp\t\t[replay] replay a capture into this source, e.g. \"rp log.txt 100\" (0: max), \"rp stop\"",
+                        "  ro\t\t[rollups] min/max/avg/last/count per slot, e.g. \"ro a 51 4 900 -86400\" (JSON)",
+                        "  rs\t\t[rollups stats] resolutions and size of the rollups (JSON)",
+                        "  s\t\t[send] send values, e.g. \"s a 54 15 22.3 1, a 54 16 21.5 1, d 41 3 1\"",
+                        "  src\t\t[sources] configured sources with received frames (JSON)",
+                        "  stats\t\tall metrics (JSON), \"stats prom\" in the Prometheus text format",
+                        "  u\t\t[udp] UDP receive counters (JSON)",
+                        "  unwatch\t\tstop the watch of this session",
                         "  w\t\t[write] write available frames to disc",
+                        "  watch\t\tpush frames (f) or value changes (v) as NDJSON, e.g. \"watch v a 51\" or \"watch f d\"",
                     ]
                 )
             )
-        elif len(self.data_frames) > 0:
+        elif cmd in ["fh", "fhem"]:
+            output(json.dumps(FHEM.FHEM.getInstance().getStats()))
+        elif cmd in ["o", "outbound"]:
+            output(json.dumps(Outbound.Outbound.getInstance().getStats()))
+        elif cmd.split(" ")[0] in ["rp", "replay"]:
+            try:
+                output(self.replay(data, cmd))
+            except (OSError, ValueError) as e:
+                output(e)
+        elif cmd in ["stats"]:
+            output(json.dumps(Metrics.Metrics.getInstance().getStats()))
+        elif cmd in ["stats prom"]:
+            output(Metrics.Metrics.getInstance().getExposition().rstrip("\n"))
+        elif cmd in ["n", "notifications"]:
+            output(json.dumps(Bus.getInstance().getStats()))
+        elif cmd in ["src", "sources"]:
+            output(json.dumps({s: len(d.getFrames()) for s, d in Data.Data.getInstances().items()}))
+        elif cmd in ["u", "udp"]:
+            output(json.dumps(self.udp_server.getStats()))
+        elif cmd.split(" ")[0] in ["unwatch", "watch"]:
+            telnet = self.sessions.get(session)
+
+            if not telnet:
+                output("watch is only available for telnet sessions.")
+            elif cmd == "unwatch":
+                output(f"OK. ({telnet.watch_dropped} dropped)")
+                telnet.watch = None
+                telnet.watch_dropped = 0
+                telnet.watch_queue.clear()
+            else:
+                try:
+                    telnet.watch = self.parseWatch(cmd, data.source)
+                    output("OK.")
+                except ValueError as e:
+                    output(e)
+        elif len(data_frames) > 0:
             if cmd in ["a", "analogue"]:
-                output(json.dumps(self.data.getValues(analogue=True)))
+                output(json.dumps(data.getValues(analogue=True)))
             elif cmd in ["c", "clean"]:
-                self.data.cleanFrames()
+                data.cleanFrames()
                 output("OK.")
             elif cmd in ["d", "digital"]:
-                output(json.dumps(self.data.getValues(digital=True)))
+                output(json.dumps(data.getValues(digital=True)))
             elif cmd in ["da", "diff analogue"]:
-                output(json.dumps(self.data.getDifference(analogue=True)))
+                output(json.dumps(data.getDifference(analogue=True, consumer=f"control/{session}")))
             elif cmd in ["dd", "diff digital"]:
-                output(json.dumps(self.data.getDifference(digital=True)))
+                output(json.dumps(data.getDifference(digital=True, consumer=f"control/{session}")))
             elif cmd in ["ar", "analogue raw"]:
-                output(json.dumps(self.data.getRawValues(analogue=True)))
+                output(json.dumps(data.getRawValues(analogue=True)))
             elif cmd in ["dr", "digital raw"]:
-                output(json.dumps(self.data.getRawValues(digital=True)))
+                output(json.dumps(data.getRawValues(digital=True)))
             elif cmd in ["f", "frames"]:
-                for f in reversed(self.data_frames):
+                for f in reversed(data_frames):
                     output(f.getString(verbose=True))
-                output(f"({len(self.data_frames)} frames)")
+                output(f"({len(data_frames)} frames)")
 
             elif cmd in ["fs", "frames short"]:
-                for f in reversed(self.data_frames):
+                for f in reversed(data_frames):
                     output(f.getString(verbose=False))
-                output(f"({len(self.data_frames)} frames)")
+                output(f"({len(data_frames)} frames)")
+            elif cmd.split(" ")[0] in ["ce", "ch"]:
+                try:
+                    self.chunks(data, cmd, output)
+                except ValueError as e:
+                    output(e)
+            elif cmd == "cs":
+                output(json.dumps(data.chunks.getStats() if data.chunks else {}))
+            elif cmd.split(" ")[0] in ["ha", "hi", "hs"]:
+                try:
+                    output(json.dumps(self.history(data, cmd)))
+                except ValueError as e:
+                    output(e)
             elif cmd in ["lf", "last frame"]:
-                output(f"{self.data_frames[-1].getString(verbose=True)}")
+                output(f"{data.getLastFrame().getString(verbose=True)}")
             elif cmd in ["lfs", "last frame short"]:
-                output(f"{self.data_frames[-1].getString(verbose=False)}")
+                output(f"{data.getLastFrame().getString(verbose=False)}")
             elif cmd in ["r", "restore"]:
-                self.data.restore()
+                data.restore()
                 output("OK.")
+            elif cmd.split(" ")[0] == "ro":
+                try:
+                    output(json.dumps(self.rollups(data, cmd)))
+                except ValueError as e:
+                    output(e)
+            elif cmd == "rs":
+                output(json.dumps(data.rollups.getStats() if data.rollups else {}))
             elif cmd.startswith("s ") or cmd.startswith("send "):
                 try:
-                    self.send(cmd)
+                    self.send(cmd, data.source)
                     output("OK.")
                 except ValueError as e:
                     output(e)
             elif cmd in ["w", "write"]:
-                self.data.save()
+                data.save()
                 output("OK.")
             else:
                 output("invalid command.")
         else:
             output("no frames, need to wait for new input.")
 
+    def history(self, data, cmd):
+        """history queries, see help for the syntax
+
+        Args:
+            data (Data): Data instance of the source
+            cmd (str): command
+
+        Raises:
+            ValueError: invalid syntax
+
+        Returns:
+            list/dictionary: query result
+        """
+        args = cmd.split()
+
+        try:
+            if args[0] == "ha":
+                analogue = len(args) < 3 or args[2] == "a"
+                return data.getHistoryAsOf(self.parseTime(args[1]), analogue=analogue, digital=not analogue)
+
+            analogue = args[1] == "a"
+            node = int(args[2])
+            index = int(args[3])
+            start = self.parseTime(args[4]) if len(args) > 4 else None
+            end = self.parseTime(args[5]) if len(args) > 5 else None
+        except IndexError:
+            raise ValueError('command has wrong syntax. use e.g. "hi a 51 4 -3600" for the last hour.')
+
+        if args[0] == "hs":
+            return data.getHistoryStats(node, index, start, end, analogue=analogue, digital=not analogue)
+
+        (timestamps, values) = data.getHistory(node, index, start, end, analogue=analogue, digital=not analogue)
+        return list(zip(timestamps.tolist(), values.tolist()))
+
+    def parseWatch(self, cmd, source):
+        """filter of a watch command: "watch [f|v] [a|d|*] [node] [index]", the index is ignored for frames
+
+        Args:
+            cmd (str): command
+            source (str): source name
+
+        Raises:
+            ValueError: invalid syntax
+
+        Returns:
+            dictionary: filter and last pushed values
+        """
+        args = cmd.split()[1:]
+
+        try:
+            mode = args[0] if args else "v"
+            type = {"a": "analogue", "d": "digital", "*": None}[args[1]] if len(args) > 1 else None
+            node = int(args[2]) if len(args) > 2 else None
+            index = int(args[3]) if len(args) > 3 else None
+
+            if mode not in ["f", "v"]:
+                raise KeyError(mode)
+        except (KeyError, ValueError):
+            raise ValueError('command has wrong syntax. use e.g. "watch v a 51 4" or "watch f".')
+
+        return {"index": index, "last": {}, "mode": mode, "node": node, "source": source, "type": type}
+
+    def parseTime(self, value):
+        """timestamp from a command argument: "now", a unix timestamp,
+        seconds relative to now (negative values) or an ISO date
+
+        Args:
+            value (str): command argument
+
+        Raises:
+            ValueError: invalid time
+
+        Returns:
+            float: timestamp
+        """
+        if value == "now":
+            return time()
+
+        try:
+            timestamp = float(value)
+            return time() + timestamp if timestamp <= 0 else timestamp
+        except ValueError:
+            pass
+
+        try:
+            return datetime.datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            raise ValueError(f'invalid time "{value}", use "now", a timestamp, negative seconds or an ISO date.')
+
+    def pushWatch(self, frame):
+        """push a received frame to all watching telnet sessions, called by the Bus.
+        the frame is decoded once, filters and change detection are per session.
+
+        Args:
+            frame (Frame): received frame
+        """
+        watches = [session for session in list(self.sessions.values()) if session.watch]
+
+        if not watches:
+            return
+
+        type = "analogue" if frame.isAnalogue() else "digital"
+        node = frame.getNode()
+        encoded = None
+        values = None
+
+        for session in watches:
+            watch = session.watch
+
+            if watch["source"] != frame.source or watch["type"] not in (None, type) or watch["node"] not in (None, node):
+                continue
+
+            if watch["mode"] == "f":
+                if encoded is None:
+                    encoded = self.getWatchFrame(frame)
+                session.push([encoded])
+                continue
+
+            if values is None:
+                values = self.getWatchValues(frame, type)
+
+            lines = []
+            last = watch["last"]
+
+            for (index, value, encoded_value) in values:
+                if watch["index"] not in (None, index) or last.get((type, node, index)) == value:
+                    continue
+
+                last[(type, node, index)] = value
+                lines.append(encoded_value)
+
+            if lines:
+                session.push(lines)
+
+    def getWatchFrame(self, frame):
+        """NDJSON line of a received frame
+
+        Args:
+            frame (Frame): received frame
+
+        Returns:
+            bytes: encoded line
+        """
+        line = {"source": frame.source, "timestamp": frame.timestamp, "frame": frame.getString(verbose=False)}
+
+        return (json.dumps(line) + "\r\n").encode()
+
+    def getWatchValues(self, frame, type):
+        """decoded values of a received frame
+
+        Args:
+            frame (Frame): received frame
+            type (str): "analogue" or "digital"
+
+        Returns:
+            list: (index, value, NDJSON line) tuples
+        """
+        data = Data.Data.getInstance(frame.source)
+        values = []
+
+        if type == "analogue":
+            decoded = [(v[0], v[1], v[2] / pow(10, data.getDecimals(v[0], v[1])), v[4]) for v in frame.getAnalogues()]
+        else:
+            decoded = frame.getDigitals()
+
+        for (node, index, value, timestamp) in decoded:
+            line = {"source": frame.source, "type": type, "node": node, "index": index}
+            line.update(value=value, timestamp=timestamp)
+            values.append((index, value, (json.dumps(line) + "\r\n").encode()))
+
+        return values
+
+    def replay(self, data, cmd):
+        """start or stop a replay into the live pipeline of a source, shows the replay counters without arguments
+
+        Args:
+            data (Data): Data instance of the source
+            cmd (str): command
+
+        Raises:
+            ValueError: invalid syntax or a replay is running
+            OSError: file is not readable
+
+        Returns:
+            str: result
+        """
+        args = cmd.split()
+
+        if len(args) == 1:
+            return json.dumps(self.replayer.getStats() if self.replayer else {})
+
+        if args[1] == "stop":
+            if self.replayer:
+                self.replayer.stop()
+            return "OK."
+
+        if self.replayer and self.replayer.is_alive():
+            raise ValueError('a replay is running, use "rp stop" first.')
+
+        filename = os.path.join(config["app"]["cwd"], args[1])
+        speed = float(args[2]) if len(args) > 2 else 1.0
+        source = data.source
+
+        # frames are ingested like received ones, inside the event loop in the asyncio runtime
+        if self.udp_server.loop:
+            sink = lambda raw: self.udp_server.loop.call_soon_threadsafe(self.udp_server.ingest, raw, source)
+        else:
+            sink = lambda raw: self.udp_server.ingest(raw, source)
+
+        open(filename, "rb").close()
+        self.replayer = Replay.Replay(filename, sink, speed=speed)
+        self.replayer.start()
+
+        return "OK."
+
+    def rollups(self, data, cmd):
+        """rollup queries, see help for the syntax
+
+        Args:
+            data (Data): Data instance of the source
+            cmd (str): command
+
+        Raises:
+            ValueError: invalid syntax
+
+        Returns:
+            list: [slot start, min, max, avg, last, count] per slot
+        """
+        args = cmd.split()
+
+        try:
+            analogue = args[1] == "a"
+            node = int(args[2])
+            index = int(args[3])
+            resolution = int(args[4])
+            start = self.parseTime(args[5]) if len(args) > 5 else None
+            end = self.parseTime(args[6]) if len(args) > 6 else None
+        except IndexError:
+            raise ValueError('command has wrong syntax. use e.g. "ro a 51 4 900 -86400" for the last day.')
+
+        return data.getRollups(node, index, resolution, start, end, analogue=analogue, digital=not analogue)
+
     def run(self):
         """run the Control thread"""
         if config["control"]["shell"]:
@@ -143,82 +647,382 @@ class Control(threading.Thread):
 
         self.executor.shutdown(wait=False)
 
+    async def runAsync(self):
+        """run the Control servers inside the asyncio runtime, the shell stays in an executor thread"""
+        loop = asyncio.get_running_loop()
+        tasks = []
+
+        if config["control"]["shell"]:
+            tasks.append(loop.run_in_executor(None, self.run_shell))
+        if config["control"]["telnet"]:
+            tasks.append(self.run_telnet_async())
+
+        await asyncio.gather(*tasks)
+
     def run_shell(self):
         """shell thread"""
         sleep(1)
         logging.debug("Control/Shell initialized.")
 
-        while True:
-            self.command(input(config["control"]["prompt"]), print)
+        try:
+            while True:
+                self.command(input(config["control"]["prompt"]), print)
+        except EOFError:
+            logging.debug("Control/Shell closed, no input available.")
 
     def run_telnet(self):
-        """telnet thread"""
+        """telnet thread, serves all sessions with one selector"""
+        host = config["control"]["telnet_host"]
+        port = config["control"]["telnet_port"]
+
         try:
-            with socket.create_server((config["control"]["telnet_host"], config["control"]["telnet_port"])) as s:
-                s.listen(1)
-                logging.debug(
-                    "Control/Telnet initialized, listening on port udp://%s:%d."
-                    % (config["control"]["telnet_host"], config["control"]["telnet_port"])
-                )
+            with socket.create_server((host, port)) as s, selectors.DefaultSelector() as selector:
+                s.listen(config["control"]["telnet_max_sessions"])
+                s.setblocking(False)
+                selector.register(s, selectors.EVENT_READ)
+
+                # woken by pushWatch() from the Bus thread
+                (wakeup, self.wakeup) = socket.socketpair()
+                wakeup.setblocking(False)
+                self.wakeup.setblocking(False)
+                selector.register(wakeup, selectors.EVENT_READ)
+
+                logging.debug("Control/Telnet initialized, listening on port tcp://%s:%d." % (host, port))
 
                 while True:
-                    conn, _ = s.accept()
-
-                    def output(res):
-                        if res:
-                            if res == "quit.":
-                                conn.send((res + "\r\n").encode())
-                                conn.close()
-                            else:
-                                lines = str(res).split("\n")
-                                for l in lines:
-                                    conn.send((l + "\r\n").encode())
-                                conn.send(config["control"]["prompt"].encode())
-
-                    while conn.fileno() > 0:
-                        data = conn.recv(1024)
-
-                        if not data:
-                            conn.close()
-
-                        self.command(data.decode("utf-8").strip(), output)
+                    for (key, events) in selector.select(timeout=1.0):
+                        if key.fileobj is s:
+                            self.acceptTelnet(s, selector)
+                            continue
+
+                        if key.fileobj is wakeup:
+                            wakeup.recv(4096)
+
+                            for session in list(self.sessions.values()):
+                                if session.conn and session.watch_queue:
+                                    self.writeTelnet(session, selector)
+                            continue
+
+                        session = key.data
+
+                        if events & selectors.EVENT_READ:
+                            self.readTelnet(session)
+                        if session.conn:
+                            self.writeTelnet(session, selector)
+
+                    self.expireTelnet(selector)
+        except Exception as e:
+            logging.error(e)
+
+    def acceptTelnet(self, s, selector):
+        """accept a new telnet connection, rejected above telnet_max_sessions
+
+        Args:
+            s (socket): listening socket
+            selector (selector): selector of the telnet thread
+        """
+        try:
+            (conn, addr) = s.accept()
+        except BlockingIOError:
+            return
+
+        name = "telnet/%s:%d" % addr[:2]
+
+        if len(self.sessions) >= config["control"]["telnet_max_sessions"]:
+            logging.warning(f"Control/Telnet: rejected {name}, too many sessions")
+            conn.sendall(b"too many sessions.\r\n")
+            conn.close()
+            return
+
+        conn.setblocking(False)
+        session = self.openSession(name, conn)
+        session.wake = self.wakeTelnet
+        selector.register(conn, selectors.EVENT_READ, session)
+
+    def closeTelnet(self, session, selector):
+        """close the connection of a telnet session and forget its state
+
+        Args:
+            session (Session): telnet session
+            selector (selector): selector of the telnet thread
+        """
+        selector.unregister(session.conn)
+        session.conn.close()
+        session.conn = None
+
+        self.sessions.pop(session.name, None)
+        self.closeSession(session.name)
+
+    def expireTelnet(self, selector):
+        """close telnet sessions idle for longer than telnet_idle_timeout
+
+        Args:
+            selector (selector): selector of the telnet thread
+        """
+        idle = time() - config["control"]["telnet_idle_timeout"]
+
+        for session in list(self.sessions.values()):
+            if session.conn and not session.watch and session.last_activity < idle:
+                logging.debug(f"Control/Telnet: {session.name} idle, closing")
+
+                try:
+                    session.conn.send(b"idle timeout.\r\n")
+                except OSError:
+                    pass
+                self.closeTelnet(session, selector)
+
+    def openSession(self, name, conn=None):
+        """new telnet session, its output is buffered until the command is done
+
+        Args:
+            name (str): session name
+            conn (socket, optional): connection of the threaded server. Defaults to None.
+
+        Returns:
+            Session: telnet session
+        """
+        session = self.sessions[name] = Session(name, conn)
+
+        def output(res):
+            if res:
+                session.outbuf += self.format_telnet(res)
+                if res == "quit.":
+                    session.closing = True
+
+        session.output = output
+
+        return session
+
+    def runCommand(self, cmd, session):
+        """run a command of a telnet session, errors are answered to that client only
+
+        Args:
+            cmd (str): command
+            session (Session): telnet session
+        """
+        try:
+            self.command(cmd, session.output, session.name)
         except Exception as e:
+            logging.exception(f"Control/Telnet: command {cmd!r} of {session.name} failed")
+            session.output(f"error: {e}")
+
+    def readTelnet(self, session):
+        """read from a telnet connection and run all complete commands
+
+        Args:
+            session (Session): telnet session
+        """
+        try:
+            data = session.conn.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+
+        if not data:
+            session.closing = True
+            return
+
+        try:
+            for cmd in session.feed(data):
+                if session.closing:
+                    break
+                self.runCommand(cmd, session)
+        except ValueError as e:
+            session.output(str(e))
+            session.closing = True
+
+    def drainWatch(self, session):
+        """move pushed lines of the watch queue to the output buffer,
+        lines stay in the bounded queue while a slow client has not read the buffer
+
+        Args:
+            session (Session): telnet session
+        """
+        queue = session.watch_queue
+
+        while queue and len(session.outbuf) < 65536:
+            session.outbuf += queue.popleft()
+
+    def wakeTelnet(self):
+        """wake the selector of the telnet thread, called from other threads"""
+        try:
+            self.wakeup.send(b"\0")
+        except BlockingIOError:
+            pass
+
+    def writeTelnet(self, session, selector):
+        """send as much of the buffered output as possible, one send per selector event
+
+        Args:
+            session (Session): telnet session
+            selector (selector): selector of the telnet thread
+        """
+        self.drainWatch(session)
+
+        if session.outbuf:
+            try:
+                sent = session.conn.send(session.outbuf)
+                del session.outbuf[:sent]
+            except BlockingIOError:
+                pass
+            except OSError:
+                session.outbuf.clear()
+                session.closing = True
+
+        if session.closing and not session.outbuf:
+            self.closeTelnet(session, selector)
+            return
+
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if session.outbuf or session.watch_queue else 0)
+        if selector.get_key(session.conn).events != events:
+            selector.modify(session.conn, events, session)
+
+    async def run_telnet_async(self):
+        """telnet server, asyncio streams version of run_telnet()"""
+        server = await asyncio.start_server(
+            self.handle_telnet,
+            config["control"]["telnet_host"],
+            config["control"]["telnet_port"],
+            backlog=config["control"]["telnet_max_sessions"],
+        )
+        logging.debug(
+            "Control/Telnet initialized, listening on port tcp://%s:%d."
+            % (config["control"]["telnet_host"], config["control"]["telnet_port"])
+        )
+
+        async with server:
+            await server.serve_forever()
+
+    async def handle_telnet(self, reader, writer):
+        """serves one telnet connection of the asyncio telnet server
+
+        Args:
+            reader (StreamReader): connection reader
+            writer (StreamWriter): connection writer
+        """
+        name = "telnet/%s:%d" % writer.get_extra_info("peername")[:2]
+
+        if len(self.sessions) >= config["control"]["telnet_max_sessions"]:
+            logging.warning(f"Control/Telnet: rejected {name}, too many sessions")
+            writer.write(b"too many sessions.\r\n")
+            writer.close()
+            return
+
+        session = self.openSession(name)
+        wake = asyncio.Event()
+        session.wake = wake.set
+        read = None
+
+        try:
+            while not session.closing:
+                read = read or asyncio.ensure_future(reader.read(4096))
+                woken = asyncio.ensure_future(wake.wait())
+                timeout = None if session.watch else config["control"]["telnet_idle_timeout"]
+
+                (done, _) = await asyncio.wait((read, woken), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                woken.cancel()
+
+                if not done:
+                    raise asyncio.TimeoutError()
+
+                if read in done:
+                    data = read.result()
+                    read = None
+
+                    if not data:
+                        break
+
+                    try:
+                        for cmd in session.feed(data):
+                            if session.closing:
+                                break
+                            self.runCommand(cmd, session)
+                    except ValueError as e:
+                        session.output(str(e))
+                        session.closing = True
+
+                wake.clear()
+                self.drainWatch(session)
+
+                if session.outbuf:
+                    writer.write(bytes(session.outbuf))
+                    session.outbuf.clear()
+                    await writer.drain()
+
+                if session.watch_queue:
+                    wake.set()
+        except asyncio.TimeoutError:
+            logging.debug(f"Control/Telnet: {name} idle, closing")
+            writer.write(b"idle timeout.\r\n")
+        except (ConnectionError, UnicodeDecodeError) as e:
             logging.error(e)
+        finally:
+            if read:
+                read.cancel()
+            writer.close()
+            self.sessions.pop(name, None)
+            self.closeSession(name)
+
+    def format_telnet(self, res):
+        """telnet representation of a command result
+
+        Args:
+            res (str): command result
+
+        Returns:
+            bytes: result lines, followed by the prompt
+        """
+        if res == "quit.":
+            return (res + "\r\n").encode()
+
+        return ("".join(l + "\r\n" for l in str(res).split("\n")) + config["control"]["prompt"]).encode()
 
-    def send(self, cmd):
+    def send(self, cmd, source=None):
+        """queue one or more comma separated values for sending, values of the same frame share a packet
+
+        Args:
+            cmd (str): command, e.g. "s a 54 15 22.3 1, d 41 3 1"
+            source (str, optional): source name. Defaults to the default source.
+
+        Raises:
+            ValueError: invalid syntax or value, nothing is sent
+        """
         if self.cmds["send"] is None:
             self.cmds["send"] = re.compile(
-                r"^(?:s|save)\s((?P<analogue>a)|(?P<digital>d))\s"
+                r"^((?P<analogue>a)|(?P<digital>d))\s"
                 r"(?P<node>[0-9]+)\s(?P<index>[0-9]+)\s"
                 r"(?(analogue)(?P<aValue>[0-9.]+)|(?P<dValue>[0-1]))\s?"
                 r"(?(analogue)(?P<decimals>[0-9])+)$"
             )
 
-        if not self.send_command(cmd):
+        if not self.send_command(cmd, source):
             raise ValueError('command has wrong syntax. use e.g. "send a 54 15 22.3 1" for analogue requests.')
 
-    def send_command(self, cmd):
-        if self.cmds["send"]:
-            m = self.cmds["send"].match(cmd)
-            if m:
-                analogue = m.group("analogue") == "a"
-                digital = not analogue
+    def send_command(self, cmd, source=None):
+        values = []
 
-                try:
-                    f = Frame()
-                    f.setValue(
-                        int(m.group("node")),
-                        int(m.group("index")),
-                        m.group("aValue") if analogue else int(m.group("dValue")),
-                        decimals=int(m.group("decimals")) if analogue else False,
-                        analogue=analogue,
-                        digital=digital,
-                    )
-                    self.udp_server.sendFrame(f)
-                except Exception as e:
-                    logging.error(e)
-                    return False
-
-                return True
-
-        return False
+        for value in cmd.partition(" ")[2].split(","):
+            m = self.cmds["send"].match(value.strip())
+            if not m:
+                return False
+
+            analogue = m.group("analogue") == "a"
+            values.append(
+                (
+                    int(m.group("node")),
+                    int(m.group("index")),
+                    m.group("aValue") if analogue else int(m.group("dValue")),
+                    int(m.group("decimals")) if analogue else False,
+                    analogue,
+                    not analogue,
+                )
+            )
+
+        try:
+            Outbound.Outbound.getInstance().setValues(values, source)
+        except ValueError as e:
+            logging.error(e)
+            return False
+
+        return True
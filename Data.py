@@ -1,113 +1,402 @@
-import copy
+import asyncio
 import json
 import logging
 import os
 import pickle
 import threading
 
-from collections import deque
-from time import sleep, time
+from collections import OrderedDict, deque
+from time import perf_counter, sleep, time
 
-from config import config
+from config import config, getSources
+from Channels import ChannelTable
+from Metrics import Metrics
 
 import UDP_Server
 
 
 class Data(threading.Thread):
     """
-    data collector and formatter
+    data collector and formatter, one instance per source (CMI)
     """
 
-    __instance = None
+    __instances = {}
 
-    data_frames = deque(maxlen=config["data"]["fifo_length"])
-    last = {"analogue": {}, "digital": {}}
-    node_config = {"analogue": {}, "digital": {}}
-    renewed = {}
     udp_server = None
 
     @staticmethod
-    def getInstance():
-        """Static access method for Data """
-        if Data.__instance is None:
-            Data()
-        return Data.__instance
+    def getDefaultSource():
+        """name of the default source, the first configured one
 
-    def __init__(self):
+        Returns:
+            str: source name
+        """
+        return next(iter(config["sources"]))
+
+    @staticmethod
+    def getInstance(source=None):
+        """Static access method for Data, one instance per source
+
+        Args:
+            source (str, optional): source name. Defaults to the default source.
+        """
+        source = source or Data.getDefaultSource()
+        if source not in Data.__instances:
+            Data(source)
+        return Data.__instances[source]
+
+    @staticmethod
+    def getInstances():
+        """instances for all configured sources
+
+        Returns:
+            dictionary: Data instances by source name
+        """
+        return {source: Data.getInstance(source) for source in config["sources"]}
+
+    @staticmethod
+    def saveAll():
+        """save all initialized instances, e.g. before shutdown. frames only with saving activated"""
+        for instance in Data.__instances.values():
+            if instance.initialized:
+                instance.save(frames=int(config["data"]["save"]) > 0)
+
+    def __init__(self, source=None):
         super().__init__()
 
-        if Data.__instance is not None:
-            raise Exception("This class is a singleton")
+        source = source or Data.getDefaultSource()
+
+        if source not in config["sources"]:
+            raise ValueError(f'unknown source "{source}"')
+        if source in Data.__instances:
+            raise Exception("This class is a singleton per source")
         else:
-            Data.__instance = self
+            Data.__instances[source] = self
+
+        self.source_config = getSources()[source]
+
+        self.changes = {
+            "analogue": deque(maxlen=config["data"]["changes_length"]),
+            "digital": deque(maxlen=config["data"]["changes_length"]),
+        }
+        self.consumers = {}
+        self.channels = ChannelTable({}, self.source_config["device"])
+        self.chunks = None
+        self.config_stamp = None
+        self.data_frames = deque(maxlen=config["data"]["fifo_length"])
+        self.history = None
+        self.initialized = False
+        self.journal = None
+        self.last_frame = None
+        self.latest = {"analogue": {}, "digital": {}}
+        self.lock = threading.Lock()
+        self.node_config = {"analogue": {}, "digital": {}}
+        self.rollups = None
+        self.save_at = time() + max(0, config["data"]["save"])
+        self.seq = 0
+        self.source = source
+
+        metrics = Metrics.getInstance()
+        self.evictions = metrics.counter(
+            "data_fifo_evictions_total", "frames pushed out of the FIFO queue", {"source": source}
+        )
+        metrics.gauge("data_fifo_frames", "frames in the FIFO queue", {"source": source}, lambda: len(self.data_frames))
+        self.timings = {
+            (name, type): metrics.histogram(f"data_{name}_seconds", help, {"source": source, "type": type})
+            for (name, help) in (("difference", "duration of getDifference()"), ("values", "duration of getValues()"))
+            for type in ("analogue", "digital")
+        }
 
         f"Data initiated with fifo size of {self.data_frames.maxlen} frames."
 
-    def initialize(self):
-        """get needed instances from local classes"""
+    def initialize(self, loop=None):
+        """get needed instances from local classes
+
+        Args:
+            loop (asyncio loop, optional): event loop of the asyncio runtime. Defaults to None (threaded).
+        """
         self.udp_server = UDP_Server.UDP_Server.getInstance()
 
+        if config["history"]["enabled"]:
+            from History import History
+
+            self.history = History(config["history"]["max_samples"])
+
+        if config["chunks"]["enabled"]:
+            from Chunks import ChunkStore
+
+            self.chunks = ChunkStore(
+                os.path.join(config["app"]["dir"], self.source_config["chunks"]),
+                self.channels,
+                samples=config["chunks"]["samples"],
+                max_age=config["chunks"]["max_age"],
+            )
+
+        if config["rollups"]["enabled"]:
+            from Rollups import Rollups
+
+            self.rollups = Rollups(
+                os.path.join(config["app"]["dir"], self.source_config["rollups"]),
+                self.channels,
+                config["rollups"]["resolutions"],
+            )
+            self.rollups.restore()
+
+        if config["journal"]["enabled"]:
+            from Journal import Journal
+
+            self.journal = Journal(
+                os.path.join(config["app"]["dir"], self.source_config["journal"]),
+                self.source,
+                list(config["sources"]).index(self.source),
+                fsync_interval=config["journal"]["fsync_interval"],
+                segment_size=config["journal"]["segment_size"],
+                max_segments=config["journal"]["max_segments"],
+            )
+
         self.restore()
         self.readConfig()
+        self.save_at = time() + max(0, config["data"]["save"])
+
+        if self.journal:
+            self.journal.start()
+
+        self.initialized = True
+
+    def addFrame(self, frame, persist=True):
+        """store a received frame in the FIFO queue and update the latest values
+
+        Args:
+            frame (Frame): received frame
+            persist (bool, optional): write frame to the journal, if enabled. Defaults to True.
+        """
+        if len(self.data_frames) == self.data_frames.maxlen:
+            self.evictions.inc()
+
+        self.data_frames.append(frame)
+        self.updateLatest(frame)
+
+        if self.history:
+            self.history.add(frame)
+        if self.chunks and persist:
+            self.chunks.add(frame)
+        if self.rollups and persist:
+            self.rollups.add(frame)
+        if self.journal and persist:
+            self.journal.append(frame)
 
     def cleanFrames(self):
         """remove all available frames from RAM and harddrive"""
         self.clearLast()
+        self.clearLatest()
         self.data_frames.clear()
-        self.save()
+
+        # the next frame of every slot has to pass the duplicate check again
+        if self.udp_server:
+            self.udp_server.clearPayloads(self.source)
+
+        if self.rollups:
+            self.rollups.clear()
+            self.rollups.save()
+
+        if self.journal:
+            self.journal.flush()
+            self.journal.clear()
+        else:
+            self.save()
+
+    def clearLatest(self):
+        """remove all latest values, their change log and history"""
+        if self.history:
+            self.history.clear()
+
+        with self.lock:
+            self.changes["analogue"].clear()
+            self.changes["digital"].clear()
+            self.last_frame = None
+            self.latest = {"analogue": {}, "digital": {}}
 
     def clearLast(self):
-        """set the last values for analogue and digital back to None.
+        """forget the last values of all consumers.
         self.getDifference() will return all available values at next call.
         """
-        self.last["analogue"] = {}
-        self.last["digital"] = {}
+        with self.lock:
+            self.consumers = {}
 
-    def getDifference(self, analogue=False, digital=False):
-        """calculates the difference between the current and last comparison.
+    def getChanges(self, seq, type):
+        """latest values of all channels changed after sequence number seq
 
         Args:
-            analogue (bool, optional): get differences for analogue values. Defaults to False.
-            digital (bool, optional): get differences for digital values. Defaults to False.
+            seq (int): sequence number of the last read, None for all available values
+            type (str): "analogue" or "digital"
+
+        Returns:
+            tuple: (dictionary of latest values by (node, index), current sequence number)
+        """
+        with self.lock:
+            changes = self.changes[type]
+            latest = self.latest[type]
+
+            # unknown consumer or older changes are already gone, start with all values
+            if seq is None or (changes and changes[0][0] > seq + 1 and len(changes) == changes.maxlen):
+                return (dict(latest), self.seq)
+
+            changed = {}
+            for (change_seq, key) in reversed(changes):
+                if change_seq <= seq:
+                    break
+                changed[key] = latest[key]
+
+            return (changed, self.seq)
+
+    def getChangedChannels(self, type, consumer="default"):
+        """changed values of configured channels since the last call of consumer.
+        every consumer has its own sequence number in the change log, so costs depend on the
+        number of changes only and consumers don't steal changes from each other.
+
+        Args:
+            type (str): "analogue" or "digital"
+            consumer (str, optional): name of the consumer. Defaults to "default".
 
         Returns:
-            dictionary: dictionary of tuples
+            list: (Channel, value, last value of consumer) tuples
         """
+        start = perf_counter()
         timestamp = time()
+        renew = config["data"]["renew"]
+        channels = self.channels
+
+        state = self.consumers.setdefault((consumer, type), {"last": {}, "renewed": OrderedDict(), "seq": None})
+        (changed, state["seq"]) = self.getChanges(state["seq"], type)
+
+        # the oldest renewals are at the front
+        renewed = state["renewed"]
+        for (key, renewed_timestamp) in renewed.items():
+            if renewed_timestamp >= timestamp - renew:
+                break
+            if key not in changed:
+                changed[key] = self.latest[type].get(key)
+
+        diff = []
+        for (key, latest_value) in changed.items():
+            channel = channels.get(type, *key)
+
+            if not latest_value or channel is None:
+                continue
+
+            if type == "analogue":
+                value = latest_value[2] / channel.divisor
+            else:
+                value = latest_value[2]
+
+            last = state["last"].get(key, value)
 
-        data = self.getValues(analogue=True) if analogue else self.getValues(digital=True)
+            if key not in renewed or value != last or renewed[key] < timestamp - renew:
+                diff.append((channel, value, last))
+                state["last"][key] = value
+                renewed[key] = timestamp
+                renewed.move_to_end(key)
+
+        self.timings[("difference", type)].since(start)
+
+        return diff
+
+    def getDifference(self, analogue=False, digital=False, consumer="default"):
+        """calculates the difference between the current values and the last call of consumer,
+        see getChangedChannels()
+
+        Args:
+            analogue (bool, optional): get differences for analogue values. Defaults to False.
+            digital (bool, optional): get differences for digital values. Defaults to False.
+            consumer (str, optional): name of the consumer. Defaults to "default".
+
+        Returns:
+            list: lists of [node, index, value, last value of consumer]
+        """
         type = "analogue" if analogue else "digital"
 
-        if not self.last[type]:
-            self.last[type] = data
-            return self.getDifference(analogue=analogue, digital=digital)
+        return [
+            [channel.sNode, channel.sIndex, value, last]
+            for (channel, value, last) in self.getChangedChannels(type, consumer=consumer)
+        ]
+
+    def removeConsumer(self, consumer):
+        """forget the state of a consumer of getDifference()
+
+        Args:
+            consumer (str): name of the consumer
+        """
+        with self.lock:
+            self.consumers.pop((consumer, "analogue"), None)
+            self.consumers.pop((consumer, "digital"), None)
+
+    def getChunkValues(self, node, index, start=None, end=None, analogue=False, digital=False):
+        """streaming decode of a channel from the compressed chunk store
+
+        Args:
+            node (int): node number
+            index (int): index number
+            start (float, optional): timestamp. Defaults to None (first sample).
+            end (float, optional): timestamp. Defaults to None (last sample).
+            analogue (bool, optional): channel is analogue. Defaults to False.
+            digital (bool, optional): channel is digital. Defaults to False.
+
+        Yields:
+            tuple: (timestamp, value), values with decimals applied
+        """
+        if not self.chunks:
+            raise ValueError("chunk storage is not enabled.")
+
+        if analogue:
+            divisor = pow(10, self.getDecimals(node, index))
+            for (timestamp, raw) in self.chunks.read(0, node, index, start, end):
+                yield (timestamp, raw / divisor)
         else:
-            diff = []
-            for n in data:
-                sNode = str(n)
-
-                for sIndex in data[sNode].keys():
-                    index_renewed = f"{sNode}-{sIndex}"
-                    if index_renewed not in self.renewed:
-                        self.renewed[index_renewed] = timestamp - config["data"]["renew"] - 1
-                    if "value" not in data[sNode][sIndex] or "value" not in self.last[type][sNode][sIndex]:
-                        continue
-                    if (
-                        sNode not in data
-                        or data[sNode][sIndex]["value"] != self.last[type][sNode][sIndex]["value"]
-                        or self.renewed[index_renewed] < timestamp - config["data"]["renew"]
-                    ):
-                        diff.append(
-                            [
-                                sNode,
-                                sIndex,
-                                data[sNode][sIndex]["value"],
-                                self.last[type][sNode][sIndex]["value"],
-                            ]
-                        )
-                        self.renewed[index_renewed] = timestamp
-            self.last[type] = data
-            return diff
+            bit = 1 << ((index - 1) % 16)
+            for (timestamp, word) in self.chunks.read(1, node, 1 if index > 16 else 0, start, end):
+                yield (timestamp, word & bit == bit)
+
+    def getRollups(self, node, index, resolution, start=None, end=None, analogue=False, digital=False):
+        """aggregates of a channel in one resolution between start and end
+
+        Args:
+            node (int): node number
+            index (int): index number
+            resolution (int): configured resolution in seconds
+            start (float, optional): timestamp. Defaults to None (oldest slot).
+            end (float, optional): timestamp. Defaults to None (newest slot).
+            analogue (bool, optional): channel is analogue. Defaults to False.
+            digital (bool, optional): channel is digital. Defaults to False.
+
+        Returns:
+            list: [slot start, min, max, avg, last, count], values with decimals applied,
+                  digital values as share of "on" (avg)
+        """
+        if not self.rollups:
+            raise ValueError("rollups are not enabled.")
+
+        divisor = pow(10, self.getDecimals(node, index)) if analogue else 1
+
+        return [
+            [slot, low / divisor, high / divisor, round(total / count / divisor, 4), last / divisor, count]
+            for (slot, low, high, total, last, count) in self.rollups.getRange(
+                "analogue" if analogue else "digital", node, index, resolution, start, end
+            )
+        ]
+
+    def getDecimals(self, node, index):
+        """configured decimals of an analogue channel
+
+        Args:
+            node (int): node number
+            index (int): index number
+
+        Returns:
+            int: decimals, 0 for channels without config
+        """
+        channel = self.channels.get("analogue", node, index)
+
+        return channel.decimals if channel else 0
 
     def getDumpFilename(self):
         """string of file where the saved and restored data goes to/comes from
@@ -115,7 +404,7 @@ class Data(threading.Thread):
         Returns:
             string: dump filename
         """
-        return os.path.join(config["app"]["dir"], config["app"]["name"] + ".dump")
+        return os.path.join(config["app"]["dir"], self.source_config["dump"])
 
     def getFrames(self):
         """return frames object
@@ -125,6 +414,90 @@ class Data(threading.Thread):
         """
         return self.data_frames
 
+    def getHistory(self, node, index, start=None, end=None, analogue=False, digital=False):
+        """values of a channel between start and end from the history
+
+        Args:
+            node (int): node number
+            index (int): index number
+            start (float, optional): timestamp. Defaults to None (first sample).
+            end (float, optional): timestamp. Defaults to None (last sample).
+            analogue (bool, optional): channel is analogue. Defaults to False.
+            digital (bool, optional): channel is digital. Defaults to False.
+
+        Returns:
+            tuple: (timestamps, values) as NumPy arrays, values with decimals applied
+        """
+        if not self.history:
+            raise ValueError("history is not enabled.")
+
+        (timestamps, raw) = self.history.getRange("analogue" if analogue else "digital", node, index, start, end)
+
+        if analogue:
+            return (timestamps, raw / pow(10, self.getDecimals(node, index)))
+
+        return (timestamps, raw.astype(bool))
+
+    def getHistoryAsOf(self, timestamp, analogue=False, digital=False):
+        """values of all channels at a point in time from the history
+
+        Args:
+            timestamp (float): point in time
+            analogue (bool, optional): analogue channels. Defaults to False.
+            digital (bool, optional): digital channels. Defaults to False.
+
+        Returns:
+            dictionary: [timestamp, value] by node and index
+        """
+        if not self.history:
+            raise ValueError("history is not enabled.")
+
+        data = {}
+
+        for ((node, index), (sample_timestamp, raw, _)) in self.history.getAsOf(
+            timestamp, "analogue" if analogue else "digital"
+        ).items():
+            value = raw / pow(10, self.getDecimals(node, index)) if analogue else raw == 1
+            data.setdefault(node, {})[index] = [sample_timestamp, value]
+
+        return data
+
+    def getHistoryStats(self, node, index, start=None, end=None, analogue=False, digital=False):
+        """count, min, max and mean of a channel between start and end from the history
+
+        Args:
+            node (int): node number
+            index (int): index number
+            start (float, optional): timestamp. Defaults to None (first sample).
+            end (float, optional): timestamp. Defaults to None (last sample).
+            analogue (bool, optional): channel is analogue. Defaults to False.
+            digital (bool, optional): channel is digital. Defaults to False.
+
+        Returns:
+            dictionary: statistics, only count for a window without samples
+        """
+        (timestamps, values) = self.getHistory(node, index, start, end, analogue=analogue, digital=digital)
+
+        if not len(values):
+            return {"count": 0}
+
+        return {
+            "count": int(len(values)),
+            "first": float(timestamps[0]),
+            "last": float(timestamps[-1]),
+            "max": float(values.max()),
+            "mean": float(values.mean()),
+            "min": float(values.min()),
+        }
+
+    def getLastFrame(self):
+        """last received frame
+
+        Returns:
+            Frame: last frame, None if there is none
+        """
+        return self.last_frame
+
     def getReadingsName(self, node, index, analogue=False, digital=False):
         """returns a matching Name, if existent
 
@@ -135,21 +508,11 @@ class Data(threading.Thread):
             digital (bool, optional): get name for digital value.. Defaults to False.
 
         Returns:
-            [type]: [description]
+            str: reading name with spaces replaced, False without a configured name
         """
-        type = "analogue" if analogue else "digital"
+        channel = self.channels.get("analogue" if analogue else "digital", node, index)
 
-        sNode = str(node)
-        sIndex = str(index)
-
-        if (
-            sNode in self.node_config[type]
-            and sIndex in self.node_config[type][sNode]
-            and "name" in self.node_config[type][sNode][sIndex]
-        ):
-            return self.node_config[type][sNode][sIndex]["name"].replace(" ", "_")
-
-        return False
+        return channel.name if channel else False
 
     def getValues(self, analogue=False, digital=False):
         """get values format in config declarations for digital and analogue configurations
@@ -162,10 +525,18 @@ class Data(threading.Thread):
         Returns:
             dictionary: value dictionary of analogue or digital values
         """
+        start = perf_counter()
+
         if analogue:
-            return self.makeAnalogue()
-        if digital:
-            return self.makeDigital()
+            values = self.makeAnalogue()
+        elif digital:
+            values = self.makeDigital()
+        else:
+            return None
+
+        self.timings[("values", "analogue" if analogue else "digital")].since(start)
+
+        return values
 
     def getRawValues(self, analogue=False, digital=False):
         """creates a data dictionary, ordered by node numbers and indexes
@@ -179,22 +550,13 @@ class Data(threading.Thread):
         """
         data = {}
 
-        for f in self.data_frames:
-            if f.isAnalogue() and analogue:
-                node = f.getNode()
-                if node not in data:
-                    data[node] = {}
-                for i in range(1, 5):
-                    index = f.getIndex(i, analogue=True)
-                    data[node][index] = f.getAnalogue(i)
-
-            if f.isDigital() and digital:
-                node = f.getNode()
-                if node not in data:
-                    data[node] = {}
-                for i in range(1, 33):
-                    index = f.getIndex(i, analogue=False)
-                    data[node][index] = f.getDigital(i)
+        if analogue:
+            for ((node, index), value) in list(self.latest["analogue"].items()):
+                data.setdefault(node, {})[index] = value
+
+        if digital:
+            for ((node, index), value) in list(self.latest["digital"].items()):
+                data.setdefault(node, {})[index] = value
 
         return data
 
@@ -204,28 +566,21 @@ class Data(threading.Thread):
         Returns:
             dictionary: dictionary with analogue representations
         """
-        data_analogue = copy.deepcopy(self.node_config["analogue"])
+        data_analogue = {}
+        latest = self.latest["analogue"]
 
-        for f in self.data_frames:
-            if f.isDigital():
-                continue
+        for channel in self.channels.getChannels("analogue"):
+            entry = data_analogue.setdefault(channel.sNode, {})[channel.sIndex] = dict(channel.entry)
+            latest_value = latest.get((channel.node, channel.index))
+
+            if latest_value:
+                raw = latest_value[2]
+                value = raw / channel.divisor
 
-            sNode = str(f.getNode())
-            if str(sNode) in data_analogue:
-                indexes = list(map(lambda i: (i, str(f.getIndex(i))), range(1, 5)))
-                for i in indexes:
-                    if i[1] in data_analogue[sNode]:
-                        decimals = int(data_analogue[sNode][i[1]]["decimals"])
-                        raw = f.getAnalogue(i[0])[2]
-                        timestamp = f.getTimestamp()
-                        unit = data_analogue[sNode][i[1]]["unit"]
-                        value = raw / pow(10, decimals)
-                        value_unit = f"{value} {unit}"
-
-                        data_analogue[sNode][i[1]]["raw"] = raw
-                        data_analogue[sNode][i[1]]["timestamp"] = timestamp
-                        data_analogue[sNode][i[1]]["value"] = value
-                        data_analogue[sNode][i[1]]["value_unit"] = value_unit
+                entry["raw"] = raw
+                entry["timestamp"] = int(latest_value[4])
+                entry["value"] = value
+                entry["value_unit"] = f"{value} {channel.unit}"
         return data_analogue
 
     def makeDigital(self):
@@ -234,69 +589,213 @@ class Data(threading.Thread):
         Returns:
             dictionary: dictionary with digital representations
         """
-        data_digital = copy.deepcopy(self.node_config["digital"])
-
-        for f in self.data_frames:
-            sNode = str(f.getNode())
-            if str(sNode) in data_digital:
-                indexes = list(map(lambda i: f.getIndex(i, False), range(1, 17)))
-                for i in indexes:
-                    sIndex = str(i)
-                    if sIndex in data_digital[sNode]:
-                        value = f.getDigital(i)[2]
-                        timestamp = f.getTimestamp()
-                        data_digital[sNode][sIndex]["timestamp"] = timestamp
-                        data_digital[sNode][sIndex]["value"] = value
+        data_digital = {}
+        latest = self.latest["digital"]
+
+        for channel in self.channels.getChannels("digital"):
+            entry = data_digital.setdefault(channel.sNode, {})[channel.sIndex] = dict(channel.entry)
+            latest_value = latest.get((channel.node, channel.index))
+
+            if latest_value:
+                entry["timestamp"] = int(latest_value[3])
+                entry["value"] = latest_value[2]
         return data_digital
 
+    def getConfigFilenames(self):
+        """paths of the channel config files
+
+        Returns:
+            tuple: analogue and digital config file
+        """
+        return (
+            os.path.join(config["app"]["cwd"], self.source_config["config_analogue"]),
+            os.path.join(config["app"]["cwd"], self.source_config["config_digital"]),
+        )
+
+    def getConfigStamp(self):
+        """modification times and sizes of the config files, missing files count as None
+
+        Returns:
+            tuple: (mtime in ns, size) or None per config file
+        """
+        stamp = []
+
+        for fn in self.getConfigFilenames():
+            try:
+                st = os.stat(fn)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+
+        return tuple(stamp)
+
     def readConfig(self):
-        """read config files from disc"""
-        config_analogue = os.path.join(config["app"]["cwd"], "config_analogue.json")
-        config_digital = os.path.join(config["app"]["cwd"], "config_digital.json")
+        """read config files from disc and compile them into the channel tables.
+        the new tables replace the old ones at once, on invalid files the old ones stay in use.
+        a missing file keeps the current config of its type, empty on startup.
+        """
+        (config_analogue, config_digital) = self.getConfigFilenames()
+        self.config_stamp = self.getConfigStamp()
+        node_config = {}
+
+        for (type, fn) in (("analogue", config_analogue), ("digital", config_digital)):
+            try:
+                with open(fn, "r") as f:
+                    node_config[type] = json.load(f)
+            except FileNotFoundError:
+                logging.error(f"Config file not found ({fn})")
+                node_config[type] = self.node_config[type]
+            except ValueError as e:
+                logging.error(f"Config file {fn} is invalid, keeping the current config: {e}")
+                return
+
+        channels = ChannelTable(node_config, self.source_config["device"])
 
-        fn = config_analogue
+        self.node_config.update(node_config)
+        self.channels = channels
 
-        try:
-            with open(fn, "r") as f:
-                self.node_config["analogue"] = json.load(f)
+        if self.chunks:
+            self.chunks.table = channels
+        if self.rollups:
+            self.rollups.table = channels
 
-            fn = config_digital
-            with open(fn, "r") as f:
-                self.node_config["digital"] = json.load(f)
+        logging.info(f"read config files {config_analogue} and {config_digital}")
 
-            logging.info(f"read config files {config_analogue} and {config_digital}")
+    def reloadConfig(self):
+        """read the config files again if they changed on disc
 
-        except FileNotFoundError:
-            logging.error(f"Config file not found ({fn})")
+        Returns:
+            bool: config files were read
+        """
+        if self.getConfigStamp() == self.config_stamp:
+            return False
+
+        self.readConfig()
+        return True
 
     def restore(self):
-        """restore saved data from disc, if existent"""
+        """restore saved data from disc, if existent.
+        with the journal enabled, a pickle dump is only read once to fill an empty journal.
+        """
+        if self.journal and self.journal.getSegmentNumbers():
+            if self.journal.is_alive():
+                self.journal.flush()
+
+            self.data_frames.clear()
+            self.clearLatest()
+            self.journal.restore(lambda df: self.addFrame(df, persist=False))
+            logging.debug(f"restored {len(self.data_frames)} frames of {self.source} from journal")
+            return
+
+        if self.journal:
+            self.journal.restore(lambda df: self.addFrame(df, persist=False))
+
         if os.path.exists(self.getDumpFilename()):
             with open(self.getDumpFilename(), "rb") as f:
                 self.data_frames.clear()
+                self.clearLatest()
                 data_frames = filter(lambda df: not df.isEmpty(), pickle.load(f))
 
                 for df in data_frames:
-                    self.data_frames.append(df)
-                logging.debug(f"restored {len(self.data_frames)} frames from disc")
+                    self.addFrame(df, persist=self.journal is not None)
+                logging.debug(f"restored {len(self.data_frames)} frames of {self.source} from disc")
+
+            if self.journal:
+                os.rename(self.getDumpFilename(), self.getDumpFilename() + ".migrated")
 
     def run(self):
         """run the Data thread"""
         while True:
+            sleep(self.runTasks())
+
+    async def runAsync(self):
+        """periodic saving and config reloading inside the asyncio runtime"""
+        while True:
+            await asyncio.sleep(self.runTasks())
+
+    def runTasks(self):
+        """periodic tasks: reload changed config files and save frames when due.
+        nothing runs before initialize() restored the saved frames, a save would overwrite them.
+
+        Returns:
+            float: seconds until the next run
+        """
+        if not self.initialized:
+            return 0.1
+
+        now = time()
+        reload = config["data"]["reload"]
+
+        if reload > 0:
+            self.reloadConfig()
+
+        if self.chunks:
+            self.chunks.write()
+
+        if now >= self.save_at:
             if int(config["data"]["save"]) > 0:
-                sleep(config["data"]["save"])
                 self.save()
+                self.save_at = now + config["data"]["save"]
             else:
-                sleep(600)
+                self.save_at = now + 600
                 logging.debug("No saving of frames to disc activated. Skipping.")
 
-    def save(self):
-        """save in memory data to disc"""
+        timeout = min(self.save_at - now, reload) if reload > 0 else self.save_at - now
+
+        # sealed chunks wait in memory until written
+        return min(timeout, 1) if self.chunks else timeout
+
+    def updateLatest(self, frame):
+        """update the latest values with all values of frame, O(1) per value.
+        changed values are added to the change log with a new sequence number.
+
+        Args:
+            frame (Frame): received or restored frame
+        """
+        node = frame.getNode()
+        type = "analogue" if frame.isAnalogue() else "digital"
+        values = frame.getAnalogues() if type == "analogue" else frame.getDigitals()
+
+        with self.lock:
+            changes = self.changes[type]
+            latest = self.latest[type]
+
+            for value in values:
+                key = (node, value[1])
+                previous = latest.get(key)
+                latest[key] = value
+
+                if not previous or previous[2] != value[2]:
+                    self.seq += 1
+                    changes.append((self.seq, key))
+
+        self.last_frame = frame
+
+    def save(self, frames=True):
+        """save in memory data to disc, with the journal enabled all queued frames get written and synced
+
+        Args:
+            frames (bool, optional): save the frames, else only rollups and chunks. Defaults to True.
+        """
+        if self.rollups:
+            self.rollups.save()
+
+        if self.chunks:
+            self.chunks.save()
+
+        if not frames:
+            return
+
+        if self.journal:
+            self.journal.flush()
+            logging.debug(f"flushed journal of {self.source}")
+            return
+
         with open(self.getDumpFilename(), "wb") as f:
             data_frames_list = list((filter(lambda f: not f.isEmpty(), self.data_frames)))
             pickle.dump(data_frames_list, f, protocol=pickle.HIGHEST_PROTOCOL)
 
-            logging.debug(f"saved {len(data_frames_list)} frames to disc")
+            logging.debug(f"saved {len(data_frames_list)} frames of {self.source} to disc")
 
     def setFrames(self, frames):
         """sets the read/available frames data
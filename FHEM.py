@@ -1,12 +1,29 @@
+import asyncio
 import logging
+import socket
 import threading
 
+from collections import OrderedDict
 from telnetlib import Telnet
-from time import sleep
+from time import perf_counter, time
 
 import Data
 
 from config import config
+from Metrics import Metrics
+
+
+def perlString(value):
+    """single quoted Perl string literal, no interpolation of $ and @.
+    semicolons are doubled, FHEM splits command lines at single ones.
+
+    Args:
+        value (str): value
+
+    Returns:
+        str: quoted value
+    """
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'").replace(";", ";;") + "'"
 
 
 class FHEM(threading.Thread):
@@ -33,45 +50,412 @@ class FHEM(threading.Thread):
         else:
             FHEM.__instance = self
 
+        self.acknowledged = False
+        self.backoff = 0
+        self.changed_at = 0
+        self.con = None
+        self.flush_seconds = None
+        self.flushed_at = 0
+        self.last_activity = 0
+        self.last_flush = 0
+        self.pending = OrderedDict()
+        self.pending_since = None
+        self.reconnect_at = 0
+        self.stats = {
+            "batch_last": 0,
+            "batch_max": 0,
+            "commands": 0,
+            "connects": 0,
+            "disconnects": 0,
+            "failed": 0,
+            "flushed": 0,
+            "flushes": 0,
+            "keepalives": 0,
+            "latency_last": 0.0,
+            "latency_max": 0.0,
+            "latency_sum": 0.0,
+        }
+        self.urgent = False
+
         logging.debug("FHEM initiated")
 
     def closeConnection(self, con):
         """closes telnet connection
 
         Args:
-            connection (telnet connection): connection
+            connection (telnet connection or StreamWriter): connection
         """
         logging.debug("closing connection")
 
         if con:
             con.close()
 
+    def connect(self):
+        """persistent telnet connection, opened on first use.
+        failed attempts are retried with exponential backoff.
+
+        Returns:
+            connection: telnet connection, None while FHEM is not reachable
+        """
+        if self.con:
+            return self.con
+
+        if time() < self.reconnect_at:
+            return None
+
+        con = None
+        try:
+            con = self.openConnection()
+
+            if not self.isPrompt(con):
+                raise ConnectionError("no FHEM prompt")
+        except (OSError, EOFError) as e:
+            self.closeConnection(con)
+            self.connectFailed(e)
+            return None
+
+        con.get_socket().setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.connected(con)
+
+        return con
+
+    async def connectAsync(self):
+        """persistent connection, asyncio runtime version of connect()
+
+        Returns:
+            tuple: (StreamReader, StreamWriter), None while FHEM is not reachable
+        """
+        if self.con:
+            return self.con
+
+        if time() < self.reconnect_at:
+            return None
+
+        writer = None
+        try:
+            (reader, writer) = await self.openConnectionAsync()
+
+            if not await self.isPromptAsync(reader, writer):
+                raise ConnectionError("no FHEM prompt")
+        except (OSError, EOFError, asyncio.TimeoutError) as e:
+            self.closeConnection(writer)
+            self.connectFailed(e)
+            return None
+
+        writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.connected((reader, writer))
+
+        return self.con
+
+    def connected(self, con):
+        """store a new connection, the backoff is reset by the first acknowledged command
+
+        Args:
+            con (connection): telnet connection or (StreamReader, StreamWriter)
+        """
+        self.acknowledged = False
+        self.con = con
+        self.last_activity = time()
+        self.stats["connects"] += 1
+
+        logging.info(f"FHEM connected, {len(self.pending)} readings pending")
+
+    def connectFailed(self, e):
+        """double the backoff up to backoff_max after a failed connection attempt
+
+        Args:
+            e (Exception): cause
+        """
+        self.delayReconnect()
+
+        logging.error(f"FHEM connection failed: {e}, retrying in {self.backoff}s")
+
     def createDevice(self):
-        """created dummy device at FHEM instance"""
-        con = self.openConnection()
+        """created dummy device at FHEM instance
 
-        if con:
-            if self.isPrompt(con):
-                alias = config["fhem"]["alias"]
-                device = config["fhem"]["device"]
-                group = config["fhem"]["group"]
-                room = config["fhem"]["room"]
+        Returns:
+            bool: devices created
+        """
+        con = self.connect()
+
+        if not con:
+            return False
+
+        try:
+            for data in Data.Data.getInstances().values():
+                for (_, response) in self.execute(con, self.getCreateDeviceCommand(data.source_config["device"])):
+                    if response:
+                        logging.info(f"FHEM: {response}")
+        except (OSError, EOFError) as e:
+            self.disconnect(e)
+            return False
+
+        return True
+
+    async def createDeviceAsync(self):
+        """created dummy device at FHEM instance, asyncio runtime version of createDevice()
+
+        Returns:
+            bool: devices created
+        """
+        con = await self.connectAsync()
+
+        if not con:
+            return False
+
+        try:
+            for data in Data.Data.getInstances().values():
+                cmd = self.getCreateDeviceCommand(data.source_config["device"])
+
+                async for (_, response) in self.executeAsync(con, cmd):
+                    if response:
+                        logging.info(f"FHEM: {response}")
+        except (OSError, EOFError, asyncio.TimeoutError) as e:
+            self.disconnect(e)
+            return False
+
+        return True
+
+    def delayReconnect(self):
+        """double the backoff up to backoff_max and postpone the next connection attempt"""
+        self.backoff = min(max(self.backoff * 2, 1), config["fhem"]["backoff_max"])
+        self.reconnect_at = time() + self.backoff
+
+    def disconnect(self, e):
+        """drop a dead or out of sync connection, the next use reconnects. a connection that
+        never acknowledged a command counts as failed attempt and postpones the reconnect.
+
+        Args:
+            e (Exception): cause
+        """
+        self.closeConnection(self.con[1] if isinstance(self.con, tuple) else self.con)
+        self.con = None
+        self.stats["disconnects"] += 1
+
+        if not self.acknowledged:
+            self.delayReconnect()
+
+        logging.error(f"FHEM connection lost: {e}, reconnecting in {max(0, self.reconnect_at - time()):.0f}s")
+
+    def execute(self, con, cmd):
+        """send the lines of cmd, every line is acknowledged by the FHEM prompt.
+        up to pipeline lines are written at once, their responses are read as a stream afterwards.
+
+        Args:
+            con (connection): telnet connection
+            cmd (string): command, may contain several lines
+
+        Raises:
+            TimeoutError: no prompt within timeout
+
+        Yields:
+            tuple: (line, response of FHEM), empty response on success
+        """
+        prompt = bytes(config["fhem"]["prompt"], encoding="utf-8")
+        timeout = config["fhem"]["timeout"]
+        lines = [line for line in cmd.split("\n") if line]
+        window = max(1, config["fhem"]["pipeline"])
+
+        for i in range(0, len(lines), window):
+            batch = lines[i : i + window]
+
+            logging.debug(f"sending {len(batch)} commands: {batch[0]} ...")
+            con.write(bytes("".join(line + "\n" for line in batch), encoding="utf-8"))
+
+            for line in batch:
+                r = con.read_until(prompt, timeout)
+                if not r.endswith(prompt):
+                    raise TimeoutError(f"no FHEM prompt for {line} within {timeout}s")
+
+                self.acknowledged = True
+                self.backoff = 0
+                self.last_activity = time()
+                self.stats["commands"] += 1
+
+                yield (line, r[: -len(prompt)].decode(encoding="utf-8").strip())
+
+    async def executeAsync(self, con, cmd):
+        """send the lines of cmd, asyncio runtime version of execute()
+
+        Args:
+            con (tuple): (StreamReader, StreamWriter)
+            cmd (string): command, may contain several lines
+
+        Yields:
+            tuple: (line, response of FHEM), empty response on success
+        """
+        (reader, writer) = con
+        prompt = bytes(config["fhem"]["prompt"], encoding="utf-8")
+        lines = [line for line in cmd.split("\n") if line]
+        window = max(1, config["fhem"]["pipeline"])
+
+        for i in range(0, len(lines), window):
+            batch = lines[i : i + window]
+
+            logging.debug(f"sending {len(batch)} commands: {batch[0]} ...")
+            writer.write(bytes("".join(line + "\n" for line in batch), encoding="utf-8"))
+            await writer.drain()
+
+            for line in batch:
+                r = await asyncio.wait_for(reader.readuntil(prompt), config["fhem"]["timeout"])
+
+                self.acknowledged = True
+                self.backoff = 0
+                self.last_activity = time()
+                self.stats["commands"] += 1
+
+                yield (line, r[: -len(prompt)].decode(encoding="utf-8").strip())
+
+    def getCreateDeviceCommand(self, device):
+        """command to create the dummy device
+
+        Args:
+            device (str): device name
+
+        Returns:
+            string: FHEM command
+        """
+        alias = config["fhem"]["alias"]
+        group = config["fhem"]["group"]
+        room = config["fhem"]["room"]
+
+        cmd = f"define {device} dummy\nattr {device} event-on-change-reading .*\n"
+        cmd += f"attr {device} alias {alias}\n" if alias else ""
+        cmd += f"attr {device} group {group}\n" if group else ""
+        cmd += f"attr {device} room {room}\n" if room else ""
+        cmd += "\n"
+
+        return cmd
+
+    def getBulkUpdateCommand(self, device, readings):
+        """Perl block that updates all readings of a device in one readingsBulkUpdate transaction,
+        so FHEM triggers one event round. the block has no single semicolons, FHEM would split the line there.
+
+        Args:
+            device (str): device name
+            readings (list): (reading, value) tuples
+
+        Returns:
+            string: FHEM command
+        """
+        hash = f"$defs{{{perlString(device)}}}"
+        updates = "".join(
+            f"readingsBulkUpdate({hash}, {perlString(reading)}, {perlString(value)}), " for (reading, value) in readings
+        )
+
+        return f"{{ readingsBeginUpdate({hash}), {updates}readingsEndUpdate({hash}, 1), undef }}"
+
+    def getPendingCommands(self):
+        """commands for all pending readings: one setreading per reading or,
+        with bulk enabled, one readingsBulkUpdate block per device
+
+        Returns:
+            list: (pending keys, command) tuples
+        """
+        if not config["fhem"]["bulk"]:
+            return [([key], command + str(value)) for (key, (command, value)) in self.pending.items()]
+
+        devices = OrderedDict()
+
+        for ((device, reading), (_, value)) in self.pending.items():
+            devices.setdefault(device, []).append((reading, value))
+
+        return [
+            ([(device, reading) for (reading, _) in readings], self.getBulkUpdateCommand(device, readings))
+            for (device, readings) in devices.items()
+        ]
+
+    def getFlushDelay(self):
+        """seconds until the pending readings are due. immediate readings are due at once,
+        all others after the coalescing window since the last change, at most max_latency
+        after the first change. the rate limit and the reconnect backoff postpone a flush.
+
+        Returns:
+            float: seconds, None without pending readings
+        """
+        if not self.pending:
+            return None
+
+        fhem = config["fhem"]
+        due = 0 if self.urgent else min(self.changed_at + fhem["coalesce"], self.pending_since + fhem["max_latency"])
+        due = max(due, self.last_flush + fhem["min_interval"], 0 if self.con else self.reconnect_at)
+
+        return max(0.0, due - time())
+
+    def getReadings(self):
+        """all changed analogue and digital values of all sources, every source has its own device
+
+        Returns:
+            list: (device, reading, value, immediate, setreading prefix) tuples
+        """
+        readings = []
+
+        for data in Data.Data.getInstances().values():
+            device = data.source_config["device"]
 
-                cmd = f"define {device} dummy\nattr {device} event-on-change-reading .*\n"
-                cmd += f"attr {device} alias {alias}\n" if alias else ""
-                cmd += f"attr {device} group {group}\n" if group else ""
-                cmd += f"attr {device} room {room}\n" if room else ""
-                cmd += "\n"
+            for (channel, value, _) in data.getChangedChannels("analogue", consumer="fhem"):
+                readings.append((device, channel.name, value, self.isImmediate(channel, "analogue"), channel.command))
 
-                self.sendCommand(con, cmd)
+            for (channel, value, _) in data.getChangedChannels("digital", consumer="fhem"):
+                value = "on" if value else "off"
+                readings.append((device, channel.name, value, self.isImmediate(channel, "digital"), channel.command))
 
-            if self.isPrompt(con, True):
-                self.closeConnection(con)
+        return readings
 
-    def initialize(self):
-        """get needed instances from local classes"""
+    def getReadingsCommands(self):
+        """setreading commands for all changed analogue and digital values of all sources
+
+        Returns:
+            list: FHEM commands
+        """
+        return [command + str(value) for (_, _, value, _, command) in self.getReadings()]
+
+    def getStats(self):
+        """connection and flush counters
+
+        Returns:
+            dictionary: commands, connects, disconnects, keepalives, flushes, batch sizes,
+                        flush latencies in seconds, pending readings and state
+        """
+        stats = dict(self.stats, connected=self.con is not None, pending=len(self.pending))
+        stats["latency_avg"] = stats["latency_sum"] / stats["flushes"] if stats["flushes"] else 0.0
+
+        return stats
+
+    def initialize(self, loop=None):
+        """get needed instances from local classes
+
+        Args:
+            loop (asyncio loop, optional): event loop of the asyncio runtime. Defaults to None (threaded).
+        """
         self.data = Data.Data.getInstance()
 
+        if loop:
+            self.updateEvent = asyncio.Event()
+
+        metrics = Metrics.getInstance()
+        stats = self.stats
+        self.flush_seconds = metrics.histogram("fhem_flush_seconds", "duration of a flush of the pending readings")
+
+        for (counter, help) in (
+            ("commands", "FHEM commands acknowledged by a prompt"),
+            ("connects", "connections to FHEM"),
+            ("disconnects", "lost connections to FHEM"),
+            ("failed", "FHEM commands answered with an error"),
+            ("flushed", "readings acknowledged by FHEM"),
+            ("flushes", "flushes with acknowledged readings"),
+            ("keepalives", "keepalive checks of an idle connection"),
+        ):
+            metrics.counter(f"fhem_{counter}_total", help, callback=lambda counter=counter: stats[counter])
+
+        metrics.gauge("fhem_connected", "connection to FHEM is open", callback=lambda: int(self.con is not None))
+        metrics.gauge("fhem_pending_readings", "readings waiting for FHEM", callback=lambda: len(self.pending))
+        metrics.gauge(
+            "fhem_last_flush_age_seconds",
+            "seconds since FHEM acknowledged readings, -1 before the first flush",
+            callback=lambda: time() - self.flushed_at if self.flushed_at else -1,
+        )
+
     def getUpdateEvent(self):
         """shared update event
 
@@ -80,6 +464,22 @@ class FHEM(threading.Thread):
         """
         return self.updateEvent
 
+    def isImmediate(self, channel, type):
+        """should a change of the channel be flushed without coalescing? set by "immediate" in the
+        channel config, the default comes from the types in fhem.immediate
+
+        Args:
+            channel (Channel): compiled channel config
+            type (str): "analogue" or "digital"
+
+        Returns:
+            bool: flush at once
+        """
+        if channel.immediate is None:
+            return type in config["fhem"]["immediate"]
+
+        return bool(channel.immediate)
+
     def isPrompt(self, con, readFirst=False):
         """read the telnet connection for FHEM Prompt
 
@@ -88,7 +488,7 @@ class FHEM(threading.Thread):
             readFirst (bool, optional): should a earlier input been read? Defaults to False.
 
         Returns:
-            [type]: [description]
+            bool: prompt received within timeout
         """
         if not con:
             return False
@@ -98,9 +498,55 @@ class FHEM(threading.Thread):
             s.recv(32768)
 
         con.write(b"\n")
-        r = con.read_until(bytes(config["fhem"]["prompt"], encoding="utf-8"))
+        r = con.read_until(bytes(config["fhem"]["prompt"], encoding="utf-8"), config["fhem"]["timeout"])
+
+        return r.decode(encoding="utf-8").endswith(config["fhem"]["prompt"])
+
+    async def isPromptAsync(self, reader, writer, readFirst=False):
+        """read the connection for FHEM Prompt, asyncio runtime version of isPrompt()
 
-        return r.decode(encoding="utf-8") == config["fhem"]["prompt"]
+        Args:
+            reader (StreamReader): connection reader
+            writer (StreamWriter): connection writer
+            readFirst (bool, optional): should a earlier input been read? Defaults to False.
+
+        Returns:
+            bool: prompt received
+        """
+        prompt = bytes(config["fhem"]["prompt"], encoding="utf-8")
+        timeout = config["fhem"]["timeout"]
+
+        if readFirst:
+            await asyncio.wait_for(reader.read(32768), timeout)
+
+        writer.write(b"\n")
+        r = await asyncio.wait_for(reader.readuntil(prompt), timeout)
+
+        return r.endswith(prompt)
+
+    def keepalive(self):
+        """check an idle connection with an empty line"""
+        if self.con and time() - self.last_activity >= config["fhem"]["keepalive"]:
+            self.stats["keepalives"] += 1
+
+            try:
+                if not self.isPrompt(self.con):
+                    raise TimeoutError("no FHEM prompt")
+                self.last_activity = time()
+            except (OSError, EOFError) as e:
+                self.disconnect(e)
+
+    async def keepaliveAsync(self):
+        """asyncio runtime version of keepalive()"""
+        if self.con and time() - self.last_activity >= config["fhem"]["keepalive"]:
+            self.stats["keepalives"] += 1
+
+            try:
+                if not await self.isPromptAsync(*self.con):
+                    raise TimeoutError("no FHEM prompt")
+                self.last_activity = time()
+            except (OSError, EOFError, asyncio.TimeoutError) as e:
+                self.disconnect(e)
 
     def openConnection(self):
         """creates new telnet connection
@@ -118,56 +564,180 @@ class FHEM(threading.Thread):
             timeout=config["fhem"]["timeout"],
         )
 
-    def run(self):
-        while True:
-            self.updateEvent.wait()
-            sleep(1.0)
-            self.sendUpdates()
-            self.updateEvent.clear()
+    async def openConnectionAsync(self):
+        """creates new telnet connection, asyncio runtime version of openConnection()
+
+        Returns:
+            tuple: (StreamReader, StreamWriter)
+        """
+        host = config["fhem"]["host"]
+        port = config["fhem"]["port"]
+
+        logging.debug(f"opening telnet connection to {host}:{port}")
+        return await asyncio.wait_for(asyncio.open_connection(host, port), config["fhem"]["timeout"])
 
-    def sendCommand(self, con, cmd):
-        """sends cmd over telnet conection
+    def recordFlush(self, count):
+        """update the flush counters, the latency is measured from the first pending change
 
         Args:
-            con (connection): telnet connection
-            cmd (string): command
+            count (int): number of acknowledged readings
         """
-        logging.debug(f"sending command: {cmd.strip()}")
-        con.write(bytes(cmd + "\n\n", encoding="utf-8"))
+        if not count:
+            return
+
+        latency = time() - self.pending_since
+        stats = self.stats
+
+        stats["batch_last"] = count
+        stats["batch_max"] = max(stats["batch_max"], count)
+        stats["flushed"] += count
+        stats["flushes"] += 1
+        stats["latency_last"] = latency
+        stats["latency_max"] = max(stats["latency_max"], latency)
+        stats["latency_sum"] += latency
+        self.flushed_at = time()
+
+        if not self.pending:
+            self.pending_since = None
+            self.urgent = False
+
+    def run(self):
+        """run the FHEM thread, flushes are scheduled by getFlushDelay()"""
+        while True:
+            delay = self.getFlushDelay()
+
+            if delay == 0:
+                self.sendUpdates()
+                continue
+
+            if self.updateEvent.wait(config["fhem"]["keepalive"] if delay is None else delay):
+                # cleared before the changes are read, a frame received meanwhile sets it again
+                self.updateEvent.clear()
+                self.setPending()
+            elif delay is None:
+                # duplicate frames don't wake us, renewals of unchanged values are picked up here
+                self.setPending()
+                if not self.pending:
+                    self.keepalive()
+
+    async def runAsync(self):
+        """run the FHEM client inside the asyncio runtime"""
+        while True:
+            delay = self.getFlushDelay()
+
+            if delay == 0:
+                await self.sendUpdatesAsync()
+                continue
+
+            try:
+                await asyncio.wait_for(self.updateEvent.wait(), config["fhem"]["keepalive"] if delay is None else delay)
+                self.updateEvent.clear()
+                self.setPending()
+            except asyncio.TimeoutError:
+                if delay is None:
+                    self.setPending()
+                    if not self.pending:
+                        await self.keepaliveAsync()
 
     def sendUpdates(self):
-        if config["fhem"]["createDevice"]:
-            self.createDevice()
+        self.last_flush = time()
+
+        if config["fhem"]["createDevice"] and self.createDevice():
             config["fhem"]["createDevice"] = False
 
-        # print(self.data.getDifference(analogue=True))
-        # print(self.data.getDifference(digital=True))
         self.updateReadings()
 
+    async def sendUpdatesAsync(self):
+        """asyncio runtime version of sendUpdates()"""
+        self.last_flush = time()
+
+        if config["fhem"]["createDevice"] and await self.createDeviceAsync():
+            config["fhem"]["createDevice"] = False
+
+        await self.updateReadingsAsync()
+
+    def setPending(self):
+        """add all changed readings to the pending readings, a newer value replaces an unsent one"""
+        now = time()
+
+        for (device, reading, value, immediate, command) in self.getReadings():
+            if not self.pending:
+                self.pending_since = now
+
+            self.pending.pop((device, reading), None)
+            self.pending[(device, reading)] = (command, value)
+            self.changed_at = now
+            self.urgent = self.urgent or immediate
+
     def updateReadings(self):
-        """send readings to FHEM instance via telnet"""
-        data_analogue = self.data.getDifference(analogue=True)
-        data_digital = self.data.getDifference(digital=True)
+        """send changed and pending readings to FHEM over the persistent connection.
+        a reading stays pending until FHEM has acknowledged it, e.g. while reconnecting.
+        """
+        self.setPending()
 
-        if len(data_analogue) or len(data_digital):
-            con = self.openConnection()
+        if not self.pending:
+            return
+
+        con = self.connect()
 
-            if con and self.isPrompt(con):
-                device = config["fhem"]["device"]
+        if not con:
+            logging.debug(f"FHEM not connected, {len(self.pending)} readings pending")
+            return
 
-                for d in data_analogue:
-                    cmd = f"setreading {device} {self.data.getReadingsName(d[0], d[1], analogue=True)} {d[3]}"
-                    self.sendCommand(con, cmd)
+        start = perf_counter()
+        commands = self.getPendingCommands()
+        cmd = "\n".join(line for (_, line) in commands)
+        count = 0
 
-                    if not self.isPrompt(con, readFirst=True):
-                        break
+        try:
+            for ((keys, _), (line, response)) in zip(commands, self.execute(con, cmd)):
+                if response:
+                    self.stats["failed"] += 1
+                    logging.error(f"FHEM: {line}: {response}")
 
-                for d in data_digital:
-                    state = "on" if d[2] else "off"
-                    cmd = f"setreading {device} {self.data.getReadingsName(d[0], d[1], digital=True)} {state}"
-                    self.sendCommand(con, cmd)
+                for key in keys:
+                    del self.pending[key]
+                count += len(keys)
+        except (OSError, EOFError) as e:
+            self.disconnect(e)
 
-                    if not self.isPrompt(con, readFirst=True):
-                        break
+        self.recordFlush(count)
 
-                self.closeConnection(con)
+        if self.flush_seconds:
+            self.flush_seconds.since(start)
+
+    async def updateReadingsAsync(self):
+        """send changed and pending readings to FHEM, asyncio runtime version of updateReadings()"""
+        self.setPending()
+
+        if not self.pending:
+            return
+
+        con = await self.connectAsync()
+
+        if not con:
+            logging.debug(f"FHEM not connected, {len(self.pending)} readings pending")
+            return
+
+        start = perf_counter()
+        commands = self.getPendingCommands()
+        pending = iter(keys for (keys, _) in commands)
+        count = 0
+
+        try:
+            async for (line, response) in self.executeAsync(con, "\n".join(line for (_, line) in commands)):
+                if response:
+                    self.stats["failed"] += 1
+                    logging.error(f"FHEM: {line}: {response}")
+
+                keys = next(pending)
+                for key in keys:
+                    del self.pending[key]
+                count += len(keys)
+        except (OSError, EOFError, asyncio.TimeoutError) as e:
+            self.disconnect(e)
+
+        self.recordFlush(count)
+
+        if self.flush_seconds:
+            self.flush_seconds.since(start)
@@ -0,0 +1,264 @@
+import logging
+import random
+import re
+import socket
+import threading
+
+from time import sleep, time
+
+from config import config
+
+
+class FakeFHEM(threading.Thread):
+    """
+    local stand-in for the FHEM telnet port, to load test the FHEM client without a real server.
+    every line is answered with an optional response and the prompt, like FHEM does.
+    understands define, attr, setreading and readingsBulkUpdate Perl blocks, stores devices and
+    readings and can inject response latency, error responses, dropped connections and outages.
+    """
+
+    # readingsBulkUpdate($defs{'device'}, 'reading', 'value') with Perl single quoted strings
+    PERL_STRING = r"'((?:[^'\\]|\\.)*)'"
+    BULK_UPDATE = re.compile(rf"readingsBulkUpdate\(\$defs\{{{PERL_STRING}\}}, {PERL_STRING}, {PERL_STRING}\)")
+    PERL_ESCAPE = re.compile(r"\\(['\\])")
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, disconnect_rate=0.0, seed=0):
+        """
+        Args:
+            host (str, optional): listen address. Defaults to "127.0.0.1".
+            port (int, optional): listen port, 0 picks a free one. Defaults to 0.
+            latency (float, optional): seconds before every response. Defaults to 0.0.
+            error_rate (float, optional): share of commands answered with an error. Defaults to 0.0.
+            disconnect_rate (float, optional): share of commands that close the connection. Defaults to 0.0.
+            seed (int, optional): seed of the failure injection. Defaults to 0.
+        """
+        super().__init__(daemon=True)
+
+        self.attributes = {}
+        self.connected_at = 0
+        self.connections = set()
+        self.disconnect_rate = disconnect_rate
+        self.down_until = 0
+        self.error_rate = error_rate
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.on_reading = None
+        self.prompt = bytes(config["fhem"]["prompt"], encoding="utf-8")
+        self.random = random.Random(seed)
+        self.readings = {}
+        self.stats = {
+            "bulk_updates": 0,
+            "commands": 0,
+            "connections": 0,
+            "errors_injected": 0,
+            "disconnects_injected": 0,
+            "readings": 0,
+            "refused": 0,
+        }
+
+        self.server = socket.create_server((host, port))
+        self.port = self.server.getsockname()[1]
+
+        logging.debug(f"FakeFHEM listening on {host}:{self.port}")
+
+    def execute(self, line):
+        """run a command line, split at single semicolons like FHEM does, ";;" is a literal one
+
+        Args:
+            line (str): command line without line break
+
+        Returns:
+            str: responses, empty on success
+        """
+        responses = (self.executeCommand(cmd.replace("\0", ";")) for cmd in line.replace(";;", "\0").split(";"))
+
+        return "\n".join(response for response in responses if response)
+
+    def executeCommand(self, line):
+        """run a single command
+
+        Args:
+            line (str): command
+
+        Returns:
+            str: response, empty on success
+        """
+        if not line.strip():
+            return ""
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.stats["errors_injected"] += 1
+            return f"injected error for {line[:40]}"
+
+        if line.lstrip().startswith("{"):
+            return self.executePerl(line.lstrip())
+
+        (cmd, _, args) = line.strip().partition(" ")
+
+        if cmd == "define":
+            (device, _, _) = args.partition(" ")
+            if device in self.attributes:
+                return f"{device} already defined, delete it first"
+            self.attributes[device] = {}
+            return ""
+
+        if cmd == "attr":
+            (device, _, rest) = args.partition(" ")
+            if device not in self.attributes:
+                return f"Please define {device} first"
+            (name, _, value) = rest.partition(" ")
+            self.attributes[device][name] = value
+            return ""
+
+        if cmd == "setreading":
+            (device, reading, value) = (args.split(" ", 2) + ["", ""])[:3]
+            if device not in self.attributes:
+                return f"Please define {device} first"
+            self.setReading(device, reading, value)
+            return ""
+
+        return f"Unknown command {cmd}, try help."
+
+    def executePerl(self, line):
+        """run a readingsBulkUpdate block as built by FHEM.getBulkUpdateCommand(), other Perl is ignored
+
+        Args:
+            line (str): Perl block
+
+        Returns:
+            str: response, empty on success
+        """
+        updates = self.BULK_UPDATE.findall(line)
+
+        for (device, reading, value) in updates:
+            device = self.PERL_ESCAPE.sub(r"\1", device)
+
+            if device not in self.attributes:
+                return f"Please define {device} first"
+
+            self.setReading(device, self.PERL_ESCAPE.sub(r"\1", reading), self.PERL_ESCAPE.sub(r"\1", value))
+
+        if updates:
+            self.stats["bulk_updates"] += 1
+
+        return ""
+
+    def getStats(self):
+        """server counters
+
+        Returns:
+            dictionary: connections, commands, bulk updates, readings, injected failures, open connections
+        """
+        with self.lock:
+            return dict(self.stats, open=len(self.connections), devices=len(self.attributes))
+
+    def handle(self, conn):
+        """serve a connection, lines are answered in order
+
+        Args:
+            conn (socket): accepted connection
+        """
+        buffer = b""
+
+        try:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    break
+
+                buffer += data
+                (*lines, buffer) = buffer.split(b"\n")
+                output = []
+
+                for line in lines:
+                    if time() < self.down_until:
+                        return
+
+                    if self.disconnect_rate and self.random.random() < self.disconnect_rate:
+                        self.stats["disconnects_injected"] += 1
+                        return
+
+                    with self.lock:
+                        response = self.execute(line.decode(encoding="utf-8", errors="replace").rstrip("\r"))
+                        self.stats["commands"] += 1
+
+                    output.append((response + "\n" if response else "").encode() + self.prompt)
+
+                if output:
+                    if self.latency:
+                        sleep(self.latency * len(output))
+                    conn.sendall(b"".join(output))
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                self.connections.discard(conn)
+            conn.close()
+
+    def outage(self, seconds):
+        """drop all connections and refuse new ones for seconds
+
+        Args:
+            seconds (float): duration of the outage
+        """
+        self.down_until = time() + seconds
+
+        with self.lock:
+            connections = list(self.connections)
+
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def run(self):
+        """accept connections, one thread per connection"""
+        while True:
+            (conn, _) = self.server.accept()
+
+            if time() < self.down_until:
+                self.stats["refused"] += 1
+                conn.close()
+                continue
+
+            with self.lock:
+                self.connected_at = time()
+                self.connections.add(conn)
+                self.stats["connections"] += 1
+
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def setReading(self, device, reading, value):
+        """store a reading, the lock must be held
+
+        Args:
+            device (str): device name
+            reading (str): reading name
+            value (str): value
+        """
+        timestamp = time()
+        self.readings[(device, reading)] = (value, timestamp)
+        self.stats["readings"] += 1
+
+        if self.on_reading:
+            self.on_reading(device, reading, value, timestamp)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="local stand-in for the FHEM telnet port")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=config["fhem"]["port"])
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of commands answered with an error")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="share of commands closing the connection")
+    args = parser.parse_args()
+
+    fhem = FakeFHEM(args.host, args.port, args.latency, args.error_rate, args.disconnect_rate)
+    fhem.start()
+
+    while True:
+        sleep(10)
+        logging.info(f"FakeFHEM: {fhem.getStats()}")
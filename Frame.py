@@ -1,7 +1,6 @@
-import asyncio
 import datetime
 import logging
-import sys
+import struct
 from time import time
 
 from config import config as config
@@ -14,27 +13,41 @@ class Frame(object):
     stores and handles CoE raw data, received from an UDP call
     """
 
+    __slots__ = ("modified", "rawData", "source", "timestamp")
+
     highMapping = 0b1001  # 0x09, at least "frame" 9
-    modified = False
-    rawData = None
     rawdataLength = 14
-    timestamp = None
 
-    def __init__(self, rawData=False):  # sourcery skip: remove-redundant-if
+    # node, frame, val1-4 (LE16), unit1-4
+    rawStruct = struct.Struct("<BBHHHHBBBB")
+
+    # value number (position) for [frame byte][index in frame], see getIndex()
+    analogueIndexes = tuple(tuple((frame - 1) * 4 + index for index in range(33)) for frame in range(256))
+    digitalIndexes = (
+        tuple((index - 16 if index > 16 else index) for index in range(33)),
+        tuple((index - 16 if index > 16 else index) + 16 for index in range(33)),
+    )
+
+    # (index, frame) for external index values, see getTupleForIndex()
+    analogueTuples = tuple((int((index - 1) % 4) + 1, int((index - 1) / 4) + 1) for index in range(17))
+    digitalTuples = tuple((int((index - 1) % 16) + 1, 0 if index < 17 else 9) for index in range(33))
+
+    # preformatted byte representations, see getString()
+    hexShort = tuple("[%02xh]" % p for p in range(256))
+    hexVerbose = tuple(tuple("[b%d:%02xh|%03dd] " % (i, p, p) for p in range(256)) for i in range(rawdataLength))
+
+    def __init__(self, rawData=False, source=None):  # sourcery skip: remove-redundant-if
         super().__init__()
 
-        if rawData != False and (not isinstance(rawData, bytes) or len(rawData) != self.rawdataLength):
+        if rawData != False and (not isinstance(rawData, (bytes, memoryview)) or len(rawData) != self.rawdataLength):
             raise TypeError("invalid type or wrong length of raw data.")
 
+        self.modified = False
+        self.source = source
         self.timestamp = time()
 
         if rawData:
             self.rawData = rawData
-
-            if config["frame"]["debug"]:
-                logging.debug(f'Frame {self.getString(verbose=config["debug"]["verbose"])}')
-            if config["frame"]["bell"]:
-                asyncio.run(self.bell())
         else:
             self.rawData = bytearray(self.rawdataLength)
 
@@ -42,6 +55,33 @@ class Frame(object):
                 logging.debug(f"Frame with {self.rawdataLength} empty bytes created.")
                 logging.debug(f'Frame {self.getString(verbose=config["debug"]["verbose"])}')
 
+    def __getstate__(self):
+        """state for pickling, views of the receive arena are stored as bytes
+
+        Returns:
+            tuple: (None, slot values)
+        """
+        rawData = bytes(self.rawData) if isinstance(self.rawData, memoryview) else self.rawData
+
+        return (
+            None,
+            {"modified": self.modified, "rawData": rawData, "source": self.source, "timestamp": self.timestamp},
+        )
+
+    def __setstate__(self, state):
+        """restore pickled frames, also frames dumped before __slots__ were in use (state as plain dict)
+
+        Args:
+            state (dict/tuple): pickled state
+        """
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **(state[1] or {})}
+
+        self.modified = state.get("modified", False)
+        self.rawData = state.get("rawData")
+        self.source = state.get("source")
+        self.timestamp = state.get("timestamp")
+
     def __str__(self):
         """string representation of rawData
 
@@ -50,12 +90,6 @@ class Frame(object):
         """
         return self.getString(verbose=False)
 
-    async def bell(self):
-        """writes a bell symbol to the shell prompt, if shell is enabled as module."""
-        sys.stdout.write("\r🔔> ")
-        await asyncio.sleep(1 / 4)
-        sys.stdout.write("\r  > ")
-
     def get16BitIntFromAnalogueValue(self, value, decimals):
         """creates an TACoE compatible integer value for given value and decimals.
 
@@ -69,11 +103,11 @@ class Frame(object):
             (not isinstance(value, int) and not isinstance(value, float))
             or not isinstance(decimals, int)
             or decimals not in range(3)
-            or int(value * pow(10, decimals)) not in range(65536)
+            or round(value * pow(10, decimals)) not in range(65536)
         ):
             raise ValueError("calculated value needs to be between 0 and 65535")
 
-        return int(value * pow(10, decimals))
+        return round(value * pow(10, decimals))
 
     def getAnalogue(self, index):
         """generate (raw) analogue values from 2 8 bit represenations at index (1-4), read as 16LE
@@ -88,14 +122,33 @@ class Frame(object):
         if index not in range(1, 5):
             raise ValueError("only indexes between 1 and 4 are valid")
 
+        rawData = self.rawData
+
         return (
-            self.getNode(),
-            self.getIndex(index, True),
-            self.rawData[index * 2 + 1] << 8 | self.rawData[index * 2],
-            self.rawData[9 + index],
+            rawData[0],
+            self.analogueIndexes[rawData[1]][index],
+            rawData[index * 2 + 1] << 8 | rawData[index * 2],
+            rawData[9 + index],
             self.timestamp,
         )
 
+    def getAnalogues(self):
+        """all 4 (raw) analogue values of the frame, decoded at once
+
+        Returns:
+            tuple: 4 tuples, same format as getAnalogue() for index 1 to 4
+        """
+        (node, frame, v1, v2, v3, v4, u1, u2, u3, u4) = self.rawStruct.unpack_from(self.rawData)
+        indexes = self.analogueIndexes[frame]
+        timestamp = self.timestamp
+
+        return (
+            (node, indexes[1], v1, u1, timestamp),
+            (node, indexes[2], v2, u2, timestamp),
+            (node, indexes[3], v3, u3, timestamp),
+            (node, indexes[4], v4, u4, timestamp),
+        )
+
     def getData(self):
         """bytes version of self.rawData
 
@@ -121,7 +174,21 @@ class Frame(object):
         indexAsBits = 1 << ((index - 1) % 16)
         num = self.rawData[3] << 8 | self.rawData[2]
 
-        return (self.getNode(), index, num & indexAsBits == indexAsBits, self.timestamp)
+        return (self.rawData[0], index, num & indexAsBits == indexAsBits, self.timestamp)
+
+    def getDigitals(self):
+        """all 16 digital values of the frame, decoded at once
+
+        Returns:
+            tuple: 16 tuples, same format as getDigital() for index 1 to 16 (17 to 32 for high mapping)
+        """
+        rawData = self.rawData
+        node = rawData[0]
+        num = rawData[3] << 8 | rawData[2]
+        offset = 16 if rawData[1] == self.highMapping else 0
+        timestamp = self.timestamp
+
+        return tuple((node, i + 1 + offset, num >> i & 1 == 1, timestamp) for i in range(16))
 
     def getFrame(self):
         """second byte of self.rawData is frame number, don't use on digital frame data.
@@ -131,7 +198,7 @@ class Frame(object):
             int: frame number
         """
 
-        return int(self.rawData[1])
+        return self.rawData[1]
 
     def getIndex(self, index, analogue=True):
         """get the value number (position) as integer (1-32)
@@ -146,13 +213,9 @@ class Frame(object):
             raise ValueError("index has to be within range of 1 to 32")
 
         if analogue:
-            return (self.getFrame() - 1) * 4 + index
+            return self.analogueIndexes[self.rawData[1]][index]
 
-        if index > 16:
-            index -= 16
-        if self.isMapped():
-            index += 16
-        return index
+        return self.digitalIndexes[self.rawData[1] == self.highMapping][index]
 
     def getNode(self):
         """first byte of self.rawData is node number
@@ -161,7 +224,7 @@ class Frame(object):
             int: node number
         """
 
-        return int(self.rawData[0])
+        return self.rawData[0]
 
     def getString(self, verbose=False):
         """create string representation of self.rawData
@@ -174,20 +237,10 @@ class Frame(object):
 
         if verbose:
             return f"{datetime.datetime.fromtimestamp(self.timestamp)} " + "".join(
-                map(
-                    lambda p, i: "[b%(i)d:%(p)02xh|%(p)03dd] " % {"i": i, "p": int(p)},
-                    self.rawData,
-                    range(self.rawdataLength),
-                )
+                map(tuple.__getitem__, self.hexVerbose, self.rawData)
             )
         else:
-            return "".join(
-                map(
-                    lambda p, i: "[%(p)02xh]" % {"p": int(p)},
-                    self.rawData,
-                    range(self.rawdataLength),
-                )
-            )
+            return "".join(map(self.hexShort.__getitem__, self.rawData))
 
     def getTimestamp(self):
         """return integer representation of timestamp
@@ -214,11 +267,11 @@ class Frame(object):
         if analogue:
             if index not in range(1, 17):
                 raise ValueError("analogue index has to be between 1 and 16")
-            return (int((index - 1) % 4) + 1, int((index - 1) / 4) + 1)
+            return self.analogueTuples[int(index)]
         elif digital:
             if index not in range(1, 33):
                 raise ValueError("digital index has to be between 1 and 32")
-            return (int((index - 1) % 16) + 1, 0 if int(index) < 17 else 9)
+            return self.digitalTuples[int(index)]
         else:
             return False
 
@@ -229,7 +282,7 @@ class Frame(object):
         Returns:
             bool: data is analogue or not
         """
-        return self.rawData[1] in range(1, 9)
+        return 1 <= self.rawData[1] <= 8
 
     def isDigital(self):
         """the opposite of isAnaloge
@@ -247,7 +300,11 @@ class Frame(object):
             bool: is empty or not
         """
 
-        return not self.rawData or not isinstance(self.rawData, (bytearray, bytes)) or not any(self.rawData)
+        return (
+            not self.rawData
+            or not isinstance(self.rawData, (bytearray, bytes, memoryview))
+            or not any(self.rawData)
+        )
 
     def isMapped(self):
         """return False for first value mapping, True for second value mapping
@@ -468,8 +525,8 @@ class Frame(object):
             self.rawData[2] |= lowByte
             self.rawData[3] |= highByte
         else:
-            self.rawData[2] ^= lowByte
-            self.rawData[3] ^= highByte
+            self.rawData[2] &= ~lowByte & 0xFF
+            self.rawData[3] &= ~highByte & 0xFF
 
         # TODO
 
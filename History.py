@@ -0,0 +1,196 @@
+import logging
+import threading
+
+import numpy as np
+
+
+class Channel(object):
+    """
+    samples of one channel in growable NumPy arrays (timestamp, raw value, unit)
+    """
+
+    __slots__ = ("length", "max_samples", "raw", "timestamps", "units")
+
+    def __init__(self, max_samples, capacity=1024):
+        super().__init__()
+
+        capacity = min(capacity, max_samples)
+
+        self.length = 0
+        self.max_samples = max_samples
+        self.raw = np.empty(capacity, dtype=np.uint16)
+        self.timestamps = np.empty(capacity, dtype=np.float64)
+        self.units = np.empty(capacity, dtype=np.uint8)
+
+    def append(self, timestamp, raw, unit):
+        """add a sample. the arrays grow by doubling up to max_samples,
+        after that the oldest quarter of the samples is dropped.
+
+        Args:
+            timestamp (float): timestamp of the sample
+            raw (int): raw value
+            unit (int): unit of the sample, 0 for digital values
+        """
+        if self.length == len(self.timestamps):
+            if self.length < self.max_samples:
+                self.resize(min(self.length * 2, self.max_samples))
+            else:
+                self.drop(self.max_samples // 4 or 1)
+
+        self.timestamps[self.length] = timestamp
+        self.raw[self.length] = raw
+        self.units[self.length] = unit
+        self.length += 1
+
+    def drop(self, count):
+        """drop the oldest samples
+
+        Args:
+            count (int): number of samples
+        """
+        n = self.length - count
+
+        self.timestamps[:n] = self.timestamps[count : self.length]
+        self.raw[:n] = self.raw[count : self.length]
+        self.units[:n] = self.units[count : self.length]
+        self.length = n
+
+    def resize(self, capacity):
+        """new capacity of the arrays
+
+        Args:
+            capacity (int): number of samples
+        """
+        for name in ("raw", "timestamps", "units"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[: self.length] = old[: self.length]
+            setattr(self, name, new)
+
+    def getAsOf(self, timestamp):
+        """last sample at or before timestamp
+
+        Args:
+            timestamp (float): point in time
+
+        Returns:
+            tuple: (timestamp, raw value, unit), None if there is no sample
+        """
+        i = int(np.searchsorted(self.timestamps[: self.length], timestamp, side="right")) - 1
+
+        if i < 0:
+            return None
+
+        return (float(self.timestamps[i]), int(self.raw[i]), int(self.units[i]))
+
+    def getRange(self, start, end):
+        """samples between start and end (including)
+
+        Args:
+            start (float): timestamp, None for the first sample
+            end (float): timestamp, None for the last sample
+
+        Returns:
+            tuple: (timestamps, raw values) as copies of the arrays
+        """
+        timestamps = self.timestamps[: self.length]
+
+        first = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+        last = self.length if end is None else int(np.searchsorted(timestamps, end, side="right"))
+
+        return (timestamps[first:last].copy(), self.raw[first:last].copy())
+
+
+class History(object):
+    """
+    columnar in memory history of all received values, one Channel per (type, node, index)
+    """
+
+    def __init__(self, max_samples):
+        super().__init__()
+
+        self.channels = {}
+        self.lock = threading.Lock()
+        self.max_samples = max_samples
+
+        logging.debug(f"History initiated with up to {max_samples} samples per channel")
+
+    def add(self, frame):
+        """add all values of frame
+
+        Args:
+            frame (Frame): received or restored frame
+        """
+        with self.lock:
+            if frame.isAnalogue():
+                for (node, index, raw, unit, timestamp) in frame.getAnalogues():
+                    self.getChannel("analogue", node, index).append(timestamp, raw, unit)
+            else:
+                for (node, index, value, timestamp) in frame.getDigitals():
+                    self.getChannel("digital", node, index).append(timestamp, value, 0)
+
+    def clear(self):
+        """remove all samples"""
+        with self.lock:
+            self.channels = {}
+
+    def getAsOf(self, timestamp, type):
+        """last sample of every channel of type at or before timestamp
+
+        Args:
+            timestamp (float): point in time
+            type (str): "analogue" or "digital"
+
+        Returns:
+            dictionary: (timestamp, raw value, unit) by (node, index)
+        """
+        with self.lock:
+            samples = {}
+
+            for ((channel_type, node, index), channel) in self.channels.items():
+                if channel_type == type:
+                    sample = channel.getAsOf(timestamp)
+                    if sample:
+                        samples[(node, index)] = sample
+
+            return samples
+
+    def getChannel(self, type, node, index):
+        """channel for type, node and index, created if not existent
+
+        Args:
+            type (str): "analogue" or "digital"
+            node (int): node number
+            index (int): index number
+
+        Returns:
+            Channel: channel
+        """
+        key = (type, node, index)
+        channel = self.channels.get(key)
+
+        if channel is None:
+            channel = self.channels[key] = Channel(self.max_samples)
+
+        return channel
+
+    def getRange(self, type, node, index, start=None, end=None):
+        """samples of a channel between start and end
+
+        Args:
+            type (str): "analogue" or "digital"
+            node (int): node number
+            index (int): index number
+            start (float, optional): timestamp. Defaults to None (first sample).
+            end (float, optional): timestamp. Defaults to None (last sample).
+
+        Returns:
+            tuple: (timestamps, raw values) as NumPy arrays, empty if the channel is unknown
+        """
+        with self.lock:
+            channel = self.channels.get((type, node, index))
+
+            if channel is None:
+                return (np.empty(0, dtype=np.float64), np.empty(0, dtype=np.uint16))
+
+            return channel.getRange(start, end)
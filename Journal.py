@@ -0,0 +1,242 @@
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import zlib
+
+from time import time
+
+from Frame import Frame
+
+
+class Journal(threading.Thread):
+    """
+    append-only on-disk log of received frames, one per source.
+    fixed size records are written by this thread in groups, followed by one fsync per group.
+    the log is split into numbered segment files, the oldest segments get removed.
+    """
+
+    # timestamp, 14 raw bytes, source number, padding, crc32 of the first 28 bytes
+    recordStruct = struct.Struct("<d14sB5xI")
+    recordLength = recordStruct.size
+    checksumOffset = recordLength - 4
+
+    def __init__(self, directory, source, source_number, fsync_interval=1.0, segment_size=16777216, max_segments=64):
+        super().__init__(name=f"Journal/{source}", daemon=True)
+
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.max_segments = max_segments
+        self.queue = queue.SimpleQueue()
+        self.segment = None
+        self.segment_number = 0
+        self.segment_records = max(1, segment_size // self.recordLength)
+        self.segment_size = 0
+        self.source = source
+        self.source_number = source_number
+        self.stats = {"fsyncs": 0, "records": 0, "restored": 0, "segments": 0, "torn": 0}
+
+        os.makedirs(directory, mode=0o755, exist_ok=True)
+
+    def append(self, frame):
+        """queue a frame for writing, never blocks
+
+        Args:
+            frame (Frame): received frame
+        """
+        self.queue.put((frame.timestamp, bytes(frame.rawData)))
+
+    def clear(self):
+        """remove all segments and start with an empty one"""
+        with self.lock:
+            self.closeSegment()
+
+            for number in self.getSegmentNumbers():
+                os.remove(self.getSegmentFilename(number))
+
+            self.openSegment(self.segment_number + 1)
+
+        logging.debug(f"Journal {self.source}: cleared")
+
+    def closeSegment(self):
+        """flush, sync and close the current segment"""
+        if self.segment:
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+            self.segment.close()
+            self.segment = None
+
+    def flush(self):
+        """write and sync all queued frames, blocks until done"""
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def getSegmentFilename(self, number):
+        """filename of a segment
+
+        Args:
+            number (int): segment number
+
+        Returns:
+            str: filename
+        """
+        return os.path.join(self.directory, "%08d.log" % number)
+
+    def getSegmentNumbers(self):
+        """numbers of all existing segments, oldest first
+
+        Returns:
+            list: segment numbers
+        """
+        return sorted(int(fn[:-4]) for fn in os.listdir(self.directory) if fn.endswith(".log") and fn[:-4].isdigit())
+
+    def getStats(self):
+        """counters of the journal
+
+        Returns:
+            dictionary: written, restored and torn records, fsyncs and segments
+        """
+        return dict(self.stats, queued=self.queue.qsize())
+
+    def openSegment(self, number):
+        """open a segment for appending and remove the oldest segments above max_segments
+
+        Args:
+            number (int): segment number
+        """
+        self.segment = open(self.getSegmentFilename(number), "ab")
+        self.segment_number = number
+        self.segment_size = self.segment.tell() // self.recordLength
+        self.stats["segments"] += 1
+
+        numbers = self.getSegmentNumbers()
+        for old in numbers[: max(0, len(numbers) - self.max_segments)]:
+            os.remove(self.getSegmentFilename(old))
+            logging.debug(f"Journal {self.source}: removed segment {old}")
+
+    def readSegment(self, number, callback):
+        """read all valid records of a segment through mmap, the segment is truncated at the
+        first torn or corrupted record (e.g. after a power loss)
+
+        Args:
+            number (int): segment number
+            callback (func): called with every restored Frame
+        """
+        fn = self.getSegmentFilename(number)
+        length = self.recordLength
+        offset = 0
+
+        with open(fn, "r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+
+            if size >= length:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    view = memoryview(m)
+
+                    try:
+                        while offset + length <= size:
+                            (timestamp, rawData, _, checksum) = self.recordStruct.unpack_from(view, offset)
+
+                            if zlib.crc32(view[offset : offset + self.checksumOffset]) != checksum:
+                                break
+
+                            frame = Frame(rawData, source=self.source)
+                            frame.timestamp = timestamp
+                            callback(frame)
+
+                            offset += length
+                            self.stats["restored"] += 1
+                    finally:
+                        view.release()
+
+            if offset != size:
+                self.stats["torn"] += 1
+                logging.error(f"Journal {self.source}: segment {number} truncated from {size} to {offset} bytes")
+                f.truncate(offset)
+
+    def restore(self, callback):
+        """read all segments, oldest first, and open the newest one for appending
+
+        Args:
+            callback (func): called with every restored Frame
+        """
+        start = time()
+        numbers = self.getSegmentNumbers()
+
+        with self.lock:
+            self.closeSegment()
+
+            for number in numbers:
+                self.readSegment(number, callback)
+
+            self.openSegment(numbers[-1] if numbers else 1)
+
+        logging.debug(
+            f"Journal {self.source}: restored {self.stats['restored']} frames "
+            f"from {len(numbers)} segments in {time() - start:.3f}s"
+        )
+
+    def run(self):
+        """run the Journal thread, writes queued frames in groups"""
+        while True:
+            item = self.queue.get()
+            records = []
+            done = []
+            deadline = time() + self.fsync_interval
+
+            while True:
+                if isinstance(item, threading.Event):
+                    done.append(item)
+                    break
+
+                records.append(item)
+
+                timeout = deadline - time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+
+            try:
+                self.write(records)
+            except OSError as e:
+                logging.error(f"Journal {self.source}: {e}")
+
+            for event in done:
+                event.set()
+
+    def write(self, records):
+        """write records as one group into the current segment(s), followed by fsync
+
+        Args:
+            records (list): (timestamp, raw bytes) tuples
+        """
+        with self.lock:
+            while records:
+                if self.segment_size >= self.segment_records:
+                    self.closeSegment()
+                    self.openSegment(self.segment_number + 1)
+
+                count = min(len(records), self.segment_records - self.segment_size)
+                buffer = bytearray(count * self.recordLength)
+
+                for (i, (timestamp, rawData)) in enumerate(records[:count]):
+                    offset = i * self.recordLength
+                    self.recordStruct.pack_into(buffer, offset, timestamp, rawData, self.source_number, 0)
+                    checksum = zlib.crc32(memoryview(buffer)[offset : offset + self.checksumOffset])
+                    struct.pack_into("<I", buffer, offset + self.checksumOffset, checksum)
+
+                self.segment.write(buffer)
+                self.segment.flush()
+                os.fsync(self.segment.fileno())
+
+                self.segment_size += count
+                self.stats["fsyncs"] += 1
+                self.stats["records"] += count
+                records = records[count:]
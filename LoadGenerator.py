@@ -0,0 +1,99 @@
+import random
+import socket
+
+from time import perf_counter, sleep
+
+from Frame import Frame
+
+
+class LoadGenerator(object):
+    """
+    synthetic CMI, sends CoE frames of a number of nodes over UDP at a fixed rate.
+    every node has 1 to 4 analogue frames with slowly drifting values (temperatures) and both
+    digital frames. changes is the share of frames with a changed value, the others repeat
+    their last payload like an idle CMI does.
+    """
+
+    def __init__(self, host="127.0.0.1", port=5441, nodes=8, first_node=51, analogue_frames=4, changes=0.1, seed=0):
+        super().__init__()
+
+        self.address = (host, port)
+        self.changes = changes
+        self.random = random.Random(seed)
+        self.sent = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.slots = []
+
+        for node in range(first_node, first_node + nodes):
+            for number in range(1, analogue_frames + 1):
+                frame = Frame()
+                for index in range(4 * number - 3, 4 * number + 1):
+                    frame.setValue(node, index, self.random.uniform(15, 60), 1, analogue=True)
+                self.slots.append(frame)
+
+            for index in (1, 17):
+                frame = Frame()
+                frame.setValue(node, index, self.random.random() < 0.5, digital=True)
+                self.slots.append(frame)
+
+    def change(self, frame):
+        """change one value of frame: drift an analogue value by +-0.5 or toggle a digital one
+
+        Args:
+            frame (Frame): frame of a slot
+        """
+        node = frame.getNode()
+
+        if frame.isAnalogue():
+            (_, index, raw, _, _) = self.random.choice(frame.getAnalogues())
+            value = min(max(raw / 10 + self.random.uniform(-0.5, 0.5), 0), 6553.5)
+            frame.setValue(node, index, value, 1, analogue=True)
+        else:
+            (_, index, value, _) = self.random.choice(frame.getDigitals())
+            frame.setValue(node, index, not value, digital=True)
+
+    def getPayload(self):
+        """next payload, the slots are sent round robin
+
+        Returns:
+            bytes: 14 byte CoE frame
+        """
+        frame = self.slots[self.sent % len(self.slots)]
+
+        if self.random.random() < self.changes:
+            self.change(frame)
+
+        return frame.getData()
+
+    def run(self, rate, duration, batch=None):
+        """send frames for duration seconds, paced in batches to reach rate on average
+
+        Args:
+            rate (int): frames per second
+            duration (float): seconds
+            batch (int, optional): frames sent back to back. Defaults to rate / 1000, at least 1.
+
+        Returns:
+            dictionary: sent frames, seconds and the reached rate
+        """
+        batch = batch or max(1, rate // 1000)
+        interval = batch / rate
+        start = perf_counter()
+        end = start + duration
+        due = start
+        sent = self.sent
+
+        while due < end:
+            for _ in range(batch):
+                self.socket.sendto(self.getPayload(), self.address)
+                self.sent += 1
+
+            due += interval
+            delay = due - perf_counter()
+
+            if delay > 0:
+                sleep(delay)
+
+        seconds = perf_counter() - start
+
+        return {"rate": (self.sent - sent) / seconds, "seconds": seconds, "sent": self.sent - sent}
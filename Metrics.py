@@ -0,0 +1,375 @@
+import asyncio
+import bisect
+import json
+import logging
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+from config import config
+
+
+class Counter(object):
+    """
+    monotonic counter, sharded per thread: every thread adds to its own cell, so increments
+    need no lock and none get lost. a callback replaces the cells by an existing counter.
+    """
+
+    type = "counter"
+
+    def __init__(self, callback=None):
+        super().__init__()
+
+        self.callback = callback
+        self.cells = {}
+
+    def getValue(self):
+        """current value, the sum of all cells
+
+        Returns:
+            float: value
+        """
+        if self.callback:
+            return self.callback()
+
+        return sum(cell[0] for cell in list(self.cells.values()))
+
+    def inc(self, amount=1):
+        """add amount
+
+        Args:
+            amount (int, optional): increment. Defaults to 1.
+        """
+        cell = self.cells.get(threading.get_ident())
+
+        if cell is None:
+            cell = self.cells.setdefault(threading.get_ident(), [0])
+
+        cell[0] += amount
+
+
+class Gauge(object):
+    """
+    value that goes up and down, set directly or read from a callback when collected
+    """
+
+    type = "gauge"
+
+    def __init__(self, callback=None):
+        super().__init__()
+
+        self.callback = callback
+        self.value = 0
+
+    def getValue(self):
+        """current value
+
+        Returns:
+            float: value
+        """
+        return self.callback() if self.callback else self.value
+
+    def set(self, value):
+        """set the value
+
+        Args:
+            value (float): value
+        """
+        self.value = value
+
+
+class Histogram(object):
+    """
+    fixed bucket histogram, sharded per thread like Counter. a cell holds the bucket counts,
+    the last one for values above the highest bound, and the sum of all values.
+    """
+
+    type = "histogram"
+
+    def __init__(self, buckets):
+        super().__init__()
+
+        self.buckets = tuple(sorted(buckets))
+        self.cells = {}
+
+    def getValue(self):
+        """cumulative bucket counts, sum and count
+
+        Returns:
+            tuple: (list of (upper bound, cumulative count), sum, count)
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+
+        for cell in list(self.cells.values()):
+            for (i, count) in enumerate(cell[0]):
+                counts[i] += count
+            total += cell[1]
+
+        cumulative = []
+        running = 0
+
+        for (bound, count) in zip(self.buckets + (float("inf"),), counts):
+            running += count
+            cumulative.append((bound, running))
+
+        return (cumulative, total, running)
+
+    def observe(self, value):
+        """count a value
+
+        Args:
+            value (float): value, e.g. seconds
+        """
+        cell = self.cells.get(threading.get_ident())
+
+        if cell is None:
+            cell = self.cells.setdefault(threading.get_ident(), [[0] * (len(self.buckets) + 1), 0.0])
+
+        cell[0][bisect.bisect_left(self.buckets, value)] += 1
+        cell[1] += value
+
+    def since(self, start):
+        """count the seconds since start
+
+        Args:
+            start (float): perf_counter() value
+        """
+        self.observe(perf_counter() - start)
+
+
+class Metrics(threading.Thread):
+    """
+    registry of counters, gauges and histograms of all components, collected on request by the
+    stats command of Control and the Prometheus text endpoint (http://host:port/metrics)
+    """
+
+    __instance = None
+
+    # seconds, 50us to 10s
+    LATENCY_BUCKETS = (
+        0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+    )
+
+    @staticmethod
+    def getInstance():
+        """Static access method for Metrics """
+        if Metrics.__instance is None:
+            Metrics()
+        return Metrics.__instance
+
+    def __init__(self):
+        super().__init__(daemon=True)
+
+        if Metrics.__instance is not None:
+            raise Exception("This class is a singleton")
+        else:
+            Metrics.__instance = self
+
+        self.help = {}
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+        logging.debug("Metrics initiated")
+
+    def counter(self, name, help, labels=None, callback=None):
+        """get or create a counter, see get()"""
+        return self.get(Counter, name, help, labels, callback=callback)
+
+    def gauge(self, name, help, labels=None, callback=None):
+        """get or create a gauge, see get()"""
+        return self.get(Gauge, name, help, labels, callback=callback)
+
+    def histogram(self, name, help, labels=None, buckets=LATENCY_BUCKETS):
+        """get or create a histogram, see get()"""
+        return self.get(Histogram, name, help, labels, buckets=buckets)
+
+    def get(self, cls, name, help, labels=None, **kwargs):
+        """get or create a metric, the same name and labels return the same instance.
+        a new callback replaces the one of an existing metric.
+
+        Args:
+            cls (class): Counter, Gauge or Histogram
+            name (str): metric name, prefixed with "tacoe_" on export
+            help (str): description
+            labels (dictionary, optional): label values. Defaults to None.
+
+        Returns:
+            metric: Counter, Gauge or Histogram
+        """
+        key = (name, tuple(sorted((labels or {}).items())))
+
+        with self.lock:
+            metric = self.metrics.get(key)
+
+            if metric is None:
+                metric = self.metrics[key] = cls(**kwargs)
+                self.help[name] = help
+            elif kwargs.get("callback"):
+                metric.callback = kwargs["callback"]
+
+        return metric
+
+    def collect(self):
+        """current values of all metrics
+
+        Returns:
+            list: (name, help, type, labels, value) tuples sorted by name and labels
+        """
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+
+        samples = []
+
+        for ((name, labels), metric) in metrics:
+            try:
+                samples.append((name, self.help[name], metric.type, labels, metric.getValue()))
+            except Exception as e:
+                logging.error(f"Metrics: collecting {name} failed: {e}")
+
+        return samples
+
+    def getExposition(self):
+        """all metrics in the Prometheus text exposition format
+
+        Returns:
+            str: exposition
+        """
+        lines = []
+        last = None
+
+        for (name, help, type, labels, value) in self.collect():
+            name = f"tacoe_{name}"
+
+            if name != last:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {type}")
+                last = name
+
+            if type == "histogram":
+                (buckets, total, count) = value
+
+                for (bound, cumulative) in buckets:
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f"{name}_bucket{self.formatLabels(labels + (('le', le),))} {cumulative}")
+
+                lines.append(f"{name}_sum{self.formatLabels(labels)} {total}")
+                lines.append(f"{name}_count{self.formatLabels(labels)} {count}")
+            else:
+                lines.append(f"{name}{self.formatLabels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def getStats(self):
+        """all metrics as a dictionary, histograms with count, sum and average
+
+        Returns:
+            dictionary: values by name and labels ("name{label=value}")
+        """
+        stats = {}
+
+        for (name, _, type, labels, value) in self.collect():
+            key = name + ("{" + ",".join(f"{k}={v}" for (k, v) in labels) + "}" if labels else "")
+
+            if type == "histogram":
+                (_, total, count) = value
+                stats[key] = {"avg": total / count if count else 0.0, "count": count, "sum": total}
+            else:
+                stats[key] = value
+
+        return stats
+
+    def formatLabels(self, labels):
+        """Prometheus label set
+
+        Args:
+            labels (tuple): (name, value) tuples
+
+        Returns:
+            str: e.g. {source="cmi"}, empty without labels
+        """
+        if not labels:
+            return ""
+
+        values = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for (_, v) in labels)
+
+        return "{" + ",".join(f'{k}="{v}"' for ((k, _), v) in zip(labels, values)) + "}"
+
+    def initialize(self, loop=None):
+        """nothing to do, metrics are registered by the components
+
+        Args:
+            loop (asyncio loop, optional): event loop of the asyncio runtime. Defaults to None (threaded).
+        """
+
+    def run(self):
+        """serve the Prometheus endpoint"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                (status, content_type, body) = metrics.getResponse(self.path)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        host = config["metrics"]["host"]
+        port = config["metrics"]["port"]
+
+        with ThreadingHTTPServer((host, port), Handler) as server:
+            logging.debug(f"Metrics listening on http://{host}:{port}/metrics")
+            server.serve_forever()
+
+    async def runAsync(self):
+        """serve the Prometheus endpoint inside the asyncio runtime"""
+        server = await asyncio.start_server(self.handleHttp, config["metrics"]["host"], config["metrics"]["port"])
+
+        async with server:
+            await server.serve_forever()
+
+    async def handleHttp(self, reader, writer):
+        """minimal HTTP/1.0 handler of the asyncio runtime, one request per connection
+
+        Args:
+            reader (StreamReader): connection reader
+            writer (StreamWriter): connection writer
+        """
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            (method, path, *_) = request.decode("latin-1").split(" ", 2)
+            (status, content_type, body) = self.getResponse(path) if method == "GET" else (405, "text/plain", b"")
+
+            writer.write(
+                f"HTTP/1.0 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    def getResponse(self, path):
+        """HTTP response of a path: /metrics in text format, /stats as JSON
+
+        Args:
+            path (str): request path
+
+        Returns:
+            tuple: (status, content type, body)
+        """
+        path = path.split("?")[0]
+
+        if path == "/metrics":
+            return (200, "text/plain; version=0.0.4; charset=utf-8", self.getExposition().encode())
+        if path == "/stats":
+            return (200, "application/json", json.dumps(self.getStats()).encode())
+
+        return (404, "text/plain", b"not found\n")
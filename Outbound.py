@@ -0,0 +1,239 @@
+import asyncio
+import heapq
+import logging
+import threading
+
+from collections import OrderedDict
+from time import sleep, time
+
+import Data
+import UDP_Server
+
+from config import config, getSources
+from Frame import Frame
+from Metrics import Metrics
+
+
+class Outbound(threading.Thread):
+    """
+    outbound values to the CMIs. values are merged into one frame per source, node and frame
+    number (4 analogue or 16 digital values), frames with changes are sent after a short
+    coalescing window over the long-lived socket of UDP_Server.
+    all known frames are sent again every refresh seconds to keep the CoE inputs of the CMIs
+    alive, a timing heap holds the next refresh of every frame and a change resets it.
+    """
+
+    __instance = None
+    loop = None
+    sendEvent = threading.Event()
+    udp_server = None
+
+    @staticmethod
+    def getInstance():
+        """Static access method for Outbound """
+        if Outbound.__instance is None:
+            Outbound()
+        return Outbound.__instance
+
+    def __init__(self):
+        super().__init__()
+
+        if Outbound.__instance is not None:
+            raise Exception("This class is a singleton")
+        else:
+            Outbound.__instance = self
+
+        self.due = {}
+        self.frames = {}
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()
+        self.schedule = []
+        self.stats = {"errors": 0, "frames": 0, "refreshes": 0, "values": 0}
+
+        logging.debug("Outbound initiated")
+
+    def flush(self):
+        """send all frames with unsent changes or a due refresh, one packet per frame.
+        the next refreshes of frames sent together are staggered by refresh / known frames,
+        so a burst spreads evenly over the refresh interval from the next round on.
+        """
+        now = time()
+        refresh = config["outbound"]["refresh"]
+
+        with self.lock:
+            refreshes = [key for key in self.getDue(now) if key not in self.pending]
+            keys = list(self.pending) + refreshes
+            frames = [(key, Frame(self.frames[key].getData(), source=key[0])) for key in keys]
+            self.pending.clear()
+
+            if refresh and keys:
+                gap = refresh / len(self.frames)
+
+                for (i, key) in enumerate(keys):
+                    self.due[key] = now + refresh - i * gap
+                    heapq.heappush(self.schedule, (self.due[key], key))
+
+        self.stats["refreshes"] += len(refreshes)
+
+        for ((source, _, _), frame) in frames:
+            try:
+                self.udp_server.sendFrame(frame, source)
+                self.stats["frames"] += 1
+            except OSError as e:
+                self.stats["errors"] += 1
+                logging.error(f"Outbound: sending to {source} failed: {e}")
+
+    def getDue(self, now):
+        """remove and return the frames with a due refresh, the lock must be held
+
+        Args:
+            now (float): timestamp
+
+        Returns:
+            list: keys of the due frames
+        """
+        keys = []
+
+        while self.schedule and self.schedule[0][0] <= now:
+            (due, key) = heapq.heappop(self.schedule)
+
+            # entries of rescheduled frames are left in the heap and skipped here
+            if self.due.get(key) == due:
+                del self.due[key]
+                keys.append(key)
+
+        return keys
+
+    def getKey(self, node, index, analogue=False, digital=False, source=None):
+        """key of the frame carrying a value
+
+        Args:
+            node (int): node number
+            index (int): index number
+            analogue (bool, optional): value is analogue. Defaults to False.
+            digital (bool, optional): value is digital. Defaults to False.
+            source (str, optional): source name. Defaults to the default source.
+
+        Raises:
+            ValueError: unknown source or invalid index
+
+        Returns:
+            tuple: (source, node, frame number)
+        """
+        source = source or Data.Data.getDefaultSource()
+
+        if source not in getSources():
+            raise ValueError(f'unknown source "{source}"')
+
+        (_, number) = Frame().getTupleForIndex(index, analogue=analogue, digital=digital)
+
+        return (source, node, number)
+
+    def getStats(self):
+        """outbound counters
+
+        Returns:
+            dictionary: queued values, sent frames and refreshes, send errors, known and pending frames
+        """
+        with self.lock:
+            return dict(self.stats, known=len(self.frames), pending=len(self.pending))
+
+    def getTimeout(self):
+        """seconds until the next refresh is due
+
+        Returns:
+            float: seconds, None without scheduled refreshes
+        """
+        with self.lock:
+            while self.schedule and self.due.get(self.schedule[0][1]) != self.schedule[0][0]:
+                heapq.heappop(self.schedule)
+
+            if not self.schedule:
+                return None
+
+            return max(0, self.schedule[0][0] - time())
+
+    def initialize(self, loop=None):
+        """get needed instances from local classes
+
+        Args:
+            loop (asyncio loop, optional): event loop of the asyncio runtime. Defaults to None (threaded).
+        """
+        self.udp_server = UDP_Server.UDP_Server.getInstance()
+
+        metrics = Metrics.getInstance()
+        stats = self.stats
+        for (counter, help) in (
+            ("errors", "outbound frames that failed to send"),
+            ("frames", "outbound frames sent"),
+            ("refreshes", "outbound frames resent as refresh"),
+            ("values", "values queued for sending"),
+        ):
+            metrics.counter(f"outbound_{counter}_total", help, callback=lambda counter=counter: stats[counter])
+        metrics.gauge("outbound_frames_known", "outbound frames kept for refreshes", callback=lambda: len(self.frames))
+        metrics.gauge(
+            "outbound_frames_pending", "outbound frames with unsent changes", callback=lambda: len(self.pending)
+        )
+
+        if loop:
+            self.loop = loop
+            self.sendEvent = asyncio.Event()
+
+    def run(self):
+        """run the Outbound thread"""
+        while True:
+            if self.sendEvent.wait(self.getTimeout()):
+                sleep(config["outbound"]["coalesce"])
+                self.sendEvent.clear()
+
+            self.flush()
+
+    async def runAsync(self):
+        """send queued frames inside the asyncio runtime"""
+        while True:
+            try:
+                await asyncio.wait_for(self.sendEvent.wait(), self.getTimeout())
+                await asyncio.sleep(config["outbound"]["coalesce"])
+                self.sendEvent.clear()
+            except asyncio.TimeoutError:
+                pass
+
+            self.flush()
+
+    def setValue(self, node, index, value, decimals=0, analogue=False, digital=False, source=None):
+        """queue a single value, see setValues()"""
+        self.setValues([(node, index, value, decimals, analogue, digital)], source)
+
+    def setValues(self, values, source=None):
+        """queue values for sending, all values are checked before any of them is queued.
+        values of the same frame are merged, the other values of a frame keep their last state.
+
+        Args:
+            values (list): (node, index, value, decimals, analogue, digital) tuples, see Frame.setValue()
+            source (str, optional): source name. Defaults to the default source.
+
+        Raises:
+            ValueError: invalid value, nothing is queued
+        """
+        keys = []
+
+        for (node, index, value, decimals, analogue, digital) in values:
+            Frame().setValue(node, index, value, decimals=decimals, analogue=analogue, digital=digital)
+            keys.append(self.getKey(node, index, analogue=analogue, digital=digital, source=source))
+
+        with self.lock:
+            for (key, (node, index, value, decimals, analogue, digital)) in zip(keys, values):
+                frame = self.frames.get(key)
+
+                if frame is None:
+                    frame = self.frames[key] = Frame(source=key[0])
+
+                frame.setValue(node, index, value, decimals=decimals, analogue=analogue, digital=digital)
+                self.pending[key] = True
+
+            self.stats["values"] += len(values)
+
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.sendEvent.set)
+        else:
+            self.sendEvent.set()
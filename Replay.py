@@ -0,0 +1,197 @@
+import datetime
+import heapq
+import logging
+import pickle
+import re
+import socket
+import threading
+
+from time import perf_counter
+
+from Frame import Frame
+
+
+class Replay(threading.Thread):
+    """
+    replays captured CoE traffic into a sink: log files with frames as written by the frame debug
+    output (verbose "[b0:33h|051d] ..." or short "[33h][04h]..." form) and pickled dumps of Data.save().
+    frames keep their original inter-arrival times divided by speed, speed 0 replays as fast as
+    possible. logs are read line by line, out of order captures are sorted within window frames.
+    """
+
+    BYTE = re.compile(r"\[(?:b\d+:)?([0-9a-f]{2})h")
+    TIME = re.compile(r"(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)(?:[,.](\d+))?")
+
+    def __init__(self, filename, sink, speed=1.0, window=1000):
+        super().__init__(daemon=True)
+
+        self.filename = filename
+        self.sink = sink
+        self.speed = speed
+        self.stats = {"errors": 0, "frames": 0, "lag": 0.0, "position": None, "seconds": 0.0, "skipped": 0}
+        self.stopEvent = threading.Event()
+        self.window = max(1, window)
+
+    @staticmethod
+    def getUdpSink(host, port):
+        """sink sending frames as UDP datagrams
+
+        Args:
+            host (str): target address
+            port (int): target port
+
+        Returns:
+            function: sink
+        """
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        return lambda data: s.sendto(data, (host, port))
+
+    def getStats(self):
+        """replay counters
+
+        Returns:
+            dictionary: replayed frames, skipped lines, sink errors, original timestamp of the last frame,
+                        seconds since the start and the lag behind the schedule in seconds
+        """
+        return dict(self.stats, running=self.is_alive())
+
+    def isDump(self):
+        """detects pickled dumps, they start with the pickle protocol marker
+
+        Returns:
+            bool: file is a dump
+        """
+        with open(self.filename, "rb") as f:
+            return f.read(1) == b"\x80"
+
+    def parseLine(self, line):
+        """frame of a log line
+
+        Args:
+            line (str): log line
+
+        Returns:
+            tuple: (timestamp or None, raw data), None for lines without a complete frame
+        """
+        hexes = self.BYTE.findall(line)
+
+        if len(hexes) != Frame.rawdataLength:
+            return None
+
+        m = self.TIME.search(line)
+        timestamp = None
+
+        if m:
+            timestamp = datetime.datetime.strptime(m.group(1), "%Y-%m-%d %H:%M:%S").timestamp()
+            timestamp += float("0." + m.group(2)) if m.group(2) else 0.0
+
+        return (timestamp, bytes(int(h, 16) for h in hexes))
+
+    def readDump(self):
+        """frames of a pickled dump, the pickle is read at once
+
+        Yields:
+            tuple: (timestamp, raw data)
+        """
+        with open(self.filename, "rb") as f:
+            frames = pickle.load(f)
+
+        for frame in frames:
+            if not frame.isEmpty():
+                yield (frame.timestamp, bytes(frame.rawData))
+
+    def readFrames(self):
+        """frames of the file in timestamp order within the window, frames without timestamp
+        keep the timestamp of the frame before
+
+        Yields:
+            tuple: (timestamp, raw data)
+        """
+        frames = self.readDump() if self.isDump() else self.readLog()
+        heap = []
+        last = 0.0
+
+        for (seq, (timestamp, data)) in enumerate(frames):
+            last = timestamp if timestamp is not None else last
+            heapq.heappush(heap, (last, seq, data))
+
+            if len(heap) > self.window:
+                (timestamp, _, data) = heapq.heappop(heap)
+                yield (timestamp, data)
+
+        while heap:
+            (timestamp, _, data) = heapq.heappop(heap)
+            yield (timestamp, data)
+
+    def readLog(self):
+        """frames of a log file, read line by line
+
+        Yields:
+            tuple: (timestamp or None, raw data)
+        """
+        with open(self.filename, "r", errors="replace") as f:
+            for line in f:
+                frame = self.parseLine(line)
+
+                if frame:
+                    yield frame
+                elif "[" in line:
+                    self.stats["skipped"] += 1
+
+    def run(self):
+        """replay all frames of the file"""
+        start = perf_counter()
+        first = None
+
+        logging.info(f"Replay: {self.filename} at speed {self.speed or 'max'}")
+
+        for (timestamp, data) in self.readFrames():
+            if first is None:
+                first = timestamp
+
+            if self.speed:
+                delay = start + (timestamp - first) / self.speed - perf_counter()
+
+                self.stats["lag"] = max(0.0, -delay)
+
+                if delay > 0:
+                    self.stopEvent.wait(delay)
+
+            if self.stopEvent.is_set():
+                break
+
+            try:
+                self.sink(data)
+                self.stats["frames"] += 1
+            except (OSError, TypeError, ValueError) as e:
+                self.stats["errors"] += 1
+                logging.error(f"Replay: {e}")
+
+            self.stats["position"] = timestamp
+            self.stats["seconds"] = perf_counter() - start
+
+        logging.info(f"Replay: {self.stats['frames']} frames of {self.filename} in {self.stats['seconds']:.3f}s")
+
+    def stop(self):
+        """stop the replay after the current frame"""
+        self.stopEvent.set()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from config import config
+
+    parser = argparse.ArgumentParser(description="replay captured CoE frames over UDP")
+    parser.add_argument("filename", help="log file (log.txt, scratch.txt) or pickled dump (TACoE.dump)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=config["udp_server"]["udp_port"])
+    parser.add_argument("--speed", type=float, default=1.0, help="speed-up of the original timing, 0 for max")
+    parser.add_argument("--window", type=int, default=1000, help="frames sorted by timestamp while reading")
+    args = parser.parse_args()
+
+    replay = Replay(args.filename, Replay.getUdpSink(args.host, args.port), speed=args.speed, window=args.window)
+    replay.start()
+    replay.join()
+    print(replay.getStats())
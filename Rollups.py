@@ -0,0 +1,216 @@
+import logging
+import os
+import pickle
+import threading
+
+from array import array
+from time import time
+
+
+class Archive(object):
+    """
+    fixed size ring buffer of aggregated slots (min, max, sum, last, count) of one resolution.
+    a slot is identified by its start (timestamp // resolution), stale slots get reset on reuse.
+    """
+
+    __slots__ = ("count", "last", "max", "min", "resolution", "slots", "starts", "sum")
+
+    def __init__(self, resolution, slots):
+        super().__init__()
+
+        self.count = array("I", bytes(4 * slots))
+        self.last = array("d", bytes(8 * slots))
+        self.max = array("d", bytes(8 * slots))
+        self.min = array("d", bytes(8 * slots))
+        self.resolution = resolution
+        self.slots = slots
+        self.starts = array("q", [-1]) * slots
+        self.sum = array("d", bytes(8 * slots))
+
+    def add(self, timestamp, value):
+        """aggregate a value into the slot of timestamp, O(1)
+
+        Args:
+            timestamp (float): timestamp of the value
+            value (int): raw value
+        """
+        start = int(timestamp // self.resolution)
+        i = start % self.slots
+
+        if self.starts[i] != start:
+            if self.starts[i] > start:
+                return
+
+            self.starts[i] = start
+            self.count[i] = 1
+            self.min[i] = self.max[i] = self.sum[i] = self.last[i] = value
+            return
+
+        self.count[i] += 1
+        self.last[i] = value
+        self.sum[i] += value
+
+        if value < self.min[i]:
+            self.min[i] = value
+        elif value > self.max[i]:
+            self.max[i] = value
+
+    def getRange(self, start, end):
+        """aggregated slots between start and end, oldest first
+
+        Args:
+            start (float): timestamp, None for the oldest slot
+            end (float): timestamp, None for the newest slot
+
+        Returns:
+            list: (slot start, min, max, sum, last, count) tuples
+        """
+        first = None if start is None else int(start // self.resolution)
+        last = None if end is None else int(end // self.resolution)
+
+        rows = sorted(
+            (s, self.min[i], self.max[i], self.sum[i], self.last[i], self.count[i])
+            for (i, s) in enumerate(self.starts)
+            if s >= 0 and (first is None or s >= first) and (last is None or s <= last)
+        )
+
+        return [(s * self.resolution, *row) for (s, *row) in rows]
+
+
+class Rollups(object):
+    """
+    multi resolution aggregates (RRD style) of the configured channels of a source.
+    every channel gets one Archive per resolution, all memory is allocated on the first value.
+    """
+
+    def __init__(self, filename, table, resolutions):
+        super().__init__()
+
+        self.channels = {}
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.resolutions = tuple((int(resolution), int(slots)) for (resolution, slots) in resolutions)
+        # ChannelTable of the configured channels, replaced on config reloads
+        self.table = table
+
+    def add(self, frame):
+        """aggregate all configured values of frame
+
+        Args:
+            frame (Frame): received frame
+        """
+        node = frame.getNode()
+
+        with self.lock:
+            if frame.isAnalogue():
+                channels = self.table.getNode("analogue", node)
+                if channels is None:
+                    return
+
+                for (_, index, raw, _, timestamp) in frame.getAnalogues():
+                    if channels[index]:
+                        self.addValue(("analogue", node, index), timestamp, raw)
+            else:
+                channels = self.table.getNode("digital", node)
+                if channels is None:
+                    return
+
+                for (_, index, value, timestamp) in frame.getDigitals():
+                    if channels[index]:
+                        self.addValue(("digital", node, index), timestamp, 1 if value else 0)
+
+    def addValue(self, key, timestamp, value):
+        """aggregate a value into all archives of a channel
+
+        Args:
+            key (tuple): (type, node, index)
+            timestamp (float): timestamp of the value
+            value (int): raw value
+        """
+        archives = self.channels.get(key)
+
+        if archives is None:
+            archives = self.channels[key] = tuple(Archive(r, s) for (r, s) in self.resolutions)
+
+        for archive in archives:
+            archive.add(timestamp, value)
+
+    def clear(self):
+        """remove all aggregates"""
+        with self.lock:
+            self.channels = {}
+
+    def getRange(self, type, node, index, resolution, start=None, end=None):
+        """aggregated slots of a channel and resolution between start and end
+
+        Args:
+            type (str): "analogue" or "digital"
+            node (int): node number
+            index (int): index number
+            resolution (int): configured resolution in seconds
+            start (float, optional): timestamp. Defaults to None (oldest slot).
+            end (float, optional): timestamp. Defaults to None (newest slot).
+
+        Raises:
+            ValueError: resolution is not configured
+
+        Returns:
+            list: (slot start, min, max, sum, last, count) tuples, empty if the channel is unknown
+        """
+        resolutions = [r for (r, _) in self.resolutions]
+
+        if resolution not in resolutions:
+            raise ValueError(f"unknown resolution {resolution}, use one of {resolutions}.")
+
+        with self.lock:
+            archives = self.channels.get((type, node, index))
+
+            if archives is None:
+                return []
+
+            return archives[resolutions.index(resolution)].getRange(start, end)
+
+    def getStats(self):
+        """size of the rollups
+
+        Returns:
+            dictionary: resolutions, channels and allocated bytes
+        """
+        with self.lock:
+            slots = sum(s for (_, s) in self.resolutions)
+
+            return {
+                "bytes": len(self.channels) * slots * 44,
+                "channels": len(self.channels),
+                "resolutions": self.resolutions,
+            }
+
+    def restore(self):
+        """read saved aggregates, archives of changed resolutions are dropped"""
+        if not os.path.exists(self.filename):
+            return
+
+        with open(self.filename, "rb") as f:
+            (resolutions, channels) = pickle.load(f)
+
+        with self.lock:
+            if tuple(resolutions) != self.resolutions:
+                logging.error(f"Rollups: resolutions of {self.filename} changed, starting empty")
+                return
+
+            self.channels = channels
+
+        logging.debug(f"Rollups: restored {len(channels)} channels from {self.filename}")
+
+    def save(self):
+        """save all aggregates, written to a temporary file first"""
+        start = time()
+
+        with self.lock:
+            data = pickle.dumps((self.resolutions, self.channels), protocol=pickle.HIGHEST_PROTOCOL)
+
+        with open(self.filename + ".tmp", "wb") as f:
+            f.write(data)
+
+        os.replace(self.filename + ".tmp", self.filename)
+        logging.debug(f"Rollups: saved {len(self.channels)} channels to {self.filename} in {time() - start:.3f}s")
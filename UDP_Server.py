@@ -1,28 +1,75 @@
-from collections import deque
+import asyncio
 import logging
+import selectors
 import socket
+import struct
+import sys
 import threading
 
+from time import sleep, time
+
 import Data
 import FHEM
 
-from config import config
+from Bus import Bus
+from config import config, getSources
 from Frame import Frame
+from Metrics import Metrics
+
+
+class UDP_Protocol(asyncio.DatagramProtocol):
+    """
+    receives CoE UDP packets inside an asyncio event loop, used by the asyncio runtime
+    """
+
+    def __init__(self, udp_server, port):
+        super().__init__()
+
+        self.port = port
+        self.udp_server = udp_server
+
+    def datagram_received(self, data, addr):
+        self.udp_server.stats["batches"] += 1
+        self.udp_server.stats["batch_last"] = 1
+        self.udp_server.stats["batch_max"] = max(self.udp_server.stats["batch_max"], 1)
+        self.udp_server.ingest(data, self.udp_server.getSource(self.port, addr))
+
+    def error_received(self, exc):
+        logging.error(exc)
 
 
 class UDP_Server(threading.Thread):
     """
-    listen on port 5441 and receives 14 byte CoE UDP packets and stores them into a FIFO queue
+    listen on port 5441 (and the ports of further sources) and receives 14 byte CoE UDP packets
+    and stores them into the FIFO queue of their source
     """
 
     __instance = None
 
+    bus = None
     callback = None
-    data = None
-    data_frames = None
+    loop = None
+    data = {}
     fhem = None
+    kernel_drops = {}
+    last_payloads = {}
+    last_seen = {}
+    received_at = {}
+    routes = {}
+    stats = {
+        "batch_last": 0,
+        "batch_max": 0,
+        "batches": 0,
+        "duplicates": 0,
+        "frames": 0,
+        "kernel_drops": 0,
+        "rejected": 0,
+        "sources": {},
+    }
     udp_port = config["udp_server"]["udp_port"]
 
+    SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)  # linux only, not exported by the socket module
+
     @staticmethod
     def getInstance():
         """Static access method for UDP_Server """
@@ -38,40 +85,363 @@ class UDP_Server(threading.Thread):
         else:
             UDP_Server.__instance = self
 
-        logging.debug(f"UDP server initiated, listening on UDP port {self.udp_port}")
+        # long-lived socket for outgoing frames
+        self.send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-    def initialize(self):
-        """get needed instances from local classes"""
-        self.data_frames = Data.Data.getInstance().getFrames()
+        # udp port -> sender address -> source, None is the fallback for unknown senders
+        for name, source in getSources().items():
+            route = self.routes.setdefault(source["udp_port"], {None: name})
+            route.setdefault(source["cmi_ip"], name)
+            self.stats["sources"][name] = 0
+
+        logging.debug(f"UDP server initiated, listening on UDP ports {', '.join(map(str, self.routes))}")
+
+    def initialize(self, loop=None):
+        """get needed instances from local classes
+
+        Args:
+            loop (asyncio loop, optional): event loop of the asyncio runtime. Defaults to None (threaded).
+        """
+        self.bus = Bus.getInstance()
+        self.data = Data.Data.getInstances()
         self.fhem = FHEM.FHEM.getInstance()
+        self.loop = loop
+
+        metrics = Metrics.getInstance()
+        stats = self.stats
+        for (counter, help) in (
+            ("batches", "wakeups of the receive loop with datagrams"),
+            ("duplicates", "received frames suppressed as duplicates"),
+            ("kernel_drops", "datagrams dropped by the kernel (linux only)"),
+            ("rejected", "received datagrams rejected as invalid"),
+        ):
+            metrics.counter(f"udp_{counter}_total", help, callback=lambda counter=counter: stats[counter])
+        metrics.gauge("udp_batch_max", "most datagrams received in one wakeup", callback=lambda: stats["batch_max"])
+
+        for source in self.data:
+            metrics.counter(
+                "udp_frames_total",
+                "frames received and stored",
+                {"source": source},
+                callback=lambda source=source: stats["sources"][source],
+            )
+            metrics.gauge(
+                "udp_last_frame_age_seconds",
+                "seconds since the last frame of a source, duplicates included, -1 before the first",
+                {"source": source},
+                callback=lambda source=source: time() - self.received_at[source] if source in self.received_at else -1,
+            )
+
+        if config["frame"]["debug"]:
+            self.bus.subscribe(Bus.FRAME_RECEIVED, "debug", self.logFrame, loop=loop)
+        if config["frame"]["bell"]:
+            self.bus.subscribe(Bus.FRAME_RECEIVED, "bell", self.ringBell, queue_length=1, loop=loop)
+        if config["fhem"]["enabled"] and config["fhem"]["receiveUpdates"]:
+            self.bus.subscribe(Bus.FRAME_RECEIVED, "fhem", self.sendUpdate, queue_length=1, loop=loop)
+
+    def logFrame(self, frame):
+        """debug output of a received frame
+
+        Args:
+            frame (Frame): received frame
+        """
+        logging.debug(f'Frame {frame.getString(verbose=config["debug"]["verbose"])}')
+
+    def ringBell(self, frame):
+        """writes a bell symbol to the shell prompt, if shell is enabled as module.
+
+        Args:
+            frame (Frame): received frame
+        """
+        sys.stdout.write("\r🔔> ")
+
+        if self.loop:
+            self.loop.call_later(1 / 4, sys.stdout.write, "\r  > ")
+        else:
+            sleep(1 / 4)
+            sys.stdout.write("\r  > ")
+
+    def getSource(self, port, addr):
+        """source name for a datagram, received on port from addr
+
+        Args:
+            port (int): local UDP port
+            addr (tuple): sender address
+
+        Returns:
+            str: source name
+        """
+        route = self.routes[port]
+
+        return route.get(addr[0], route[None]) if addr else route[None]
+
+    def clearPayloads(self, source=None):
+        """forget the last payloads of source, their next frames are not taken as duplicates
+
+        Args:
+            source (str, optional): source name. Defaults to the default source.
+        """
+        source = source or Data.Data.getDefaultSource()
+
+        for key in [key for key in list(self.last_payloads) if key[0] == source]:
+            self.last_payloads.pop(key, None)
+
+    def getLastSeen(self, source=None):
+        """time of the last received frame per slot, suppressed duplicates included
+
+        Args:
+            source (str, optional): source name. Defaults to the default source.
+
+        Returns:
+            dictionary: timestamps by (node, frame number)
+        """
+        source = source or Data.Data.getDefaultSource()
+
+        return {(node, number): t for ((s, node, number), t) in list(self.last_seen.items()) if s == source}
+
+    def getStats(self):
+        """receive counters
+
+        Returns:
+            dictionary: received, suppressed and rejected frames, share of suppressed duplicates,
+                        batch sizes and kernel drops (linux only)
+        """
+        received = self.stats["frames"] + self.stats["duplicates"]
+        suppressed = self.stats["duplicates"] / received if received else 0.0
+
+        return {**self.stats, "sources": dict(self.stats["sources"]), "suppressed": suppressed}
+
+    def ingest(self, data, source=None):
+        """create a frame from received data, store it in the FIFO queue of its source and notify subscribers.
+        a payload equal to the last one of its (node, frame number) slot only updates the last seen time.
+
+        Args:
+            data (bytes/memoryview): received raw data
+            source (str, optional): source name. Defaults to the default source.
+
+        Returns:
+            Frame: created frame, None for invalid data and suppressed duplicates
+        """
+        source = source or Data.Data.getDefaultSource()
+        now = self.received_at[source] = time()
+
+        if config["udp_server"]["dedup"] and len(data) == Frame.rawdataLength:
+            key = (source, data[0], data[1])
+            self.last_seen[key] = now
+
+            if self.last_payloads.get(key) == data:
+                self.stats["duplicates"] += 1
+                return None
+
+            self.last_payloads[key] = bytes(data)
+
+        try:
+            frame = Frame(data, source=source)
+        except TypeError as type_error:
+            self.stats["rejected"] += 1
+            logging.error(type_error)
+            return None
+
+        self.data[source].addFrame(frame)
+        self.stats["frames"] += 1
+        self.stats["sources"][source] += 1
+        self.bus.publish(Bus.FRAME_RECEIVED, frame)
+
+        return frame
+
+    def openSockets(self):
+        """bound UDP sockets for all source ports
+
+        Returns:
+            dictionary: sockets by port
+        """
+        sockets = {}
+
+        for port in self.routes:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if config["udp_server"]["rcvbuf"]:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config["udp_server"]["rcvbuf"])
+            s.bind(("", port))
+            sockets[port] = s
+
+        return sockets
+
+    def receive(self, sockets):
+        """receive loop, one datagram per call
+
+        Args:
+            sockets (dictionary): bound UDP sockets by port
+        """
+        with selectors.DefaultSelector() as selector:
+            for port, s in sockets.items():
+                selector.register(s, selectors.EVENT_READ, port)
+
+            while True:
+                for key, _ in selector.select():
+                    data, addr = key.fileobj.recvfrom(Frame.rawdataLength)
+                    self.stats["batches"] += 1
+                    self.stats["batch_last"] = 1
+                    self.stats["batch_max"] = max(self.stats["batch_max"], 1)
+                    self.ingest(data, self.getSource(key.data, addr))
+
+    def getArenaSlots(self, queue_length):
+        """number of frames in a receive arena
+
+        Args:
+            queue_length (int): longest bus queue
+
+        Returns:
+            int: slots
+        """
+        return config["data"]["fifo_length"] + queue_length + config["udp_server"]["arena_headroom"]
+
+    def receiveBatched(self, sockets):
+        """receive loop, drains all pending datagrams per wakeup into preallocated arenas.
+        frames are read only views of the arena of their port. an arena holds more slots than the FIFO
+        and the longest bus queue together, so a slot is only reused after its frame was pushed out of
+        the FIFO and left all bus queues. the headroom covers frames in the callbacks of the subscribers.
+        a subscriber with a longer queue replaces the arenas by bigger ones, the frames keep the old ones.
+        ports shared by several sources can't guarantee that, their frames are copied out of the arena.
+
+        Args:
+            sockets (dictionary): bound UDP sockets by port
+        """
+        length = Frame.rawdataLength
+        queue_length = Bus.queue_length
+        slots = self.getArenaSlots(queue_length)
+
+        with selectors.DefaultSelector() as selector:
+            for port, s in sockets.items():
+                selector.register(
+                    s,
+                    selectors.EVENT_READ,
+                    {
+                        "ancbufsize": socket.CMSG_SPACE(4) if self.enableDropCounter(s) else 0,
+                        "arena": memoryview(bytearray(slots * length)),
+                        "port": port,
+                        "shared": len(set(self.routes[port].values())) > 1,
+                        "slot": 0,
+                    },
+                )
+
+            while True:
+                batch = 0
+
+                for key, _ in selector.select():
+                    s = key.fileobj
+                    state = key.data
+
+                    while True:
+                        if Bus.queue_length != queue_length:
+                            queue_length = Bus.queue_length
+                            slots = self.getArenaSlots(queue_length)
+
+                            for k in selector.get_map().values():
+                                k.data["arena"] = memoryview(bytearray(slots * length))
+                                k.data["slot"] = 0
+
+                        view = state["arena"][state["slot"] * length : (state["slot"] + 1) * length]
+                        try:
+                            nbytes, ancdata, msg_flags, addr = s.recvmsg_into(
+                                [view], state["ancbufsize"], socket.MSG_DONTWAIT
+                            )
+                        except BlockingIOError:
+                            break
+
+                        batch += 1
+
+                        for level, type, data in ancdata:
+                            if level == socket.SOL_SOCKET and type == self.SO_RXQ_OVFL and len(data) >= 4:
+                                self.kernel_drops[state["port"]] = struct.unpack("=I", data[:4])[0]
+                                self.stats["kernel_drops"] = sum(self.kernel_drops.values())
+
+                        if nbytes != length or msg_flags & socket.MSG_TRUNC:
+                            self.stats["rejected"] += 1
+                            logging.error("invalid type or wrong length of raw data.")
+                            continue
+
+                        source = self.getSource(state["port"], addr)
+
+                        if state["shared"]:
+                            self.ingest(bytes(view), source)
+                        elif self.ingest(view.toreadonly(), source):
+                            state["slot"] = (state["slot"] + 1) % slots
+
+                if batch:
+                    self.stats["batches"] += 1
+                    self.stats["batch_last"] = batch
+                    if batch > self.stats["batch_max"]:
+                        self.stats["batch_max"] = batch
+
+    def enableDropCounter(self, s):
+        """enable SO_RXQ_OVFL, the kernel delivers the number of dropped datagrams with every received one
+
+        Args:
+            s (socket): UDP socket
+
+        Returns:
+            bool: drop counter available
+        """
+        if not sys.platform.startswith("linux"):
+            return False
+
+        try:
+            s.setsockopt(socket.SOL_SOCKET, self.SO_RXQ_OVFL, 1)
+        except OSError as e:
+            logging.debug(f"SO_RXQ_OVFL not available: {e}")
+            return False
+
+        return True
+
+    async def runAsync(self):
+        """run the UDP listeners as datagram endpoints inside the asyncio runtime"""
+        loop = asyncio.get_running_loop()
+        transports = []
+
+        try:
+            for port, s in self.openSockets().items():
+                transport, _ = await loop.create_datagram_endpoint(lambda port=port: UDP_Protocol(self, port), sock=s)
+                transports.append(transport)
+
+            await loop.create_future()
+        finally:
+            for transport in transports:
+                transport.close()
 
     def run(self):
         """run the UDP_Server thread"""
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.bind(("", self.udp_port))
+        sockets = self.openSockets()
 
-            while True:
-                data, _ = s.recvfrom(Frame.rawdataLength)
-                try:
-                    frame = Frame(data)
-                    self.data_frames.append(frame)
-                    self.sendUpdate()
+        try:
+            if config["udp_server"]["batch"] and hasattr(socket.socket, "recvmsg_into"):
+                self.receiveBatched(sockets)
+            else:
+                self.receive(sockets)
+        finally:
+            for s in sockets.values():
+                s.close()
+
+    def sendFrame(self, frame, source=None):
+        """send frame to the CMI of source
 
-                except TypeError as type_error:
-                    logging.error(type_error)
+        Args:
+            frame (Frame): frame to send
+            source (str, optional): source name. Defaults to the source of the frame or the default source.
+        """
+        target = getSources()[source or frame.source or Data.Data.getDefaultSource()]
+        ip = target["cmi_ip"]
+        port = target["cmi_port"]
 
-    def sendFrame(self, frame):
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            ip = config["udp_server"]["cmi_ip"]
-            port = config["udp_server"]["cmi_port"]
-            sFrame = frame.getString()
+        self.send_socket.sendto(frame.getData(), (ip, port))
 
-            s.sendto(frame.getData(), (ip, port))
-            sFrame = frame.getString()
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"sent frame {frame.getString()} to udp://{ip}:{port}")
 
-            logging.debug(f"sent frame {sFrame} to udp://{ip}:{port}")
+    def sendUpdate(self, frame=None):
+        """sets update event to true
 
-    def sendUpdate(self):
-        """sets update event to true"""
+        Args:
+            frame (Frame, optional): received frame. Defaults to None.
+        """
         if config["fhem"]["enabled"] and config["fhem"]["receiveUpdates"]:
-            self.fhem.getUpdateEvent().set()
\ No newline at end of file
+            self.fhem.getUpdateEvent().set()
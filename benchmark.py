@@ -0,0 +1,438 @@
+"""
+end-to-end throughput benchmark: a LoadGenerator process sends CoE frames over loopback UDP
+to an in-process UDP_Server/Data pipeline, while a sampler measures getValues() and
+getDifference() latencies. with --fhem the FHEM client pushes the readings to a FakeFHEM,
+measured are readings per second, the delay from ingest to arrival and reconnects after an
+outage. one JSON result per rate is printed and appended to --output.
+
+    python3 benchmark.py --rates 1000,5000,20000 --duration 10 --nodes 16 --output bench.jsonl
+    python3 benchmark.py --fhem --fhem-latency 0.001 --fhem-outage 2 --rates 2000
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+
+from time import perf_counter, sleep, time
+
+from config import config
+from LoadGenerator import LoadGenerator
+
+
+def percentiles(samples):
+    """nearest rank percentiles of latency samples
+
+    Args:
+        samples (list): seconds
+
+    Returns:
+        dictionary: p50, p90, p99 and max in microseconds
+    """
+    if not samples:
+        return {"count": 0}
+
+    samples = sorted(samples)
+
+    def rank(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))] * 1e6
+
+    return {"count": len(samples), "p50": rank(0.5), "p90": rank(0.9), "p99": rank(0.99), "max": samples[-1] * 1e6}
+
+
+def generate(args, rate, result):
+    """load generator process
+
+    Args:
+        args (Namespace): command line arguments
+        rate (int): frames per second
+        result (Queue): receives the generator result
+    """
+    generator = LoadGenerator(
+        port=args.port,
+        nodes=args.nodes,
+        first_node=args.first_node,
+        analogue_frames=args.analogue_frames,
+        changes=args.changes,
+        seed=rate,
+    )
+    result.put(generator.run(rate, args.duration))
+
+
+def sample(data, stop, latencies, interval):
+    """measure getValues() and getDifference() until stop is set
+
+    Args:
+        data (Data): Data instance of the default source
+        stop (Event): stops sampling
+        latencies (dictionary): lists of seconds by name
+        interval (float): seconds between two samples
+    """
+    while not stop.is_set():
+        start = perf_counter()
+        data.getValues(analogue=True)
+        latencies["getValues"].append(perf_counter() - start)
+
+        start = perf_counter()
+        data.getDifference(analogue=True, consumer="benchmark")
+        latencies["getDifference"].append(perf_counter() - start)
+
+        sleep(interval)
+
+
+class Propagation(object):
+    """
+    delays from the ingest of a changed value to its arrival at FakeFHEM. only the latest change
+    of a reading is tracked, values replaced before a flush (coalesced) are not measured.
+    """
+
+    def __init__(self, data):
+        super().__init__()
+
+        self.data = data
+        self.delays = []
+        self.device = data.source_config["device"]
+        self.lock = threading.Lock()
+        self.sent = {}
+
+    def onFrame(self, frame):
+        """remember the ingest time of changed values, Bus subscriber
+
+        Args:
+            frame (Frame): received frame
+        """
+        channels = self.data.channels
+
+        with self.lock:
+            if frame.isAnalogue():
+                for (_, index, raw, _, timestamp) in frame.getAnalogues():
+                    channel = channels.get("analogue", frame.getNode(), index)
+                    if channel:
+                        self.track(channel.name, str(raw / channel.divisor), timestamp)
+            else:
+                for (_, index, value, timestamp) in frame.getDigitals():
+                    channel = channels.get("digital", frame.getNode(), index)
+                    if channel:
+                        self.track(channel.name, "on" if value else "off", timestamp)
+
+    def onReading(self, device, reading, value, timestamp):
+        """measure the delay of an arrived reading, FakeFHEM callback
+
+        Args:
+            device (str): device name
+            reading (str): reading name
+            value (str): value
+            timestamp (float): arrival time
+        """
+        with self.lock:
+            sent = self.sent.get(reading)
+
+            if device == self.device and sent and sent[0] == value and sent[2] is None:
+                self.sent[reading] = (value, sent[1], timestamp)
+                self.delays.append(timestamp - sent[1])
+
+    def track(self, reading, value, timestamp):
+        """remember a value if it differs from the last one of reading, the lock must be held
+
+        Args:
+            reading (str): reading name
+            value (str): value as sent to FHEM
+            timestamp (float): ingest time
+        """
+        sent = self.sent.get(reading)
+
+        if not sent or sent[0] != value:
+            self.sent[reading] = (value, timestamp, None)
+
+
+def startServer(args):
+    """start UDP_Server, Data and with --fhem FHEM in the configured runtime, the asyncio loop gets its own thread
+
+    Args:
+        args (Namespace): command line arguments
+
+    Returns:
+        tuple: (UDP_Server, Data, FHEM or None)
+    """
+    from Data import Data
+    from FHEM import FHEM
+    from UDP_Server import UDP_Server
+
+    data = Data.getInstance()
+    udp_server = UDP_Server.getInstance()
+    fhem = FHEM.getInstance() if args.fhem else None
+    instances = [t for t in (data, udp_server, fhem) if t]
+
+    if args.runtime == "asyncio":
+        ready = threading.Event()
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            for t in instances:
+                t.initialize(loop=loop)
+            ready.set()
+            await asyncio.gather(udp_server.runAsync(), *([fhem.runAsync()] if fhem else []))
+
+        threading.Thread(target=asyncio.run, args=(run(),), daemon=True).start()
+        ready.wait()
+    else:
+        for t in instances:
+            t.initialize()
+
+        for t in instances[1:]:
+            t.daemon = True
+            t.start()
+
+    sleep(0.5)
+
+    return (udp_server, data, fhem)
+
+
+def writeChannelConfig(args):
+    """channel configs for all simulated channels in the benchmark home
+
+    Args:
+        args (Namespace): command line arguments
+
+    Returns:
+        tuple: analogue and digital config file
+    """
+    generator = LoadGenerator(nodes=args.nodes, first_node=args.first_node, analogue_frames=args.analogue_frames)
+    node_config = {"analogue": {}, "digital": {}}
+
+    for frame in generator.slots:
+        node = str(frame.getNode())
+
+        if frame.isAnalogue():
+            for (_, index, _, _, _) in frame.getAnalogues():
+                entry = {"name": f"A {node} {index}", "decimals": 1, "unit": "°C"}
+                node_config["analogue"].setdefault(node, {})[str(index)] = entry
+        else:
+            for (_, index, _, _) in frame.getDigitals():
+                node_config["digital"].setdefault(node, {})[str(index)] = {"name": f"D {node} {index}"}
+
+    filenames = []
+
+    for (type, nodes) in node_config.items():
+        filenames.append(os.path.join(config["app"]["dir"], f"config_{type}.json"))
+        with open(filenames[-1], "w") as f:
+            json.dump(nodes, f)
+
+    return tuple(filenames)
+
+
+def waitForFHEM(data, fake, timeout):
+    """wait until FakeFHEM holds the latest value of every configured channel
+
+    Args:
+        data (Data): Data instance of the default source
+        fake (FakeFHEM): fake FHEM server
+        timeout (float): seconds
+
+    Returns:
+        int: readings with a different or missing value after timeout
+    """
+    device = data.source_config["device"]
+    end = time() + timeout
+
+    while True:
+        expected = {}
+
+        for (type, sNodes) in (("analogue", data.getValues(analogue=True)), ("digital", data.getValues(digital=True))):
+            for (sNode, entries) in sNodes.items():
+                for (sIndex, entry) in entries.items():
+                    if "value" in entry:
+                        channel = data.channels.get(type, int(sNode), int(sIndex))
+                        value = entry["value"] if type == "analogue" else ("on" if entry["value"] else "off")
+                        expected[channel.name] = str(value)
+
+        with fake.lock:
+            mismatches = sum(1 for (k, v) in expected.items() if fake.readings.get((device, k), (None,))[0] != v)
+
+        if not mismatches or time() > end:
+            return mismatches
+
+        sleep(0.2)
+
+
+def getRevision():
+    """git revision of the working tree
+
+    Returns:
+        str: commit hash, None outside of a git checkout
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=config["app"]["cwd"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TACoE ingest benchmark with a synthetic CMI")
+    parser.add_argument("--rates", default="1000,5000,20000", help="comma separated frames per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per rate")
+    parser.add_argument("--nodes", type=int, default=8, help="number of simulated CAN nodes")
+    parser.add_argument("--first-node", type=int, default=51, help="first node number")
+    parser.add_argument("--analogue-frames", type=int, default=4, help="analogue frames per node (1-4)")
+    parser.add_argument("--changes", type=float, default=0.1, help="share of frames with a changed value")
+    parser.add_argument("--port", type=int, default=15441, help="local UDP port")
+    parser.add_argument("--runtime", choices=["threads", "asyncio"], default=config["app"]["runtime"])
+    parser.add_argument("--sample-interval", type=float, default=0.01, help="seconds between latency samples")
+    parser.add_argument("--no-dedup", action="store_true", help="disable duplicate suppression")
+    parser.add_argument("--no-batch", action="store_true", help="receive one datagram per wakeup")
+    parser.add_argument("--output", help="append results as JSON lines to this file")
+    parser.add_argument("--fhem", action="store_true", help="push readings to a local FakeFHEM")
+    parser.add_argument("--fhem-bulk", action="store_true", help="readingsBulkUpdate blocks instead of setreading")
+    parser.add_argument("--fhem-latency", type=float, default=0.0, help="FakeFHEM seconds per response")
+    parser.add_argument("--fhem-error-rate", type=float, default=0.0, help="FakeFHEM share of error responses")
+    parser.add_argument("--fhem-disconnect-rate", type=float, default=0.0, help="FakeFHEM share of dropped commands")
+    parser.add_argument("--fhem-outage", type=float, default=0.0, help="FakeFHEM outage seconds in the middle of a run")
+    args = parser.parse_args()
+
+    # a private home, the benchmark must not touch dumps, journals or rollups of a real installation
+    config["app"]["dir"] = tempfile.mkdtemp(prefix="tacoe-bench-")
+    config["data"]["save"] = 0
+    config["fhem"]["enabled"] = False
+    config["frame"]["bell"] = False
+    config["frame"]["debug"] = False
+    config["udp_server"]["batch"] = not args.no_batch
+    config["udp_server"]["dedup"] = not args.no_dedup
+
+    (config_analogue, config_digital) = writeChannelConfig(args)
+    config["sources"] = {
+        "cmi": {
+            "cmi_ip": "127.0.0.1",
+            "config_analogue": config_analogue,
+            "config_digital": config_digital,
+            "udp_port": args.port,
+        }
+    }
+
+    fake = None
+    if args.fhem:
+        from FakeFHEM import FakeFHEM
+
+        fake = FakeFHEM(
+            latency=args.fhem_latency, error_rate=args.fhem_error_rate, disconnect_rate=args.fhem_disconnect_rate
+        )
+        fake.start()
+
+        config["fhem"].update(
+            {"bulk": args.fhem_bulk, "backoff_max": 1, "enabled": True, "host": "127.0.0.1", "port": fake.port}
+        )
+
+    (udp_server, data, fhem) = startServer(args)
+
+    if fake:
+        from Bus import Bus
+
+        propagation = Propagation(data)
+        fake.on_reading = propagation.onReading
+        Bus.getInstance().subscribe(Bus.FRAME_RECEIVED, "benchmark", propagation.onFrame, queue_length=100000)
+
+    # spawned, a forked child would inherit the threads of the server
+    context = multiprocessing.get_context("spawn")
+    results = []
+
+    for rate in (int(r) for r in args.rates.split(",")):
+        before = udp_server.getStats()
+        latencies = {"getDifference": [], "getValues": []}
+        stop = threading.Event()
+        queue = context.Queue()
+
+        sampler = threading.Thread(target=sample, args=(data, stop, latencies, args.sample_interval), daemon=True)
+        generator = context.Process(target=generate, args=(args, rate, queue))
+
+        if fake:
+            fhem_before = dict(fhem.getStats())
+            fake_before = fake.getStats()
+            propagation.delays = []
+
+            if args.fhem_outage:
+                threading.Timer(args.duration / 2, fake.outage, (args.fhem_outage,)).start()
+
+        sampler.start()
+        generator.start()
+        generated = queue.get()
+        generator.join()
+
+        # let the server drain its socket buffer
+        sleep(0.5)
+        stop.set()
+        sampler.join()
+
+        if fake:
+            mismatches = waitForFHEM(data, fake, config["fhem"]["max_latency"] + 5)
+
+        after = udp_server.getStats()
+        received = (
+            after["frames"] + after["duplicates"] + after["rejected"]
+            - before["frames"] - before["duplicates"] - before["rejected"]
+        )
+
+        result = {
+            "timestamp": int(time()),
+            "revision": getRevision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "runtime": args.runtime,
+            "batch": config["udp_server"]["batch"],
+            "dedup": config["udp_server"]["dedup"],
+            "nodes": args.nodes,
+            "changes": args.changes,
+            "rate": rate,
+            "sent": generated["sent"],
+            "send_rate": generated["rate"],
+            "received": received,
+            "ingest_rate": received / generated["seconds"],
+            "duplicates": after["duplicates"] - before["duplicates"],
+            "loss": 1 - received / generated["sent"] if generated["sent"] else 0.0,
+            "kernel_drops": after["kernel_drops"] - before["kernel_drops"],
+            "latency_us": {name: percentiles(samples) for (name, samples) in latencies.items()},
+        }
+
+        if fake:
+            fhem_after = fhem.getStats()
+            fake_after = fake.getStats()
+            readings = fake_after["readings"] - fake_before["readings"]
+
+            result["fhem"] = {
+                "bulk": config["fhem"]["bulk"],
+                "latency": args.fhem_latency,
+                "error_rate": args.fhem_error_rate,
+                "disconnect_rate": args.fhem_disconnect_rate,
+                "outage": args.fhem_outage,
+                "readings": readings,
+                "readings_rate": readings / generated["seconds"],
+                "commands": fake_after["commands"] - fake_before["commands"],
+                "flushes": fhem_after["flushes"] - fhem_before["flushes"],
+                "connects": fhem_after["connects"] - fhem_before["connects"],
+                "disconnects": fhem_after["disconnects"] - fhem_before["disconnects"],
+                "reconnect_delay": fake.connected_at - fake.down_until if args.fhem_outage else None,
+                "mismatches": mismatches,
+                "delay_us": percentiles(propagation.delays),
+            }
+        results.append(result)
+        print(json.dumps(result), flush=True)
+
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(json.dumps(result) + "\n")
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -8,24 +8,42 @@ config = {
         "dir": None,
         "home": os.path.join(os.path.expanduser("~"), ".config"),
         "name": "TACoE",
+        "runtime": "threads",  # "threads" or "asyncio"
     },
+    "bus": {"queue_length": 1000},
+    # compressed history of the configured channels on disc, open chunks stay in RAM
+    # until they are sealed after samples or max_age seconds
+    "chunks": {"enabled": False, "max_age": 3600, "samples": 1024},
     "control": {
         "enabled": True,
         "prompt": " > ",
         "shell": True,
         "telnet": True,
         "telnet_host": "127.0.0.1",
+        "telnet_idle_timeout": 900,  # seconds without input before a session is closed
+        "telnet_max_sessions": 16,
         "telnet_port": 11112,
+        "watch_queue": 1000,  # pushed lines per watching session, the oldest get dropped
     },
-    "data": {"fifo_length": 100, "renew": 300, "save": 0},
+    # reload: seconds between checks of the channel config files for changes (0 disables)
+    "data": {"changes_length": 10000, "fifo_length": 100, "reload": 2, "renew": 300, "save": 0},
     "debug": {"level": logging.DEBUG, "verbose": True},
     "fhem": {
         "alias": "CMI",
+        "backoff_max": 60,  # seconds between reconnect attempts, doubled per failure
+        "bulk": False,  # one readingsBulkUpdate block per device and flush instead of a setreading per value
+        "coalesce": 1.0,  # seconds without new changes before a flush
         "createDevice": True,
         "device": "dum_cmi",
         "enabled": False,
         "group": "Heating",
         "host": "10.0.0.23",
+        # channel types flushed without coalescing, single channels can set "immediate" in their config
+        "immediate": ["digital"],
+        "keepalive": 30,  # seconds of idle time before the connection gets checked
+        "max_latency": 5.0,  # seconds from the first change to the latest flush
+        "min_interval": 0.05,  # seconds between two flushes (rate limit)
+        "pipeline": 100,  # commands written at once before reading their prompts, 1 waits for every prompt
         "port": 7072,
         "prompt": "fhem> ",
         "receiveUpdates": True,
@@ -33,10 +51,60 @@ config = {
         "timeout": 10,
     },
     "frame": {"bell": True, "debug": False},
-    "udp_server": {"cmi_ip": "10.0.0.46", "cmi_port": 5441, "udp_port": 5441},
+    # append-only frame log instead of pickle dumps, max_segments per source
+    "journal": {"enabled": False, "fsync_interval": 1.0, "max_segments": 64, "segment_size": 16777216},
+    "history": {"enabled": False, "max_samples": 1209600},  # needs numpy, max_samples per channel
+    "metrics": {"http": True, "host": "127.0.0.1", "port": 9441},  # Prometheus endpoint http://host:port/metrics
+    # seconds to collect values before their frames are sent,
+    # seconds between re-sends of unchanged frames to keep the CMI inputs alive (0 disables)
+    "outbound": {"coalesce": 0.05, "refresh": 60},
+    # min/max/avg/last per configured channel in ring buffers of [seconds per slot, slots]
+    "rollups": {"enabled": False, "resolutions": [[10, 360], [60, 1440], [900, 2976], [86400, 730]]},
+    # CMIs to receive from, first entry is the default source.
+    # every source can override udp_port, cmi_ip, cmi_port (udp_server), device (fhem),
+    # config_analogue, config_digital, chunks, dump, journal and rollups.
+    # sources sharing the same udp_port are told apart by the sender address (cmi_ip).
+    "sources": {"cmi": {}},
+    "udp_server": {
+        "arena_headroom": 1024,  # receive slots beyond fifo_length and the longest bus queue
+        "batch": True,
+        "cmi_ip": "10.0.0.46",
+        "cmi_port": 5441,
+        "dedup": True,  # frames equal to the last one of their node and frame number are dropped at ingest
+        "rcvbuf": 1048576,
+        "udp_port": 5441,
+    },
 }
 
 
+def getSources():
+    """settings of all configured sources, missing values come from the global settings
+
+    Returns:
+        dictionary: settings by source name
+    """
+    sources = {}
+
+    for i, (name, source) in enumerate(config["sources"].items()):
+        suffix = "" if i == 0 else f"_{name}"
+
+        sources[name] = {
+            "cmi_ip": config["udp_server"]["cmi_ip"],
+            "cmi_port": config["udp_server"]["cmi_port"],
+            "config_analogue": f"config_analogue{suffix}.json",
+            "config_digital": f"config_digital{suffix}.json",
+            "device": config["fhem"]["device"] + suffix,
+            "chunks": config["app"]["name"] + suffix + ".chunks",
+            "dump": config["app"]["name"] + suffix + ".dump",
+            "journal": config["app"]["name"] + suffix + ".journal",
+            "rollups": config["app"]["name"] + suffix + ".rollups",
+            "udp_port": config["udp_server"]["udp_port"],
+            **source,
+        }
+
+    return sources
+
+
 def initHomeDirectory():
     config["app"]["dir"] = f'{os.path.join(config["app"]["home"],config["app"]["name"])}'
 
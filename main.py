@@ -1,22 +1,72 @@
-from config import config
+import asyncio
+import os
+import signal
+import threading
+
+from config import config, getSources
 
 from Control import Control
 from Data import Data
 from Frame import Frame
 from FHEM import FHEM
+from Metrics import Metrics
+from Outbound import Outbound
 from UDP_Server import UDP_Server
 
+
+async def runAsync(threads):
+    """single event loop runtime, the instances are not started as threads
+
+    Args:
+        threads (dictionary): Data, UDP_Server, Control and FHEM instances
+    """
+    loop = asyncio.get_running_loop()
+    # runs as a regular callback of the loop, never inside a callback holding a lock
+    loop.add_signal_handler(signal.SIGTERM, shutdown)
+
+    for _, t in threads.items():
+        t.initialize(loop=loop)
+
+    await asyncio.gather(*[t.runAsync() for t in threads.values()])
+
+
+def shutdown():
+    """save all data and exit, e.g. on SIGTERM of systemd. never call from a signal handler,
+    the interrupted code may hold the locks needed for saving.
+    """
+    Data.saveAll()
+    os._exit(0)
+
+
 if __name__ == "__main__":
-    threads = {"data": Data.getInstance(), "udp_server": UDP_Server.getInstance()}
+    threads = {"data": Data.getInstance()}
+
+    for source in list(getSources())[1:]:
+        threads[f"data_{source}"] = Data.getInstance(source)
+
+    threads["udp_server"] = UDP_Server.getInstance()
+    threads["outbound"] = Outbound.getInstance()
 
     if config["control"]["enabled"]:
         threads["control"] = Control.getInstance()
     if config["fhem"]["enabled"]:
         threads["fhem"] = FHEM.getInstance()
+    if config["metrics"]["http"]:
+        threads["metrics"] = Metrics.getInstance()
 
-    for _, t in threads.items():
-        t.start()
-        t.initialize()
+    if config["app"]["runtime"] == "asyncio":
+        asyncio.run(runAsync(threads))
+    else:
+        # the handler only wakes the main thread, which saves outside of the signal context
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+        for _, t in threads.items():
+            t.start()
+            t.initialize()
+
+        stop.wait()
+        shutdown()
 
     # f = Frame()
     # print(f.isEmpty())
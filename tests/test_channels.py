@@ -0,0 +1,37 @@
+from Channels import ChannelTable
+
+NODE_CONFIG = {
+    "analogue": {
+        "51": {"1": {"name": "T Kollektor", "decimals": 1, "unit": "°C"}, "2": {"name": "T2"}},
+        "52": {"40": {"name": "out of range"}, "x": {"name": "invalid"}, "3": {"unit": "no name"}},
+    },
+    "digital": {"51": {"17": {"name": "Pumpe"}}},
+}
+
+
+def test_compiled_channels():
+    table = ChannelTable(NODE_CONFIG, "cmi")
+    channel = table.get("analogue", 51, 1)
+
+    assert channel.name == "T_Kollektor"
+    assert channel.divisor == 10
+    assert channel.unit == "°C"
+    assert channel.command == "setreading cmi T_Kollektor "
+    assert table.get("analogue", 51, 2).divisor == 1
+    assert table.get("digital", 51, 17).name == "Pumpe"
+
+
+def test_unknown_and_invalid_channels():
+    table = ChannelTable(NODE_CONFIG, "cmi")
+
+    assert table.get("analogue", 51, 3) is None
+    assert table.get("analogue", 53, 1) is None
+    assert table.get("analogue", 999, 1) is None
+    assert table.get("analogue", 52, 40) is None
+    assert [(c.node, c.index) for c in table.getChannels("analogue")] == [(51, 1), (51, 2), (52, 3)]
+
+
+def test_semicolons_are_escaped_for_fhem():
+    table = ChannelTable({"analogue": {"51": {"1": {"name": "a;b"}}}}, "dev;x")
+
+    assert table.get("analogue", 51, 1).command == "setreading dev;;x a;;b "
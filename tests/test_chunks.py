@@ -0,0 +1,144 @@
+import os
+import random
+
+from Channels import ChannelTable
+from Chunks import Chunk, ChunkStore, unzigzag, zigzag
+from Frame import Frame
+
+TABLE = ChannelTable({"analogue": {"51": {"1": {"name": "t1"}}}, "digital": {"51": {"3": {"name": "d3"}}}}, "dev")
+
+
+def encode(samples, digital=False):
+    chunk = Chunk(digital)
+
+    for (timestamp, value) in samples:
+        chunk.append(timestamp, value)
+
+    return list(Chunk.decode(chunk.writer.getBytes(), chunk.writer.length, chunk.first, chunk.count, digital))
+
+
+def getFrame(timestamp, value=None, state=None):
+    frame = Frame()
+
+    if value is not None:
+        frame.setValue(51, 1, value, 1, analogue=True)
+    else:
+        frame.setValue(51, 3, state, digital=True)
+
+    frame.timestamp = timestamp
+    return frame
+
+
+def test_zigzag():
+    for value in (0, 1, -1, 2, -2, 63, -64, 1 << 40, -(1 << 40)):
+        assert zigzag(value) >= 0
+        assert unzigzag(zigzag(value)) == value
+
+
+def test_analogue_round_trip_all_buckets():
+    rng = random.Random(1)
+    timestamp = 1700000000000
+    value = 500
+    samples = []
+
+    for i in range(2000):
+        # regular intervals, jitter, gaps of seconds, minutes and days
+        timestamp += rng.choice((1000, 1000, 1000 + rng.randint(-60, 60), 5000, 300000, 86400000 * 3))
+        delta = rng.choice((0, 0, rng.randint(-7, 7), rng.randint(-120, 120), rng.randint(-5000, 5000)))
+        value = min(max(value + delta, 0), 65535)
+        samples.append((timestamp, value))
+
+    assert encode(samples) == samples
+
+
+def test_digital_round_trip():
+    rng = random.Random(2)
+    samples = [(1000 * i, rng.choice((0, 0, 0, rng.randint(0, 65535)))) for i in range(500)]
+
+    assert encode(samples, digital=True) == samples
+
+
+def test_single_sample():
+    assert encode([(123, 65535)]) == [(123, 65535)]
+
+
+def test_store_reads_sealed_queued_and_open_chunks(tmp_path):
+    store = ChunkStore(str(tmp_path / "TACoE.chunks"), TABLE, samples=4)
+
+    for i in range(10):
+        store.add(getFrame(1000 + i, value=i))
+
+    # two full chunks wait for write(), the open one has two samples
+    assert store.getStats()["queued"] == 2
+    assert [v for (_, v) in store.read(0, 51, 1)] == list(range(0, 100, 10))
+
+    store.write()
+
+    assert store.getStats()["queued"] == 0
+    assert store.getStats()["chunks"] == 2
+    assert list(store.read(0, 51, 1, 1003, 1005)) == [(1003.0, 30), (1004.0, 40), (1005.0, 50)]
+
+
+def test_store_digital_words(tmp_path):
+    store = ChunkStore(str(tmp_path / "TACoE.chunks"), TABLE)
+    store.add(getFrame(1000, state=True))
+    store.add(getFrame(1001, state=False))
+
+    assert [word >> 2 & 1 for (_, word) in store.read(1, 51, 0)] == [1, 0]
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    filename = str(tmp_path / "TACoE.chunks")
+    store = ChunkStore(filename, TABLE, samples=4)
+
+    for i in range(8):
+        store.add(getFrame(1000 + i, value=i))
+    store.write()
+
+    size = os.path.getsize(filename)
+    with open(filename, "ab") as f:
+        f.write(ChunkStore.headerStruct.pack(0, 51, 1, 2000, 2003, 4, 200) + b"\x00" * 3)
+
+    store = ChunkStore(filename, TABLE, samples=4)
+
+    assert os.path.getsize(filename) == size
+    assert [v for (_, v) in store.read(0, 51, 1)] == list(range(0, 80, 10))
+
+
+def test_open_chunks_survive_a_restart(tmp_path):
+    filename = str(tmp_path / "TACoE.chunks")
+    store = ChunkStore(filename, TABLE, samples=4)
+
+    for i in range(6):
+        store.add(getFrame(1000 + i, value=i))
+    store.save()
+
+    store = ChunkStore(filename, TABLE, samples=4)
+
+    assert [v for (_, v) in store.read(0, 51, 1)] == list(range(0, 60, 10))
+
+    # the continued chunk gets sealed with its first samples
+    for i in range(6, 8):
+        store.add(getFrame(1000 + i, value=i))
+    store.write()
+
+    assert store.getStats()["chunks"] == 2
+    assert [v for (_, v) in store.read(0, 51, 1)] == list(range(0, 80, 10))
+
+
+def test_open_chunks_already_sealed_are_skipped(tmp_path):
+    filename = str(tmp_path / "TACoE.chunks")
+    store = ChunkStore(filename, TABLE, samples=4)
+
+    for i in range(2):
+        store.add(getFrame(1000 + i, value=i))
+    store.save()
+
+    # sealed and written after the save, e.g. before a crash
+    for i in range(2, 4):
+        store.add(getFrame(1000 + i, value=i))
+    store.write()
+
+    store = ChunkStore(filename, TABLE, samples=4)
+
+    assert [v for (_, v) in store.read(0, 51, 1)] == [0, 10, 20, 30]
@@ -0,0 +1,122 @@
+import pytest
+
+from Channels import ChannelTable
+from config import config
+from Data import Data
+from Frame import Frame
+
+NODE_CONFIG = {
+    "analogue": {"51": {"1": {"name": "t1", "decimals": 1}, "2": {"name": "t2", "decimals": 1}}},
+    "digital": {"51": {"3": {"name": "d3"}}},
+}
+
+
+@pytest.fixture
+def data(monkeypatch):
+    monkeypatch.setitem(config["data"], "changes_length", 4)
+    monkeypatch.setattr(Data, "_Data__instances", {})
+
+    data = Data.getInstance()
+    data.channels = ChannelTable(NODE_CONFIG, "dev")
+    return data
+
+
+def addAnalogues(data, *values):
+    frame = Frame()
+
+    for (index, value) in enumerate(values, 1):
+        frame.setValue(51, index, value, 1, analogue=True)
+
+    data.addFrame(frame)
+
+
+def test_changes_after_sequence_number(data):
+    addAnalogues(data, 1.0, 2.0, 3.0, 4.0)
+    (changed, seq) = data.getChanges(None, "analogue")
+
+    assert set(changed) == {(51, 1), (51, 2), (51, 3), (51, 4)}
+    assert seq == 4
+    assert data.getChanges(seq, "analogue") == ({}, 4)
+
+    # unchanged values get no new sequence number
+    addAnalogues(data, 1.0, 2.5, 3.0, 4.0)
+    (changed, seq) = data.getChanges(seq, "analogue")
+
+    assert list(changed) == [(51, 2)]
+    assert changed[(51, 2)][2] == 25
+    assert seq == 5
+
+
+def test_overrun_change_log_returns_all_values(data):
+    addAnalogues(data, 1.0, 2.0, 3.0, 4.0)
+    (_, seq) = data.getChanges(None, "analogue")
+
+    for i in range(2):
+        addAnalogues(data, 10.0 + i, 20.0 + i, 30.0 + i, 40.0 + i)
+
+    (changed, seq) = data.getChanges(seq, "analogue")
+
+    assert len(changed) == 4
+    assert seq == 12
+
+
+def test_consumers_do_not_steal_changes(data):
+    addAnalogues(data, 1.0, 2.0, 3.0, 4.0)
+
+    assert data.getDifference(analogue=True, consumer="a") == [["51", "1", 1.0, 1.0], ["51", "2", 2.0, 2.0]]
+    assert data.getDifference(analogue=True, consumer="a") == []
+
+    addAnalogues(data, 1.5, 2.0, 3.0, 4.0)
+
+    assert data.getDifference(analogue=True, consumer="a") == [["51", "1", 1.5, 1.0]]
+    assert len(data.getDifference(analogue=True, consumer="b")) == 2
+    assert data.getDifference(analogue=True, consumer="b") == []
+
+
+def test_removed_consumer_starts_again(data):
+    addAnalogues(data, 1.0, 2.0, 3.0, 4.0)
+    data.getDifference(analogue=True, consumer="a")
+    data.removeConsumer("a")
+
+    assert len(data.getDifference(analogue=True, consumer="a")) == 2
+
+
+def test_unchanged_values_are_renewed(data, monkeypatch):
+    addAnalogues(data, 1.0, 2.0, 3.0, 4.0)
+    data.getDifference(analogue=True)
+
+    monkeypatch.setitem(config["data"], "renew", -1)
+
+    assert data.getDifference(analogue=True) == [["51", "1", 1.0, 1.0], ["51", "2", 2.0, 2.0]]
+
+
+def test_digital_changes(data):
+    frame = Frame()
+    frame.setValue(51, 3, True, digital=True)
+    data.addFrame(frame)
+
+    assert data.getDifference(digital=True) == [["51", "3", True, True]]
+
+    frame = Frame()
+    frame.setValue(51, 3, False, digital=True)
+    data.addFrame(frame)
+
+    assert data.getDifference(digital=True) == [["51", "3", False, True]]
+
+
+def test_missing_config_file_keeps_the_other_type(data, monkeypatch, tmp_path):
+    (tmp_path / "analogue.json").write_text('{"51": {"1": {"name": "t1"}}}')
+    monkeypatch.setitem(config["app"], "cwd", str(tmp_path))
+    monkeypatch.setitem(data.source_config, "config_analogue", "analogue.json")
+    monkeypatch.setitem(data.source_config, "config_digital", "digital.json")
+
+    data.readConfig()
+
+    assert data.channels.get("analogue", 51, 1).name == "t1"
+    assert data.channels.getChannels("digital") == []
+
+    # invalid files keep the current tables
+    (tmp_path / "digital.json").write_text("{")
+    data.readConfig()
+
+    assert data.channels.get("analogue", 51, 1).name == "t1"
@@ -0,0 +1,81 @@
+import pytest
+
+from config import config
+from FakeFHEM import FakeFHEM
+from FHEM import FHEM
+
+
+@pytest.fixture
+def fhem(monkeypatch):
+    monkeypatch.setattr(FHEM, "_FHEM__instance", None)
+    return FHEM.getInstance()
+
+
+@pytest.fixture
+def server():
+    server = FakeFHEM()
+    server.execute("define dev dummy")
+    yield server
+    server.server.close()
+
+
+def test_bulk_update_round_trip(fhem, server):
+    readings = [("a;b", "1;2"), ("q'x", "v;;w"), ("back\\slash", "$x @y")]
+
+    assert server.execute(fhem.getBulkUpdateCommand("dev", readings)) == ""
+    assert {reading: value for ((_, reading), (value, _)) in server.readings.items()} == dict(readings)
+
+
+def test_command_lines_are_split_at_single_semicolons(server):
+    assert server.execute("setreading dev a 1;setreading dev b 2;;3") == ""
+    assert server.readings[("dev", "a")][0] == "1"
+    assert server.readings[("dev", "b")][0] == "2;3"
+
+
+class DroppingFHEM(FakeFHEM):
+    """accepts connections and answers the prompt, but drops the connection on every command"""
+
+    def execute(self, line):
+        if line.strip():
+            raise OSError("dropped")
+        return super().execute(line)
+
+
+def connectTo(server, monkeypatch):
+    monkeypatch.setitem(config["fhem"], "host", "127.0.0.1")
+    monkeypatch.setitem(config["fhem"], "port", server.port)
+    server.start()
+
+
+def test_connection_dropped_on_commands_backs_off(fhem, monkeypatch):
+    server = DroppingFHEM()
+    connectTo(server, monkeypatch)
+
+    for backoff in (1, 2, 4):
+        con = fhem.connect()
+        assert con
+
+        with pytest.raises((OSError, EOFError)):
+            list(fhem.execute(con, "setreading dev a 1"))
+        fhem.disconnect(EOFError("dropped"))
+
+        assert fhem.backoff == backoff
+        assert fhem.connect() is None
+
+        # skip the wait
+        fhem.reconnect_at = 0
+
+    server.server.close()
+
+
+def test_acknowledged_command_resets_the_backoff(fhem, server, monkeypatch):
+    connectTo(server, monkeypatch)
+    fhem.backoff = 8
+
+    con = fhem.connect()
+    assert fhem.backoff == 8
+
+    list(fhem.execute(con, "setreading dev a 1"))
+    assert fhem.backoff == 0
+
+    fhem.closeConnection(con)
@@ -0,0 +1,45 @@
+from Frame import Frame
+from History import Channel, History
+
+
+def test_channel_grows_and_drops_the_oldest_quarter():
+    channel = Channel(8, capacity=2)
+
+    for i in range(10):
+        channel.append(float(i), i, 1)
+
+    (timestamps, raw) = channel.getRange(None, None)
+
+    assert raw.tolist() == [2, 3, 4, 5, 6, 7, 8, 9]
+    assert timestamps.tolist() == [float(i) for i in range(2, 10)]
+
+
+def test_channel_range_and_as_of():
+    channel = Channel(100)
+
+    for i in range(10):
+        channel.append(100.0 + i, i * 10, 1)
+
+    assert channel.getRange(102, 104)[1].tolist() == [20, 30, 40]
+    assert channel.getAsOf(104.5) == (104.0, 40, 1)
+    assert channel.getAsOf(99) is None
+
+
+def test_history_of_frames():
+    history = History(100)
+
+    for i in range(3):
+        frame = Frame()
+        frame.setValue(51, 2, 20 + i, 1, analogue=True)
+        frame.timestamp = 100.0 + i
+        history.add(frame)
+
+    frame = Frame()
+    frame.setValue(51, 3, True, digital=True)
+    frame.timestamp = 101.0
+    history.add(frame)
+
+    assert history.getRange("analogue", 51, 2)[1].tolist() == [200, 210, 220]
+    assert history.getRange("analogue", 51, 9)[1].tolist() == []
+    assert history.getAsOf(101.5, "analogue")[(51, 2)] == (101.0, 210, 1)
+    assert history.getAsOf(101.5, "digital")[(51, 3)][1] == 1
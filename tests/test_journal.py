@@ -0,0 +1,100 @@
+import os
+
+from Frame import Frame
+from Journal import Journal
+
+
+def getFrames(count):
+    frames = []
+
+    for i in range(count):
+        frame = Frame()
+        frame.setValue(51, 1 + i % 4, i / 10, 1, analogue=True)
+        frame.timestamp = 1000.0 + i
+        frames.append(frame)
+
+    return frames
+
+
+def restore(directory):
+    journal = Journal(directory, "cmi", 0)
+    frames = []
+    journal.restore(frames.append)
+
+    return (journal, frames)
+
+
+def test_round_trip(tmp_path):
+    journal = Journal(str(tmp_path), "cmi", 3)
+    journal.restore(lambda frame: None)
+    frames = getFrames(10)
+    journal.write([(frame.timestamp, frame.getData()) for frame in frames])
+    journal.closeSegment()
+
+    (journal, restored) = restore(str(tmp_path))
+
+    assert [(f.timestamp, f.getData()) for f in restored] == [(f.timestamp, f.getData()) for f in frames]
+    assert {f.source for f in restored} == {"cmi"}
+    assert journal.getStats()["torn"] == 0
+
+
+def test_segments_rotate_and_expire(tmp_path):
+    journal = Journal(str(tmp_path), "cmi", 0, segment_size=Journal.recordLength * 4, max_segments=2)
+    journal.restore(lambda frame: None)
+    frames = getFrames(10)
+    journal.write([(frame.timestamp, frame.getData()) for frame in frames])
+    journal.closeSegment()
+
+    assert journal.getSegmentNumbers() == [2, 3]
+
+    (_, restored) = restore(str(tmp_path))
+
+    assert [f.timestamp for f in restored] == [f.timestamp for f in frames[4:]]
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    journal = Journal(str(tmp_path), "cmi", 0)
+    journal.restore(lambda frame: None)
+    frames = getFrames(5)
+    journal.write([(frame.timestamp, frame.getData()) for frame in frames])
+    journal.closeSegment()
+
+    filename = journal.getSegmentFilename(1)
+    with open(filename, "ab") as f:
+        f.write(b"\x01" * (Journal.recordLength // 2))
+
+    (journal, restored) = restore(str(tmp_path))
+
+    assert len(restored) == 5
+    assert journal.getStats()["torn"] == 1
+    assert os.path.getsize(filename) == 5 * Journal.recordLength
+
+
+def test_corrupted_record_ends_the_segment(tmp_path):
+    journal = Journal(str(tmp_path), "cmi", 0)
+    journal.restore(lambda frame: None)
+    journal.write([(frame.timestamp, frame.getData()) for frame in getFrames(5)])
+    journal.closeSegment()
+
+    filename = journal.getSegmentFilename(1)
+    with open(filename, "r+b") as f:
+        f.seek(2 * Journal.recordLength + 9)
+        f.write(b"\xff")
+
+    (_, restored) = restore(str(tmp_path))
+
+    assert len(restored) == 2
+    assert os.path.getsize(filename) == 2 * Journal.recordLength
+
+
+def test_appended_frames_are_written_by_the_thread(tmp_path):
+    journal = Journal(str(tmp_path), "cmi", 0, fsync_interval=0.01)
+    journal.restore(lambda frame: None)
+    journal.start()
+
+    for frame in getFrames(3):
+        journal.append(frame)
+    journal.flush()
+
+    assert journal.getStats()["records"] == 3
+    assert len(restore(str(tmp_path))[1]) == 3
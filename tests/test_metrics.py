@@ -0,0 +1,79 @@
+import json
+import threading
+
+import pytest
+
+from Metrics import Metrics
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    monkeypatch.setattr(Metrics, "_Metrics__instance", None)
+    return Metrics.getInstance()
+
+
+def test_counter_threads_lose_no_updates(metrics):
+    counter = metrics.counter("test_total", "test")
+
+    def work():
+        for _ in range(10000):
+            counter.inc()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert counter.getValue() == 80000
+
+
+def test_same_name_and_labels_is_the_same_metric(metrics):
+    a = metrics.counter("test_total", "test", {"source": "cmi", "type": "a"})
+
+    assert metrics.counter("test_total", "test", {"type": "a", "source": "cmi"}) is a
+    assert metrics.counter("test_total", "test", {"source": "cmi2", "type": "a"}) is not a
+
+
+def test_callbacks_are_read_when_collected(metrics):
+    stats = {"frames": 1}
+    metrics.counter("frames_total", "frames", callback=lambda: stats["frames"])
+    metrics.gauge("queued", "queued", callback=lambda: 1 / 0)
+    stats["frames"] = 5
+
+    assert metrics.getStats() == {"frames_total": 5}
+
+
+def test_histogram(metrics):
+    histogram = metrics.histogram("latency_seconds", "latency", {"stage": "a"}, buckets=(0.1, 1))
+
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value)
+
+    assert histogram.getValue() == ([(0.1, 2), (1, 3), (float("inf"), 4)], 2.65, 4)
+    assert metrics.getStats()["latency_seconds{stage=a}"] == {"avg": 2.65 / 4, "count": 4, "sum": 2.65}
+
+
+def test_exposition(metrics):
+    metrics.counter("frames_total", "received frames", {"source": 'c"mi'}).inc(3)
+    metrics.histogram("latency_seconds", "latency", buckets=(0.5,)).observe(0.25)
+
+    assert metrics.getExposition().splitlines() == [
+        "# HELP tacoe_frames_total received frames",
+        "# TYPE tacoe_frames_total counter",
+        'tacoe_frames_total{source="c\\"mi"} 3',
+        "# HELP tacoe_latency_seconds latency",
+        "# TYPE tacoe_latency_seconds histogram",
+        'tacoe_latency_seconds_bucket{le="0.5"} 1',
+        'tacoe_latency_seconds_bucket{le="+Inf"} 1',
+        "tacoe_latency_seconds_sum 0.25",
+        "tacoe_latency_seconds_count 1",
+    ]
+
+
+def test_responses(metrics):
+    metrics.gauge("queued", "queued").set(2)
+
+    assert metrics.getResponse("/metrics?x=1")[0] == 200
+    assert json.loads(metrics.getResponse("/stats")[2]) == {"queued": 2}
+    assert metrics.getResponse("/")[0] == 404
@@ -0,0 +1,111 @@
+import pytest
+
+from config import config
+from Outbound import Outbound
+
+
+class FakeServer(object):
+    def __init__(self):
+        self.error = None
+        self.sent = []
+
+    def sendFrame(self, frame, source):
+        if self.error:
+            raise self.error
+        self.sent.append((source, frame))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("Outbound.time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def outbound(monkeypatch, clock):
+    monkeypatch.setattr(Outbound, "_Outbound__instance", None)
+    monkeypatch.setitem(config["outbound"], "refresh", 60)
+
+    outbound = Outbound.getInstance()
+    outbound.udp_server = FakeServer()
+    return outbound
+
+
+def test_values_of_a_frame_are_coalesced(outbound):
+    outbound.setValues([(41, 1, 1.5, 1, True, False), (41, 2, 2.5, 1, True, False)])
+    outbound.setValue(41, 3, 3.5, 1, analogue=True)
+    outbound.setValue(41, 5, 5.5, 1, analogue=True)
+    outbound.flush()
+
+    sent = {frame.rawData[1]: frame for (_, frame) in outbound.udp_server.sent}
+
+    assert len(sent) == 2
+    assert [v[2] for v in sent[1].getAnalogues()] == [15, 25, 35, 0]
+    assert [v[2] for v in sent[2].getAnalogues()] == [55, 0, 0, 0]
+    assert outbound.getStats()["frames"] == 2
+    assert outbound.getStats()["values"] == 4
+
+    outbound.flush()
+
+    assert len(outbound.udp_server.sent) == 2
+
+
+def test_changes_keep_the_other_values_of_a_frame(outbound):
+    outbound.setValue(41, 1, True, digital=True)
+    outbound.flush()
+    outbound.setValue(41, 2, True, digital=True)
+    outbound.setValue(41, 1, False, digital=True)
+    outbound.flush()
+
+    frame = outbound.udp_server.sent[-1][1]
+
+    assert [v[2] for v in frame.getDigitals()[:3]] == [False, True, False]
+
+
+def test_invalid_values_queue_nothing(outbound):
+    with pytest.raises(ValueError):
+        outbound.setValues([(41, 1, 1.5, 1, True, False), (41, 2, 99999, 1, True, False)])
+
+    assert outbound.getStats()["pending"] == 0
+
+    with pytest.raises(ValueError):
+        outbound.setValue(41, 1, 1, analogue=True, source="unknown")
+
+
+def test_refreshes_are_staggered(outbound, clock):
+    for node in (41, 42, 43):
+        outbound.setValue(node, 1, 1.0, 1, analogue=True)
+    outbound.flush()
+
+    assert sorted(outbound.due.values()) == [1020.0, 1040.0, 1060.0]
+    assert outbound.getTimeout() == 20.0
+
+    clock[0] = 1030.0
+    outbound.flush()
+
+    assert len(outbound.udp_server.sent) == 4
+    assert outbound.getStats()["refreshes"] == 1
+
+
+def test_a_change_resets_the_refresh(outbound, clock):
+    outbound.setValue(41, 1, 1.0, 1, analogue=True)
+    outbound.flush()
+
+    clock[0] = 1030.0
+    outbound.setValue(41, 1, 2.0, 1, analogue=True)
+    outbound.flush()
+
+    clock[0] = 1070.0
+    outbound.flush()
+
+    assert outbound.getStats()["refreshes"] == 0
+    assert outbound.getTimeout() == 20.0
+
+
+def test_send_errors_are_counted(outbound):
+    outbound.udp_server.error = OSError("unreachable")
+    outbound.setValue(41, 1, 1.0, 1, analogue=True)
+    outbound.flush()
+
+    assert outbound.getStats()["errors"] == 1
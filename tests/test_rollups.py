@@ -0,0 +1,77 @@
+import pytest
+
+from Channels import ChannelTable
+from Frame import Frame
+from Rollups import Archive, Rollups
+
+TABLE = ChannelTable({"analogue": {"51": {"1": {"name": "t1"}}}, "digital": {"51": {"3": {"name": "d3"}}}}, "dev")
+
+
+def getFrame(timestamp, value):
+    frame = Frame()
+    frame.setValue(51, 1, value, 1, analogue=True)
+    frame.timestamp = timestamp
+    return frame
+
+
+def test_archive_aggregates_slots():
+    archive = Archive(10, 4)
+
+    for (timestamp, value) in ((100, 5), (105, 3), (109, 8), (110, 1)):
+        archive.add(timestamp, value)
+
+    assert archive.getRange(None, None) == [(100, 3, 8, 16, 8, 3), (110, 1, 1, 1, 1, 1)]
+    assert archive.getRange(110, None) == [(110, 1, 1, 1, 1, 1)]
+
+
+def test_archive_ring_reuses_stale_slots():
+    archive = Archive(10, 2)
+
+    for timestamp in (100, 110, 120):
+        archive.add(timestamp, timestamp)
+
+    assert [row[0] for row in archive.getRange(None, None)] == [110, 120]
+
+    # values older than the slot are dropped
+    archive.add(100, 0)
+    assert [row[0] for row in archive.getRange(None, None)] == [110, 120]
+
+
+def test_configured_channels_only(tmp_path):
+    rollups = Rollups(str(tmp_path / "TACoE.rollups"), TABLE, [[10, 6], [60, 2]])
+
+    for i in range(12):
+        rollups.add(getFrame(600 + i * 5, 20 + i))
+
+    assert rollups.getStats()["channels"] == 1
+    assert rollups.getRange("analogue", 51, 2, 10) == []
+    assert [row[5] for row in rollups.getRange("analogue", 51, 1, 60)] == [12]
+    assert len(rollups.getRange("analogue", 51, 1, 10)) == 6
+
+    with pytest.raises(ValueError):
+        rollups.getRange("analogue", 51, 1, 30)
+
+
+def test_save_and_restore(tmp_path):
+    filename = str(tmp_path / "TACoE.rollups")
+    rollups = Rollups(filename, TABLE, [[10, 6]])
+    rollups.add(getFrame(600, 20))
+    rollups.save()
+
+    restored = Rollups(filename, TABLE, [[10, 6]])
+    restored.restore()
+    assert restored.getRange("analogue", 51, 1, 10) == rollups.getRange("analogue", 51, 1, 10)
+
+    # other resolutions start empty
+    changed = Rollups(filename, TABLE, [[60, 6]])
+    changed.restore()
+    assert changed.getStats()["channels"] == 0
+
+
+def test_reloaded_table_applies(tmp_path):
+    rollups = Rollups(str(tmp_path / "TACoE.rollups"), TABLE, [[10, 6]])
+    rollups.table = ChannelTable({"analogue": {"51": {"2": {"name": "t2"}}}}, "dev")
+    rollups.add(getFrame(600, 20))
+
+    assert rollups.getRange("analogue", 51, 1, 10) == []
+    assert rollups.getStats()["channels"] == 1
@@ -0,0 +1,88 @@
+import pytest
+
+from config import config
+from Data import Data
+from Frame import Frame
+from UDP_Server import UDP_Server
+
+
+class FakeBus(object):
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, frame):
+        self.published.append(frame)
+
+
+@pytest.fixture
+def data(monkeypatch, tmp_path):
+    monkeypatch.setattr(Data, "_Data__instances", {})
+
+    data = Data.getInstance()
+    monkeypatch.setattr(data, "getDumpFilename", lambda: tmp_path / "frames.pickle")
+    return data
+
+
+@pytest.fixture
+def server(monkeypatch, data):
+    monkeypatch.setattr(UDP_Server, "_UDP_Server__instance", None)
+    monkeypatch.setitem(config["udp_server"], "dedup", True)
+
+    for attribute in ("last_payloads", "last_seen", "received_at", "routes"):
+        monkeypatch.setattr(UDP_Server, attribute, {})
+
+    monkeypatch.setattr(UDP_Server, "stats", dict(UDP_Server.stats, duplicates=0, frames=0, rejected=0, sources={}))
+
+    server = UDP_Server.getInstance()
+    server.bus = FakeBus()
+    server.data = {data.source: data}
+    data.udp_server = server
+    yield server
+    server.send_socket.close()
+
+
+def payload(node, number, value):
+    frame = Frame()
+    frame.setValue(node, number * 4 - 3, value, 1, analogue=True)
+    return bytes(frame.rawData)
+
+
+def test_identical_payload_is_suppressed(server, monkeypatch):
+    monkeypatch.setattr("UDP_Server.time", lambda: 1000.0)
+    assert server.ingest(payload(51, 1, 1.5)) is not None
+
+    monkeypatch.setattr("UDP_Server.time", lambda: 1010.0)
+    assert server.ingest(payload(51, 1, 1.5)) is None
+
+    stats = server.getStats()
+    assert stats["frames"] == 1
+    assert stats["duplicates"] == 1
+    assert stats["suppressed"] == 0.5
+    assert len(server.bus.published) == 1
+
+    # the suppressed duplicate still counts as sign of life of its slot
+    assert server.getLastSeen() == {(51, 1): 1010.0}
+
+
+def test_changed_payload_passes(server):
+    server.ingest(payload(51, 1, 1.5))
+    frame = server.ingest(payload(51, 1, 2.5))
+
+    assert frame is not None
+    assert frame.getAnalogues()[0][2] == 25
+    assert server.getStats()["duplicates"] == 0
+    assert len(server.bus.published) == 2
+
+
+def test_clean_frames_lets_the_next_frame_of_every_slot_pass(server, data):
+    server.ingest(payload(51, 1, 1.5))
+    server.ingest(payload(51, 2, 2.5))
+    server.ingest(payload(52, 1, 3.5))
+
+    data.cleanFrames()
+
+    assert server.ingest(payload(51, 1, 1.5)) is not None
+    assert server.ingest(payload(51, 2, 2.5)) is not None
+    assert server.ingest(payload(52, 1, 3.5)) is not None
+    assert server.getStats()["duplicates"] == 0
+    assert server.getStats()["frames"] == 6